@@ -7,32 +7,41 @@ from pathlib import Path
 import signal
 from datetime import datetime
 from functools import partial
-from typing import List
+from typing import List, Tuple
 
 from services.application_service import ApplicationService
+from services.worker_service import WorkerService
 from domain.logger import Logger, LoggerType
 from domain.llm_utils import LLMUtils
+from domain.segmenter import TokenBudgetSegmenter
+from domain.near_duplicates import MinHashIndex
+from infrastructure.executors import get_executor_names
+from infrastructure.language_detector import TargetLanguageFilter
 
 logger: Logger = Logger(LoggerType.INFO)
 application_service: ApplicationService = None
+worker_service: WorkerService = None
+grace_period: float = 60
+stop_requests: int = 0
 
-# def signal_handler(sig, frame):
-#     logger.log_error('Request to stop the program!')
-#     if application_service is not None:
-#         logger.log_warn('Trying emergency save before exiting!')
-#         application_service.emergency_save()
-#     else:
-#         logger.log_warn('No emergency save possible before exiting!')
-#     logger.log_warn('Exiting')
-#     sys.exit(0)
-
-# signal.signal(signal.SIGINT,    signal_handler)
-# signal.signal(signal.SIGABRT,   signal_handler)
-# signal.signal(signal.SIGSEGV,   signal_handler)
-# signal.signal(signal.SIGTERM,   signal_handler)
-# signal.signal(signal.SIGILL,    signal_handler)
+def signal_handler(sig, frame):
+    # First signal: stop dispatching, let the requests in flight finish and save a partial document.
+    # Second signal: abort immediately.
+    # Only flags are set here: the request is logged by the processing loops, or by main when it came before processing.
+    global stop_requests
+    stop_requests += 1
+    if stop_requests > 1:
+        os._exit(1)
+    if worker_service is not None:
+        worker_service.request_drain(grace_period)
+    elif application_service is not None:
+        application_service.request_drain(grace_period)
+
+signal.signal(signal.SIGINT,    signal_handler)
+signal.signal(signal.SIGTERM,   signal_handler)
 
 def main() -> None:
+    global logger, application_service, grace_period
     program_name = os.path.basename(sys.argv[0])
     paragraph_start_min_word_numbers: int = 1
     paragraph_start_min_word_length: int = 3
@@ -49,6 +58,25 @@ def main() -> None:
     use_debugger_ai: bool = False
     csv_ = partial(str.split, sep=',')
     context_path: str = None
+    executor: str = None
+    work_item_store: str = None
+    resume: bool = False
+    journal_path: str = None
+    job_store_path: str = None
+    max_request_tokens: int = TokenBudgetSegmenter.DEFAULT_MAX_REQUEST_TOKENS
+    json_tables: bool = False
+    extraction_cache_path: str = None
+    batch_slides: bool = False
+    slide_partitions: int = 1
+    batch_cells: bool = False
+    cell_ranges: List = []
+    prefilter: bool = False
+    prefilter_patterns: List = []
+    skip_target_language: bool = False
+    target_language_confidence: float = TargetLanguageFilter.DEFAULT_MIN_CONFIDENCE
+    translation_memory_path: str = None
+    near_duplicates: bool = False
+    near_duplicate_threshold: float = MinHashIndex.DEFAULT_THRESHOLD
     debug: bool = True
     if debug:
         #engine="gpt-4"
@@ -61,9 +89,9 @@ def main() -> None:
     logger = Logger(logger_type)
     llm_utils: LLMUtils = LLMUtils(os.getenv("MAGIC_ADDITIONAL_REQUEST", default=""), from_language, logger)
     parser = argparse.ArgumentParser(prog=program_name)
-    parser.add_argument('--from_document', type=str, help='Specify the document to open: If document name ends with doc(x), consider a Microsoft Word document, consider PowerPoint if document name ends with ppt(x).', required=required_parameters_activation)
+    parser.add_argument('--from_document', type=str, help='Specify the document to open: If document name ends with doc(x), consider a Microsoft Word document, consider PowerPoint if document name ends with ppt(x), Excel if it ends with xls(x), Markdown if it ends with md, plain text if it ends with txt and CSV if it ends with csv or tsv.', required=required_parameters_activation)
     parser.add_argument('--to_document', type=str, help='Specify the document to save', required=False)
-    parser.add_argument('--transformation', type=int, help=f'Specify one transformation request to process from the following list: [[ {llm_utils.get_all_requests_and_ids_str()} ]]')
+    parser.add_argument('--transformation', type=csv_, help=f'Specify one transformation request, or several comma separated ones each producing its own document from a single extraction, to process from the following list: [[ {llm_utils.get_all_requests_and_ids_str()} ]]')
     parser.add_argument('--skip_slides', type=csv_, help='For ppt(x) documents only: Specify slides to skip: 1,2-5,8: Cannot be used with only_slides')
     parser.add_argument('--only_slides', type=csv_, help='For ppt(x) documents only: Specify slides to keep: 1,2-5,8: Cannot be used with skip_slides')
     parser.add_argument('--context_path', type=str, help='Path to a text file (whatever extension) where the contect of the document is described. If not orovided, headings will be used as context.')
@@ -75,7 +103,27 @@ def main() -> None:
     parser.add_argument('--debug', action="store_true", help='Set logging to debug')
     parser.add_argument('--trace', action="store_true", help='Set logging to trace')
     parser.add_argument('--max_number_threads', type=int, help=f'Specify the maximum number of parallel thread (Default {max_number_threads})', required=False)
-    parser.add_argument('--language', type=str, help='Specify the language of your text', required=False)
+    parser.add_argument('--executor', type=str, choices=get_executor_names(), help='Executor backend sending the requests to the LLM, --max_number_threads defines its number of parallel requests (Default: serial with 1 thread, legacy threads otherwise)', required=False)
+    parser.add_argument('--work_item_store', type=str, help='Path of a local SQLite file where pending work items are spilled to keep memory bounded on very large documents (Default for txt, md and csv documents without --near_duplicates: <to_document>.work_items. Not supported by the legacy multithreaded processor: use --executor)', required=False)
+    parser.add_argument('--journal', type=str, help='Path of the journal checkpointing every LLM response (Default: <to_document>.journal, removed once the document is saved)', required=False)
+    parser.add_argument('--resume', action="store_true", help='Replay the responses of the journal of an interrupted run into the document and only send the missing segments to the LLM')
+    parser.add_argument('--grace_period', type=float, help=f'On SIGINT/SIGTERM, number of seconds given to the requests in flight to complete before saving a partial document (Default {grace_period}). The serial executor always completes its request in flight', required=False)
+    parser.add_argument('--job_store', type=str, help='Run as coordinator: path of a SQLite job store, typically on shared storage, where requests are published for `transform_document worker --job_store <path>` processes. The document is saved once all their responses are applied', required=False)
+    parser.add_argument('--max_request_tokens', type=int, help=f'Approximate number of tokens per request: for doc(x) documents larger sections are split on paragraph boundaries and consecutive small sections are merged, for doc(x) and ppt(x) documents larger tables are sent as row groups repeating the header. 0 sends one request per section or table (Default {max_request_tokens})', required=False)
+    parser.add_argument('--table_json', action="store_true", help='For doc(x) and ppt(x) documents: send tables as JSON arrays of rows, using structured outputs when the LLM endpoint supports them. Rows and columns of the response are validated and only missing or malformed cells are requested again', required=False)
+    parser.add_argument('--extraction_cache', type=str, help='Directory where the segments extracted from the input document are cached: further runs on the same file with the same extraction options (paragraph_start_min_word_*, slides, context, max_request_tokens, table_json) skip the extraction', required=False)
+    parser.add_argument('--batch_slides', action="store_true", help='For ppt(x) documents only: send the text shapes of each slide in one request as a JSON object keyed by shape id, within --max_request_tokens. Shapes missing from the response are requested one by one. Titles and tables keep their own requests', required=False)
+    parser.add_argument('--slide_partitions', type=int, help='For ppt(x) documents only: split the slides in this number of contiguous partitions, each one parsed, transformed and updated by its own process. --max_number_threads is shared between the partitions. Not supported with --job_store, --work_item_store, --extraction_cache and --resume (Default 1: no partition)', required=False)
+    parser.add_argument('--batch_cells', action="store_true", help='For xls(x) documents only: send consecutive cells of a column (or the cells of each range of --cell_ranges) in one request as a JSON object keyed by cell coordinate, within --max_request_tokens. Cells missing from the response are requested one by one', required=False)
+    parser.add_argument('--cell_ranges', type=csv_, help="For xls(x) documents only: Specify the cell ranges to process: Sheet1!A2:A5000,'Other sheet'!B:C,D2:D10 (without sheet name: all sheets)", required=False)
+    parser.add_argument('--prefilter', action="store_true", help='Classify all extracted segments before sending them: segments with too few letters or made only of a number, URL, email, date, code or path are kept unchanged without LLM call', required=False)
+    parser.add_argument('--prefilter_pattern', type=str, action="append", help='With --prefilter: additional regular expression of segments to keep unchanged when they match entirely, can be repeated', required=False)
+    parser.add_argument('--skip_target_language', action="store_true", help='For translations: identify the language of every segment offline and keep unchanged the segments already in the target language', required=False)
+    parser.add_argument('--target_language_confidence', type=float, help=f'With --skip_target_language: minimum probability of the target language for a segment to be skipped (Default {target_language_confidence})', required=False)
+    parser.add_argument('--translation_memory', type=str, help='For translations: path of a SQLite translation memory storing the translated sentences across runs. Segments made only of known sentences are assembled without LLM call, for the others only the new sentences are requested', required=False)
+    parser.add_argument('--near_duplicates', action="store_true", help='Group nearly identical segments of the document (boilerplate differing by a product name or a number): the response of the first one is reused for the others when only tokens found as is in the response differ, otherwise it is sent with their request for consistency (Not supported by the legacy multithreaded processor: use --executor)', required=False)
+    parser.add_argument('--near_duplicate_threshold', type=float, help=f'With --near_duplicates: minimum Jaccard similarity of the word pairs of two segments to group them (Default {near_duplicate_threshold})', required=False)
+    parser.add_argument('--language', type=csv_, help='Specify the language of your text, several comma separated languages produce one document per language from a single extraction', required=False)
 
     parser.add_argument('--engine', type=str, help='LLM Engine name.', required=False)
 
@@ -98,8 +146,9 @@ def main() -> None:
     if args.only_slides:
         slides_to_keep = LLMUtils.get_list_parameters(args.only_slides)
 
+    transformations: List[int] = [transformation]
     if args.transformation:
-        transformation = args.transformation           
+        transformations = [int(transformation) for transformation in args.transformation]
 
     if args.from_document:
         from_document = args.from_document
@@ -117,8 +166,69 @@ def main() -> None:
     if args.max_number_threads:
         max_number_threads = args.max_number_threads
         
+    if args.executor:
+        executor = args.executor
+
+    if args.work_item_store:
+        work_item_store = args.work_item_store
+
+    if args.journal:
+        journal_path = args.journal
+
+    if args.resume:
+        resume = args.resume
+
+    if args.grace_period is not None:
+        grace_period = args.grace_period
+
+    if args.job_store:
+        job_store_path = args.job_store
+
+    if args.max_request_tokens is not None:
+        max_request_tokens = args.max_request_tokens
+
+    if args.table_json:
+        json_tables = args.table_json
+
+    if args.extraction_cache:
+        extraction_cache_path = args.extraction_cache
+
+    if args.batch_slides:
+        batch_slides = args.batch_slides
+
+    if args.slide_partitions is not None:
+        slide_partitions = args.slide_partitions
+
+    if args.batch_cells:
+        batch_cells = args.batch_cells
+
+    if args.cell_ranges:
+        cell_ranges = args.cell_ranges
+
+    if args.prefilter:
+        prefilter = args.prefilter
+
+    if args.prefilter_pattern:
+        prefilter_patterns = args.prefilter_pattern
+
+    if args.skip_target_language:
+        skip_target_language = args.skip_target_language
+
+    if args.target_language_confidence is not None:
+        target_language_confidence = args.target_language_confidence
+
+    if args.translation_memory:
+        translation_memory_path = args.translation_memory
+
+    if args.near_duplicates:
+        near_duplicates = args.near_duplicates
+
+    if args.near_duplicate_threshold is not None:
+        near_duplicate_threshold = args.near_duplicate_threshold
+
+    languages: List[str] = [from_language]
     if args.language:
-        from_language = args.language
+        languages = [language.strip() for language in args.language]
 
     if args.engine:
         engine = args.engine
@@ -128,15 +238,30 @@ def main() -> None:
 
     if args.context_path:
         context_path = args.context_path
-    if args.to_document:
-        to_document = args.to_document
-    else:
-        base_name: str = '.'.join(from_document.split('.')[0:-1])
-        suffix: str = from_document.split('.')[-1]
-        to_lang: str = f'-to-{to_language}' if to_language != "" else ""
-        debugger_ai:str = '-use_debugger_ai' if use_debugger_ai else ""
-        to_document = f"{base_name}{debugger_ai}-transformation-{transformation}-from-{from_language}{to_lang}-min_words_paragraph-{paragraph_start_min_word_numbers}-min_letters_word-{paragraph_start_min_word_length}-engine-{engine}-threads-{max_number_threads}.{suffix}"
+    # One document per transformation and language: the first one is produced first, the others are forked from it
+    pairs: List[Tuple[int, str]] = [(transformation, language) for transformation in transformations for language in languages]
+    to_documents: List[str] = []
+    for transformation, from_language in pairs:
+        if args.to_document:
+            to_document = args.to_document
+            if len(pairs) > 1:
+                to_path: Path = Path(args.to_document)
+                to_document = str(to_path.with_name(f'{to_path.stem}-transformation-{transformation}-{from_language}{to_path.suffix}'))
+        else:
+            base_name: str = '.'.join(from_document.split('.')[0:-1])
+            suffix: str = from_document.split('.')[-1]
+            to_lang: str = f'-to-{to_language}' if to_language != "" else ""
+            debugger_ai:str = '-use_debugger_ai' if use_debugger_ai else ""
+            to_document = f"{base_name}{debugger_ai}-transformation-{transformation}-from-{from_language}{to_lang}-min_words_paragraph-{paragraph_start_min_word_numbers}-min_letters_word-{paragraph_start_min_word_length}-engine-{engine}-threads-{max_number_threads}.{suffix}"
+        to_documents.append(to_document)
+    transformation, from_language = pairs[0]
+    to_document = to_documents[0]
+    fan_out: List[Tuple[int, str, str]] = [(transformation, from_language, to_document)
+                                           for (transformation, from_language), to_document in zip(pairs[1:], to_documents[1:])]
 
+    if stop_requests > 0:
+        logger.log_error('Request to stop the program, nothing to save: exiting!')
+        sys.exit(1)
     logger.log_info(f"Please make sure {args.from_document} is not opened.")
     started_epoch: datetime.date = datetime.now()
 
@@ -154,12 +279,76 @@ def main() -> None:
         use_debugger_ai,
         slides_to_skip,
         slides_to_keep,
-        context_path)
-    
+        context_path,
+        executor,
+        work_item_store,
+        resume,
+        journal_path,
+        job_store_path,
+        max_request_tokens,
+        json_tables,
+        extraction_cache_path,
+        batch_slides,
+        slide_partitions,
+        batch_cells,
+        cell_ranges,
+        prefilter,
+        prefilter_patterns,
+        skip_target_language,
+        target_language_confidence,
+        translation_memory_path,
+        near_duplicates,
+        near_duplicate_threshold,
+        fan_out)
+    if stop_requests > 0:
+        # Stopped while the document was opened: nothing was processed yet
+        logger.log_error('Request to stop the program, nothing to save: exiting!')
+        application_service.close()
+        sys.exit(1)
+
     application_service.process()
     ended_epoch: datetime.date = datetime.now()
     logger.log_warn(f"Total run time: {ended_epoch - started_epoch}")
     logger.log_warn("It could be the script now stalls because of one to many threads that were skipped: Python might be wating they finish which typically depends on the timeout of the APIGW of OpenAI and is usually around 10 minutes.")
 
+def worker_main(arguments: List[str]) -> None:
+    global logger, worker_service
+    program_name = f'{os.path.basename(sys.argv[0])} worker'
+    max_number_threads: int = 1
+    lease_seconds: float = 120
+    parser = argparse.ArgumentParser(prog=program_name, description='Process the requests published by a coordinator started with --job_store')
+    parser.add_argument('--job_store', type=str, help='Path of the SQLite job store of the coordinator', required=True)
+    parser.add_argument('--engine', type=str, help='LLM Engine name (Default: engine of the coordinator)', required=False)
+    parser.add_argument('--use_debugger_ai', action="store_true", help='Use a fake ML engine to debug application')
+    parser.add_argument('--max_number_threads', type=int, help=f'Specify the number of requests processed in parallel by this worker (Default {max_number_threads})', required=False)
+    parser.add_argument('--lease_seconds', type=float, help=f'Time after which a request claimed by a worker that stopped sending heartbeats is given to another worker (Default {lease_seconds})', required=False)
+    parser.add_argument('--worker_id', type=str, help='Name of this worker in the job store (Default: <hostname>-<pid>)', required=False)
+    parser.add_argument('--exit_when_idle', action="store_true", help='Exit as soon as there is no request to claim instead of waiting until the coordinator closes the job')
+    parser.add_argument('--debug', action="store_true", help='Set logging to debug')
+    parser.add_argument('--trace', action="store_true", help='Set logging to trace')
+    args = parser.parse_args(arguments)
+
+    logger_type: LoggerType = LoggerType.INFO
+    if args.trace:
+        logger_type = LoggerType.TRACE
+    elif args.debug:
+        logger_type = LoggerType.DEBUG
+    logger = Logger(logger_type)
+
+    if args.max_number_threads:
+        max_number_threads = args.max_number_threads
+
+    if args.lease_seconds:
+        lease_seconds = args.lease_seconds
+
+    worker_service = WorkerService(args.job_store, logger, args.engine, args.use_debugger_ai,
+                                   max_number_threads, lease_seconds, args.exit_when_idle, args.worker_id)
+    if stop_requests > 0:
+        worker_service.request_drain(grace_period)
+    worker_service.process()
+
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == "worker":
+        worker_main(sys.argv[2:])
+    else:
+        main()
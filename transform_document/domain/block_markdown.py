@@ -0,0 +1,81 @@
+import re
+from typing import List
+
+
+class MarkdownBlock:
+    __slots__ = ("kind", "level", "text")
+
+    def __init__(self, kind: str, level: int, text: str):
+        self.kind: str = kind
+        self.level: int = level
+        self.text: str = text
+
+    def __repr__(self) -> str:
+        return f"MarkdownBlock({self.kind}, {self.level}, {self.text!r})"
+
+
+class BlockMarkdown:
+    # Line based parser of the block markdown returned by the LLM: headings, bullet and numbered lists
+    # (nested by indentation) and plain paragraphs. Each non empty line is one document paragraph.
+    HEADING: str = "heading"
+    BULLET: str = "bullet"
+    NUMBER: str = "number"
+    PARAGRAPH: str = "paragraph"
+    INDENT_WIDTH: int = 2
+    MAX_LIST_LEVEL: int = 3
+    BLOCK_REGEXP = re.compile(r'^(?P<indent>[ \t]*)(?:(?P<heading>#+)[ \t]*|(?P<bullet>[*+\-])[ \t]+|(?P<number>\d+[.)])[ \t]+)?(?P<text>.*)$')
+
+    @staticmethod
+    def __split_heading(blocks: List[MarkdownBlock], heading: MarkdownBlock) -> None:
+        # Sometimes LLM returns a very long heading that should actually be a heading followed by a paragraph
+        heading_text, separator, paragraph_text = heading.text.partition('.')
+        if len(separator) > 0 and len(paragraph_text.strip()) > 0:
+            heading.text = heading_text
+        else:
+            paragraph_text = ""
+        # We should not have a ':' in a heading
+        heading_text, separator, detail_text = heading.text.partition(':')
+        if len(separator) > 0 and len(detail_text.strip()) > 0:
+            heading.text = heading_text
+        else:
+            detail_text = ""
+        blocks.append(heading)
+        blocks.extend([MarkdownBlock(BlockMarkdown.PARAGRAPH, 0, text.strip()) for text in [detail_text, paragraph_text] if len(text.strip()) > 0])
+
+    @staticmethod
+    def parse(text: str, first_is_heading: bool = False) -> List[MarkdownBlock]:
+        """
+        Returns the blocks of the text in their order, first_is_heading handles the first line
+        as a heading even without '#' marking (response to a heading of the document).
+        """
+        blocks: List[MarkdownBlock] = []
+        for line in text.split('\n'):
+            if len(line) == 0 or line.isspace():
+                continue
+            match: re.Match = BlockMarkdown.BLOCK_REGEXP.match(line)
+            indent: int = len(match.group('indent').expandtabs(BlockMarkdown.INDENT_WIDTH * 2))
+            list_level: int = min(BlockMarkdown.MAX_LIST_LEVEL, 1 + indent // BlockMarkdown.INDENT_WIDTH)
+            block_text: str = match.group('text').strip()
+            if match.group('heading') is not None:
+                BlockMarkdown.__split_heading(blocks, MarkdownBlock(BlockMarkdown.HEADING, len(match.group('heading')), block_text))
+            elif match.group('bullet') is not None:
+                blocks.append(MarkdownBlock(BlockMarkdown.BULLET, list_level, block_text))
+            elif match.group('number') is not None:
+                blocks.append(MarkdownBlock(BlockMarkdown.NUMBER, list_level, block_text))
+            elif first_is_heading and len(blocks) == 0:
+                BlockMarkdown.__split_heading(blocks, MarkdownBlock(BlockMarkdown.HEADING, 0, block_text))
+            else:
+                blocks.append(MarkdownBlock(BlockMarkdown.PARAGRAPH, 0, block_text))
+        return blocks
+
+    @staticmethod
+    def get_style_names(block: MarkdownBlock) -> List[str]:
+        # Style name prefixes to look for in the document, from the most to the least specific
+        level_suffix: str = f" {block.level}" if block.level > 1 else ""
+        if block.kind == BlockMarkdown.HEADING:
+            return [f'heading {block.level}'] if block.level > 0 else []
+        if block.kind == BlockMarkdown.BULLET:
+            return [f'list bullet{level_suffix}', 'list bullet', 'bullet ', 'list ']
+        if block.kind == BlockMarkdown.NUMBER:
+            return [f'list number{level_suffix}', 'list number', 'list ']
+        return ['normal']
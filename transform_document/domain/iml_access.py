@@ -1,11 +1,17 @@
 from abc import ABC, abstractmethod
+from typing import Dict
+import asyncio
 
 class IMLAccess(ABC):
     @abstractmethod
-    def try_transform_line(self, text_to_transform: str, how_to_transform: str, temperature: float, top_p: float) -> str:
+    def try_transform_line(self, text_to_transform: str, how_to_transform: str, temperature: float, top_p: float, response_format: Dict = None) -> str:
         """
         """
     @abstractmethod
-    def transform_line(self, text_to_transform: str, how_to_transform: str, temperature: float, top_p: float) -> str:
+    def transform_line(self, text_to_transform: str, how_to_transform: str, temperature: float, top_p: float, response_format: Dict = None) -> str:
         """
-        """
\ No newline at end of file
+        """
+
+    async def transform_line_async(self, text_to_transform: str, how_to_transform: str, temperature: float, top_p: float, response_format: Dict = None) -> str:
+        # Needs to be overriden by endpoints offering a native asynchronous client
+        return await asyncio.to_thread(self.transform_line, text_to_transform, how_to_transform, temperature, top_p, response_format)
@@ -0,0 +1,41 @@
+import json
+from typing import Dict, List
+
+from domain.llm_utils import LLMUtils
+
+
+class IndexedBatch:
+    # Several independent texts sent in one request as a JSON object keyed by a stable identifier (shape id, cell
+    # coordinate...): the system prompt and the context are sent once, every item of the response is validated by key.
+    INSTRUCTION: str = "[Process each text of the JSON object below as per request, independently of the others: " +\
+                       "return a JSON object with exactly the same keys, the value of each key being its processed text]"
+    ITEM_INSTRUCTION: str = "[Process the text as per request]"
+    RESPONSE_FORMAT: Dict = {"type": "json_object"}
+
+    @staticmethod
+    def to_json(items: Dict[str, str]) -> str:
+        return json.dumps(items, ensure_ascii=False)
+
+    @staticmethod
+    def extract_items(request: str) -> Dict[str, str]:
+        return json.loads(request[request.index(IndexedBatch.INSTRUCTION) + len(IndexedBatch.INSTRUCTION):].strip())
+
+    @staticmethod
+    def get_item_request(request: str, text: str) -> str:
+        # Fallback request for one item: same context as the batch
+        return f"{request[0:request.index(IndexedBatch.INSTRUCTION)]}{IndexedBatch.ITEM_INSTRUCTION} {text}"
+
+    @staticmethod
+    def parse(text: str, keys: List[str]) -> Dict[str, str]:
+        """
+        Returns the items of the response having one of the expected keys and a text value, the other ones are dropped.
+        """
+        response: any = LLMUtils.load_json(text)
+        if not isinstance(response, dict):
+            return {}
+        return {key: response[key] for key in keys if isinstance(response.get(key), str) and len(response[key].strip()) > 0}
+
+    @staticmethod
+    def get_locator(keys: List[str], group_sizes: List[int]) -> Dict:
+        # The pointers of the metadata are the ones of all items in order, group_sizes gives the number of pointers of each item
+        return {"keys": keys, "groups": group_sizes}
@@ -0,0 +1,104 @@
+from typing import Dict, List, Tuple
+
+
+class InlineMarkdown:
+    # Single pass tokenizer of the inline markdown returned by the LLM: **bold**, __bold__, *italic*, _italic_,
+    # `code` and backslash escapes. Returns (style flags, text) runs, consecutive texts with the same flags are merged.
+    PLAIN: int = 0
+    BOLD: int = 1
+    ITALIC: int = 2
+    CODE: int = 4
+    CODE_FONT: str = "Consolas"
+    ESCAPABLE: str = "\\`*_{}[]()#+-.!|~<>"
+
+    @staticmethod
+    def __add_run(runs: List[Tuple[int, str]], flags: int, text: str) -> None:
+        if len(text) == 0:
+            return
+        if len(runs) > 0 and runs[-1][0] == flags:
+            runs[-1] = (flags, runs[-1][1] + text)
+        else:
+            runs.append((flags, text))
+
+    @staticmethod
+    def __scan(text: str) -> List[List]:
+        """
+        Split the text in literal texts, code spans and emphasis delimiters.
+        Tokens are [kind, value, can_open, can_close], kind being "text", "code" or the delimiter flag.
+        """
+        tokens: List[List] = []
+        literal: List[str] = []
+        has_closing_backtick: bool = True
+        index: int = 0
+        length: int = len(text)
+        while index < length:
+            char: str = text[index]
+            if char == '\\' and index + 1 < length and text[index + 1] in InlineMarkdown.ESCAPABLE:
+                literal.append(text[index + 1])
+                index += 2
+                continue
+            if char == '`' and has_closing_backtick:
+                closing: int = text.find('`', index + 1)
+                if closing < 0:
+                    # No later backtick can close a code span either
+                    has_closing_backtick = False
+                else:
+                    tokens.append(["text", "".join(literal), False, False])
+                    tokens.append(["code", text[index + 1:closing], False, False])
+                    literal = []
+                    index = closing + 1
+                    continue
+            if char in '*_':
+                width: int = 2 if index + 1 < length and text[index + 1] == char else 1
+                before: str = text[index - 1] if index > 0 else ' '
+                after: str = text[index + width] if index + width < length else ' '
+                can_open: bool = not after.isspace()
+                can_close: bool = not before.isspace()
+                # snake_case words are not emphasis
+                if char == '_' and before.isalnum() and after.isalnum():
+                    can_open = can_close = False
+                if can_open or can_close:
+                    tokens.append(["text", "".join(literal), False, False])
+                    tokens.append([InlineMarkdown.BOLD if width == 2 else InlineMarkdown.ITALIC, char * width, can_open, can_close])
+                    literal = []
+                else:
+                    literal.append(char * width)
+                index += width
+                continue
+            literal.append(char)
+            index += 1
+        tokens.append(["text", "".join(literal), False, False])
+        return tokens
+
+    @staticmethod
+    def tokenize(text: str) -> List[Tuple[int, str]]:
+        tokens: List[List] = InlineMarkdown.__scan(text)
+        # Pair the delimiters, the ones left unpaired are kept as literal text
+        open_delimiters: Dict[str, List[int]] = {}
+        paired: List[bool] = [False] * len(tokens)
+        for token_id, (kind, value, can_open, can_close) in enumerate(tokens):
+            if kind in ["text", "code"]:
+                continue
+            openers: List[int] = open_delimiters.setdefault(value, [])
+            if can_close and len(openers) > 0:
+                paired[openers.pop()] = True
+                paired[token_id] = True
+            elif can_open:
+                openers.append(token_id)
+
+        runs: List[Tuple[int, str]] = []
+        flags: int = InlineMarkdown.PLAIN
+        for token_id, (kind, value, _, _) in enumerate(tokens):
+            if kind == "text":
+                InlineMarkdown.__add_run(runs, flags, value)
+            elif kind == "code":
+                InlineMarkdown.__add_run(runs, flags | InlineMarkdown.CODE, value)
+            elif paired[token_id]:
+                flags ^= kind
+            else:
+                InlineMarkdown.__add_run(runs, flags, value)
+        return runs
+
+    @staticmethod
+    def to_plain_text(text: str) -> str:
+        return "".join([run_text for _, run_text in InlineMarkdown.tokenize(text)])
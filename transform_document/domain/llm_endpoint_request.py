@@ -1,11 +1,17 @@
-from typing import List, Dict
+from typing import Callable, List, Dict, Tuple
+import asyncio
 from domain.llm_utils import LLMUtils
+from domain.table_json import TableJson
+from domain.indexed_batch import IndexedBatch
+from domain.sentence_alignment import SentenceAlignment
 
 from domain.iml_access import IMLAccess
 from domain.logger import GenericLogger
 
 class LLMEndpointRequest:
     how_to_transform: List[str] = []
+    MAX_TABLE_REPAIRS: int = 2
+    MEMORY_CONTEXT_INSTRUCTION: str = "[The other sentences of the text are already processed as follows, keep the new ones consistent with them:"
     def __init__(self, 
                  ml_access: IMLAccess,
                  how_to_transform: Dict,
@@ -15,17 +21,155 @@ class LLMEndpointRequest:
         self.temperature: float = 0.4
         self.top_p: float = 0.3
         self.how_to_transform = how_to_transform
+        # Provides get_translations(sentences) and store(pairs), see TranslationMemory
+        self.translation_memory: any = None
+        # Provides fits(texts) and split_text(text, reserved_tokens), see TokenBudgetSegmenter
+        self.segmenter: any = None
           
+    def use_translation_memory(self, translation_memory: any) -> None:
+        self.translation_memory = translation_memory
+
+    def use_segmenter(self, segmenter: any) -> None:
+        self.segmenter = segmenter
+
+    def __get_parts(self, text_to_transform: str, what_to_transform: str) -> Tuple[str, List[str]]:
+        """
+        Returns the instructions and the parts of a text too large for the budget, each part being sent with the
+        instructions on its own. None when the text can be sent at once.
+        """
+        if self.segmenter is None or what_to_transform != LLMUtils.DEFAULT_REQUEST or self.segmenter.fits([text_to_transform]):
+            return None
+        instruction_index: int = text_to_transform.find(IndexedBatch.ITEM_INSTRUCTION)
+        if instruction_index < 0:
+            return None
+        text_index: int = instruction_index + len(IndexedBatch.ITEM_INSTRUCTION) + 1
+        instructions: str = text_to_transform[0:text_index]
+        parts: List[str] = self.segmenter.split_text(text_to_transform[text_index:], self.segmenter.estimate_tokens(instructions))
+        if len(parts) < 2:
+            return None
+        self.logger.log_info(f"Sending a text of about {self.segmenter.estimate_tokens(text_to_transform)} tokens in {len(parts)} parts split on sentence boundaries")
+        return instructions, parts
+
+    @staticmethod
+    def __join_parts(parts: List[str], new_parts: List[str]) -> str:
+        # The spaces and line breaks separating the parts are kept
+        return "".join([new_part.rstrip() + part[len(part.rstrip()):] for part, new_part in zip(parts, new_parts)])
+
     def get_ml_access(self) -> IMLAccess:
         return self.ml_access
     
+    def __transform_table_json(self, text_to_transform: str, transform_line: Callable) -> str:
+        expected_rows: List[List[str]] = TableJson.extract_table(text_to_transform)
+        request: List = LLMUtils.get_final_request(self.how_to_transform, LLMUtils.TABLE_JSON_REQUEST, self.logger)
+        response: str = transform_line(text_to_transform, request, self.temperature, self.top_p, TableJson.RESPONSE_FORMAT)
+        cells, invalid_cells = TableJson.validate(expected_rows, TableJson.parse_table(response))
+        repair: int = 0
+        while len(invalid_cells) > 0 and repair < self.MAX_TABLE_REPAIRS:
+            repair += 1
+            self.logger.log_warn(f"Table response is missing or has malformed {len(invalid_cells)} cells, requesting them again ({repair}/{self.MAX_TABLE_REPAIRS})")
+            cells_request: str = TableJson.get_cells_request(text_to_transform, expected_rows, invalid_cells)
+            request = LLMUtils.get_final_request(self.how_to_transform, LLMUtils.TABLE_JSON_REQUEST, self.logger)
+            response = transform_line(cells_request, request, self.temperature, self.top_p, TableJson.CELLS_RESPONSE_FORMAT)
+            TableJson.apply_cells(cells, response)
+            invalid_cells = [(row_id, col_id) for row_id, col_id in invalid_cells if cells[row_id][col_id] is None]
+        if len(invalid_cells) > 0:
+            self.logger.log_error(f"Keeping the initial text of {len(invalid_cells)} table cells the LLM failed to process")
+            for row_id, col_id in invalid_cells:
+                cells[row_id][col_id] = expected_rows[row_id][col_id]
+        new_table: str = TableJson.to_json(cells)
+        self.logger.log_debug(f"LLMEndpointRequest.update_line: Transformed:\n{text_to_transform}\nto\n{new_table}")
+        return new_table
+
+    def __transform_batch(self, text_to_transform: str, transform_line: Callable) -> str:
+        items: Dict[str, str] = IndexedBatch.extract_items(text_to_transform)
+        request: List = LLMUtils.get_final_request(self.how_to_transform, LLMUtils.BATCH_REQUEST, self.logger)
+        response: str = transform_line(text_to_transform, request, self.temperature, self.top_p, IndexedBatch.RESPONSE_FORMAT)
+        new_items: Dict[str, str] = IndexedBatch.parse(response, list(items.keys()))
+        missing_keys: List[str] = [key for key in items if key not in new_items]
+        if len(missing_keys) > 0:
+            self.logger.log_warn(f"Batch response is missing or has malformed {len(missing_keys)} items out of {len(items)}, requesting them one by one")
+            request = LLMUtils.get_final_request(self.how_to_transform, LLMUtils.DEFAULT_REQUEST, self.logger)
+        for key in missing_keys:
+            new_items[key] = transform_line(IndexedBatch.get_item_request(text_to_transform, items[key]), request, self.temperature, self.top_p)
+        new_batch: str = IndexedBatch.to_json({key: new_items[key] for key in items})
+        self.logger.log_debug(f"LLMEndpointRequest.update_line: Transformed:\n{text_to_transform}\nto\n{new_batch}")
+        return new_batch
+
+    def __transform_with_memory(self, text_to_transform: str, transform_line: Callable) -> str:
+        # Sentences known from previous runs are not sent again: only the new ones are requested, with the known
+        # ones as fixed context, and the response is assembled sentence by sentence
+        request: List = LLMUtils.get_final_request(self.how_to_transform, LLMUtils.DEFAULT_REQUEST, self.logger)
+        instruction_index: int = text_to_transform.find(IndexedBatch.ITEM_INSTRUCTION)
+        if instruction_index < 0:
+            return transform_line(text_to_transform, request, self.temperature, self.top_p)
+        source: str = text_to_transform[instruction_index + len(IndexedBatch.ITEM_INSTRUCTION):].strip()
+        sentences: List[str] = SentenceAlignment.get_sentences(source)
+        translations: Dict[str, str] = self.translation_memory.get_translations(sentences)
+        new_sentences: List[str] = list(dict.fromkeys([sentence for sentence in sentences if sentence not in translations]))
+        if len(translations) == 0:
+            new_line: str = transform_line(text_to_transform, request, self.temperature, self.top_p)
+            self.translation_memory.store(SentenceAlignment.align(source, new_line))
+            return new_line
+        self.logger.log_info(f"Translation memory: {len(sentences) - len(new_sentences)} of {len(sentences)} sentences known, requesting {len(new_sentences)} sentences")
+        if len(new_sentences) > 0:
+            items: Dict[str, str] = {str(index + 1): sentence for index, sentence in enumerate(new_sentences)}
+            fixed_context: str = f"{self.MEMORY_CONTEXT_INSTRUCTION} {IndexedBatch.to_json(translations)}] "
+            batch_request: str = f"{text_to_transform[0:instruction_index]}{fixed_context}{IndexedBatch.INSTRUCTION} {IndexedBatch.to_json(items)}"
+            new_items: Dict[str, str] = IndexedBatch.parse(self.__transform_batch(batch_request, transform_line), list(items.keys()))
+            new_pairs: List[Tuple[str, str]] = [(items[key], new_items[key]) for key in items if key in new_items]
+            self.translation_memory.store(new_pairs)
+            translations.update(dict(new_pairs))
+            if len(new_pairs) < len(items):
+                self.logger.log_error(f"Keeping the initial text of {len(items) - len(new_pairs)} sentences the LLM failed to process")
+                translations.update({sentence: sentence for sentence in new_sentences if sentence not in translations})
+        new_line: str = SentenceAlignment.assemble(source, translations)
+        self.logger.log_debug(f"LLMEndpointRequest.update_line: Transformed:\n{text_to_transform}\nto\n{new_line}")
+        return new_line
+
     def transform_text(self, text_to_transform: str, what_to_transform: str) -> str:
+        instructions_and_parts: Tuple[str, List[str]] = self.__get_parts(text_to_transform, what_to_transform)
+        if instructions_and_parts is not None:
+            instructions, parts = instructions_and_parts
+            return self.__join_parts(parts, [self.transform_text(f"{instructions}{part.rstrip()}", what_to_transform) for part in parts])
+        if what_to_transform == LLMUtils.TABLE_JSON_REQUEST:
+            return self.__transform_table_json(text_to_transform, self.ml_access.transform_line)
+        if what_to_transform == LLMUtils.BATCH_REQUEST:
+            return self.__transform_batch(text_to_transform, self.ml_access.transform_line)
+        if what_to_transform == LLMUtils.DEFAULT_REQUEST and self.translation_memory is not None:
+            return self.__transform_with_memory(text_to_transform, self.ml_access.transform_line)
         request: List = LLMUtils.get_final_request(self.how_to_transform, what_to_transform, self.logger)
         new_line: str = self.ml_access.transform_line(text_to_transform, request, self.temperature, self.top_p)
         self.logger.log_debug(f"LLMEndpointRequest.update_line: Transformed:\n{text_to_transform}\nto\n{new_line}")
         return new_line
 
+    async def transform_text_async(self, text_to_transform: str, what_to_transform: str) -> str:
+        instructions_and_parts: Tuple[str, List[str]] = self.__get_parts(text_to_transform, what_to_transform)
+        if instructions_and_parts is not None:
+            instructions, parts = instructions_and_parts
+            return self.__join_parts(parts, [await self.transform_text_async(f"{instructions}{part.rstrip()}", what_to_transform) for part in parts])
+        if what_to_transform == LLMUtils.TABLE_JSON_REQUEST:
+            # Validation and repair requests are sequential, they are run outside of the event loop
+            return await asyncio.to_thread(self.__transform_table_json, text_to_transform, self.ml_access.transform_line)
+        if what_to_transform == LLMUtils.BATCH_REQUEST:
+            return await asyncio.to_thread(self.__transform_batch, text_to_transform, self.ml_access.transform_line)
+        if what_to_transform == LLMUtils.DEFAULT_REQUEST and self.translation_memory is not None:
+            return await asyncio.to_thread(self.__transform_with_memory, text_to_transform, self.ml_access.transform_line)
+        request: List = LLMUtils.get_final_request(self.how_to_transform, what_to_transform, self.logger)
+        new_line: str = await self.ml_access.transform_line_async(text_to_transform, request, self.temperature, self.top_p)
+        self.logger.log_debug(f"LLMEndpointRequest.update_line: Transformed:\n{text_to_transform}\nto\n{new_line}")
+        return new_line
+
     def try_transform_text(self, text_to_transform: str, what_to_transform: str) -> str:
+        instructions_and_parts: Tuple[str, List[str]] = self.__get_parts(text_to_transform, what_to_transform)
+        if instructions_and_parts is not None:
+            instructions, parts = instructions_and_parts
+            return self.__join_parts(parts, [self.try_transform_text(f"{instructions}{part.rstrip()}", what_to_transform) for part in parts])
+        if what_to_transform == LLMUtils.TABLE_JSON_REQUEST:
+            return self.__transform_table_json(text_to_transform, self.ml_access.try_transform_line)
+        if what_to_transform == LLMUtils.BATCH_REQUEST:
+            return self.__transform_batch(text_to_transform, self.ml_access.try_transform_line)
+        if what_to_transform == LLMUtils.DEFAULT_REQUEST and self.translation_memory is not None:
+            return self.__transform_with_memory(text_to_transform, self.ml_access.try_transform_line)
         request: List = LLMUtils.get_final_request(self.how_to_transform, what_to_transform, self.logger)
         self.logger.log_trace(f"LLMEndpointRequest.update_line: transforming with \n{request}\n The initial text:\n{text_to_transform}")
         new_line: str = self.ml_access.try_transform_line(text_to_transform, request, self.temperature, self.top_p)
@@ -12,10 +12,19 @@ class LLMUtils:
     REQUEST: str = 'request'
     TEMPERATURE: str = "temperature"
     TOP_P: str = "top_p"
+    # Language of the responses of translation requests: segments already in this language can be skipped
+    TARGET_LANGUAGE: str = "target_language"
     DEFAULT_REQUEST: str = "default_request"
     TABLE_REQUEST: str = "table_request"
+    TABLE_JSON_REQUEST: str = "table_json_request"
+    BATCH_REQUEST: str = "batch_request"
     HEADING_REQUEST: str = "heading_request"
     ALL_REQUESTS: str = "all_requests"
+    MD_TABLE_SEPARATOR_REGEXP = re.compile(r'^\s*\|?(\s*:?-+:?\s*\|)*\s*:?-+:?\s*\|?\s*$')
+    MD_TABLE_RULE: str = "- Return a MD table only.\n"
+    JSON_OBJECT_RULE: str = "- Return a JSON object only, without any markdown formatting.\n"
+    # JSON requests follow the rules of the request they are derived from, only the expected output format differs
+    JSON_DERIVED_REQUESTS: Dict[str, str] = {TABLE_JSON_REQUEST: TABLE_REQUEST, BATCH_REQUEST: DEFAULT_REQUEST}
 
     def __init__(self, additional_requests_file_name: str, language: str, logger: GenericLogger):
         self.logger = logger
@@ -28,7 +37,7 @@ class LLMUtils:
                             f"- Provide NO explanation of any change you perform.\n"+\
                             f"- Provide NO comment regarding any change.\n" +\
                             f"- Do NOT modify the meaning of the text.\n"
-        table_cell_rules: str = "- Return a MD table only.\n"+\
+        table_cell_rules: str = self.MD_TABLE_RULE +\
                         "- Ensure the number of rows and columns is kept strictly identical to the table provided in input.\n"
 
         heading_rules: str = "- Keep around 20% of the initial number of words or up to 5 words\n" +\
@@ -172,19 +181,40 @@ class LLMUtils:
                   }
                 }
              ],
-             self.TEMPERATURE: 0.4, self.TOP_P: 0.6 
+             self.TEMPERATURE: 0.4, self.TOP_P: 0.6, self.TARGET_LANGUAGE: language
             }
         ]
         self.all_requests.extend(self.additional_requests)
     
+    @staticmethod
+    def load_json(text: str) -> any:
+        # Models without structured output support often wrap the JSON in a markdown code block
+        text = re.sub(r'^\s*```(json)?\s*', '', re.sub(r'\s*```\s*$', '', text.strip()))
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return None
+
+    def is_table_request(request_type: str) -> bool:
+        return request_type in [LLMUtils.TABLE_REQUEST, LLMUtils.TABLE_JSON_REQUEST]
+
+    def __get_request_rules(all_requests: Dict, what_to_transform: str) -> str:
+        if what_to_transform in all_requests:
+            return all_requests[what_to_transform]
+        base_request: str = LLMUtils.JSON_DERIVED_REQUESTS.get(what_to_transform)
+        if base_request is not None and base_request in all_requests:
+            return all_requests[base_request].replace(LLMUtils.MD_TABLE_RULE, "") + LLMUtils.JSON_OBJECT_RULE
+        return None
+
     def get_final_request(how_to_transform: Dict, what_to_transform: str, logger: GenericLogger) -> List:
         final_request: List = []
         role: str = "role"
         logger.log_trace(f"Transforming request\n{pformat(how_to_transform)}\n, leveraging {pformat(what_to_transform)}\n")
         for request in how_to_transform:
             if role in request and LLMUtils.ALL_REQUESTS in request:
-                if what_to_transform in request[LLMUtils.ALL_REQUESTS]:
-                    context: str = "\n".join( f"[{req}]" for req in request[LLMUtils.ALL_REQUESTS][what_to_transform].split('\n'))
+                rules: str = LLMUtils.__get_request_rules(request[LLMUtils.ALL_REQUESTS], what_to_transform)
+                if rules is not None:
+                    context: str = "\n".join( f"[{req}]" for req in rules.split('\n'))
                     final_request.append({
                         role: request[role], 
                         "content": context
@@ -283,11 +313,13 @@ class LLMUtils:
 
     def md_to_lists(md_table_str: str, logger: GenericLogger) -> List:
         logger.log_trace(f"Transforming MD table to list: {md_table_str}")
-        lines = [re.sub(r'^\s*\|', '', re.sub(r'\|\s*$', '', "| ".join(line.strip().split("|")))) for line in md_table_str.split("\n")]
+        # Only table rows are kept: text around the table and the header separator row are dropped
+        table_lines: List = [line for line in md_table_str.split("\n") if "|" in line and not LLMUtils.MD_TABLE_SEPARATOR_REGEXP.match(line)]
+        lines = [re.sub(r'^\s*\|', '', re.sub(r'\|\s*$', '', "| ".join(line.strip().split("|")))) for line in table_lines]
         logger.log_trace(f"Table simplified to: {lines}")
 
         csv_reader = list(csv.reader(lines, delimiter="|"))
-        table_from_csv: List = [reader for id, reader in enumerate(csv_reader) if id != 1]
+        table_from_csv: List = csv_reader
         logger.log_trace(f"CSV Reader: {table_from_csv}")
         md_table_list = []
 
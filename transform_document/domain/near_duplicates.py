@@ -0,0 +1,138 @@
+import hashlib
+import random
+import re
+from typing import Dict, List, Set, Tuple
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from domain.logger import GenericLogger
+
+
+class NearDuplicateGroup:
+    # Segments nearly identical to a leader segment: the response to the leader is reused for the others
+    __slots__ = ("leader", "response")
+
+    def __init__(self, leader: any):
+        self.leader: any = leader
+        self.response: str = None
+
+
+class TokenPatch:
+    # A near duplicate differing from its leader only by a few tokens (product name, number...) gets the response
+    # of the leader with these tokens replaced, provided each of them appears in the response as often as in the leader.
+    TOKEN_REGEXP = re.compile(r'\w+|[^\w\s]')
+    MAX_SUBSTITUTIONS: int = 3
+
+    @staticmethod
+    def get_substitutions(leader_text: str, text: str) -> Dict[str, str]:
+        """
+        Returns the tokens of the leader to replace by the ones of the text, None when the texts differ otherwise.
+        """
+        leader_tokens: List[str] = TokenPatch.TOKEN_REGEXP.findall(leader_text)
+        tokens: List[str] = TokenPatch.TOKEN_REGEXP.findall(text)
+        if len(leader_tokens) != len(tokens):
+            return None
+        substitutions: Dict[str, str] = {}
+        for leader_token, token in zip(leader_tokens, tokens):
+            if leader_token == token:
+                continue
+            if substitutions.setdefault(leader_token, token) != token:
+                return None
+        if len(substitutions) > TokenPatch.MAX_SUBSTITUTIONS or any(leader_token in tokens for leader_token in substitutions):
+            return None
+        return substitutions
+
+    @staticmethod
+    def apply(leader_text: str, response: str, substitutions: Dict[str, str]) -> str:
+        """
+        Returns the patched response, None when the tokens to replace cannot be found unambiguously in the response.
+        """
+        if len(substitutions) == 0:
+            return response
+        token_regexp = re.compile(r'(?<!\w)(' + '|'.join([re.escape(token) for token in substitutions]) + r')(?!\w)')
+        for token in substitutions:
+            token_count_regexp = re.compile(r'(?<!\w)' + re.escape(token) + r'(?!\w)')
+            if len(token_count_regexp.findall(response)) != len(token_count_regexp.findall(leader_text)):
+                return None
+        return token_regexp.sub(lambda match: substitutions[match.group(1)], response)
+
+
+class MinHashIndex:
+    # Near duplicate detection over word bigrams: MinHash signatures are split in bands (LSH) so that only segments
+    # sharing a band are compared, the candidates are then confirmed with the exact Jaccard similarity.
+    # Only the segments of the current document are indexed: the checkpoint journal keeps fingerprints without the
+    # source texts and replays exact segments only, the translation memory already reuses identical sentences.
+    NUM_PERMUTATIONS: int = 64
+    BANDS: int = 16
+    SHINGLE_SIZE: int = 2
+    PRIME: int = (1 << 32) + 15
+    DEFAULT_THRESHOLD: float = 0.7
+    WORD_REGEXP = re.compile(r'\w+')
+
+    def __init__(self, logger: GenericLogger, threshold: float = DEFAULT_THRESHOLD):
+        self.logger: GenericLogger = logger
+        self.threshold: float = threshold
+        # Fixed seed: the same segments are grouped the same way in every run
+        generator: random.Random = random.Random(self.NUM_PERMUTATIONS)
+        self.a: List[int] = [generator.randrange(1, 1 << 31) for _ in range(self.NUM_PERMUTATIONS)]
+        self.b: List[int] = [generator.randrange(0, self.PRIME) for _ in range(self.NUM_PERMUTATIONS)]
+        if numpy is not None:
+            self.a_array: numpy.ndarray = numpy.array(self.a, dtype=numpy.uint64)[:, None]
+            self.b_array: numpy.ndarray = numpy.array(self.b, dtype=numpy.uint64)[:, None]
+        self.buckets: Dict[Tuple, List[int]] = {}
+        self.leader_shingles: Dict[int, Set[int]] = {}
+        self.checked: int = 0
+        self.near_duplicates: int = 0
+        self.groups: int = 0
+
+    def __get_shingles(self, text: str) -> Set[int]:
+        words: List[str] = self.WORD_REGEXP.findall(text.lower())
+        shingles: List[str] = [' '.join(words[index:index + self.SHINGLE_SIZE]) for index in range(max(1, len(words) - self.SHINGLE_SIZE + 1))]
+        return {int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little") for shingle in shingles}
+
+    def __get_signature(self, shingles: Set[int]) -> List[int]:
+        if numpy is None:
+            return [min((a * shingle + b) % self.PRIME for shingle in shingles) for a, b in zip(self.a, self.b)]
+        # All permutations of all shingles at once: a < 2^31 and shingles < 2^32 never overflow 64 bits
+        hashes: numpy.ndarray = numpy.fromiter(shingles, dtype=numpy.uint64, count=len(shingles))[None, :]
+        return ((self.a_array * hashes + self.b_array) % self.PRIME).min(axis=1).tolist()
+
+    def __get_band_keys(self, kind: str, signature: List[int]) -> List[Tuple]:
+        rows: int = self.NUM_PERMUTATIONS // self.BANDS
+        return [(kind, band, *signature[band * rows:(band + 1) * rows]) for band in range(self.BANDS)]
+
+    def find_leaders(self, texts: List[str], kinds: List[str] = None) -> List[int]:
+        """
+        Returns for each text the index of the most similar previous text it nearly duplicates, None for the texts
+        having no near duplicate before them: these ones are the leaders. Texts of different kinds are never grouped.
+        """
+        self.buckets = {}
+        self.leader_shingles = {}
+        leaders: List[int] = []
+        for index, text in enumerate(texts):
+            shingles: Set[int] = self.__get_shingles(text)
+            kind: str = kinds[index] if kinds is not None else None
+            band_keys: List[Tuple] = self.__get_band_keys(kind, self.__get_signature(shingles)) if len(shingles) > 0 else []
+            candidates: Set[int] = {candidate for band_key in band_keys for candidate in self.buckets.get(band_key, [])}
+            best_leader, best_similarity = None, 0.0
+            for candidate in sorted(candidates):
+                candidate_shingles: Set[int] = self.leader_shingles[candidate]
+                similarity: float = len(shingles & candidate_shingles) / len(shingles | candidate_shingles)
+                if similarity >= self.threshold and similarity > best_similarity:
+                    best_leader, best_similarity = candidate, similarity
+            leaders.append(best_leader)
+            if best_leader is None and len(shingles) > 0:
+                self.leader_shingles[index] = shingles
+                for band_key in band_keys:
+                    self.buckets.setdefault(band_key, []).append(index)
+        self.checked += len(texts)
+        self.near_duplicates += sum(1 for leader in leaders if leader is not None)
+        self.groups += len({leader for leader in leaders if leader is not None})
+        return leaders
+
+    def get_statistics(self) -> str:
+        coverage: float = 100.0 * self.near_duplicates / self.checked if self.checked > 0 else 0.0
+        return f"Near duplicates: {self.near_duplicates} of {self.checked} segments ({coverage:.1f}%) " + \
+               f"can reuse the response of one of {self.groups} leader segments"
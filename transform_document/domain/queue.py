@@ -1,12 +1,18 @@
 from abc import ABC, abstractmethod
-from typing import List, Tuple
+from typing import Callable, Dict, List, Tuple
 from dataclasses import dataclass
 import threading
 from pprint import pformat
 import re
 
+from domain.block_markdown import BlockMarkdown, MarkdownBlock
+from domain.indexed_batch import IndexedBatch
+from domain.inline_markdown import InlineMarkdown
 from domain.llm_utils import LLMUtils
+from domain.near_duplicates import NearDuplicateGroup
 from domain.logger import GenericLogger
+from domain.segmenter import TokenBudgetSegmenter
+from domain.table_json import TableJson
 
 
 class ThreadSynchronization:
@@ -22,9 +28,39 @@ class ThreadSynchronization:
 
         return return_value
 
+class DocumentStyles:
+    # Styles of one document, looked up by name prefix: every prefix is resolved once
+    # instead of scanning all styles for each paragraph written back.
+    def __init__(self, styles: List):
+        self.styles: List = styles
+        self.style_names: List[str] = [style.name.lower() for style in styles]
+        self.styles_by_prefix: Dict[str, any] = {}
+        self.thread_lock = threading.Lock()
+
+    def __iter__(self):
+        return iter(self.styles)
+
+    def __len__(self) -> int:
+        return len(self.styles)
+
+    def get_style(self, style_name_prefix: str) -> any:
+        prefix: str = style_name_prefix.lower()
+        self.thread_lock.acquire()
+        if prefix not in self.styles_by_prefix:
+            self.styles_by_prefix[prefix] = next((style for style, name in zip(self.styles, self.style_names) if name.startswith(prefix)), None)
+        style: any = self.styles_by_prefix[prefix]
+        self.thread_lock.release()
+        return style
+
+
 class Metadata(ABC):
     
-    def __init__(self, list_pointer_source_data: List, context: str, text_to_transform: str, request_type: str, logger: GenericLogger, document_style: List = None):
+    def __init__(self, list_pointer_source_data: List, context: str, text_to_transform: str, request_type: str, logger: GenericLogger, document_style: DocumentStyles = None,
+                 locator: Dict = None, pointer_resolver: Callable[[Dict], List] = None):
+        # The locator is a JSON serializable and stable reference to the pointers (sheet/cell, slide/shape, paragraph index):
+        # it allows dropping the pointers and resolving them again only when the document is updated.
+        self.locator: Dict = locator
+        self.pointer_resolver: Callable[[Dict], List] = pointer_resolver
         self.list_pointer_source_data: List = list_pointer_source_data
         self.context = context
         self.text_to_transform: str = text_to_transform
@@ -33,13 +69,36 @@ class Metadata(ABC):
         self.logger.log_trace(f"Add metadata of request type {request_type}, text_to_transform: {text_to_transform}")
         # Will have to be moved to MetadaWindows
         self.use_paragraph_style = False
-        self.document_style: List = document_style
+        self.document_style: DocumentStyles = document_style
+        # Shared with the near duplicates of the segment, set only when near duplicates are grouped
+        self.near_duplicate: NearDuplicateGroup = None
+
+    @property
+    def list_pointer_source_data(self) -> List:
+        if self._list_pointer_source_data is None and self.locator is not None and self.pointer_resolver is not None:
+            self._list_pointer_source_data = self.pointer_resolver(self.locator)
+        return self._list_pointer_source_data
+
+    @list_pointer_source_data.setter
+    def list_pointer_source_data(self, list_pointer_source_data: List) -> None:
+        self._list_pointer_source_data = list_pointer_source_data
 
     def get_text_to_transform(self) -> str:
         return self.text_to_transform
     
     def get_pointers(self):
         return self.list_pointer_source_data
+
+    def get_locator(self) -> Dict:
+        return self.locator
+
+    def to_record(self) -> Dict:
+        return {
+            "text": self.text_to_transform,
+            "context": self.context,
+            "request_type": self.request_type,
+            "locator": self.locator
+        }
     
     def get_context(self) -> str:
         return self.context
@@ -59,37 +118,60 @@ class MetadataWindows(Metadata):
     def _get_pointer_to_text(self, pointer: any)-> any:
         return pointer
 
-    def _update_table(self, md_table_text: str) -> None:
+    def __get_cell_text(self, cell: any) -> str:
+        if hasattr(cell, "paragraphs"):
+            return " ".join([paragraph.text for paragraph in cell.paragraphs])
+        return cell.text
+
+    def __update_cell(self, cell: any, new_text: str) -> None:
+        paragraph: any = cell
+        if hasattr(cell, "paragraphs"):
+            if len(cell.paragraphs) == 0:
+                paragraph = cell.add_paragraph()
+            else:
+                while len(paragraph.paragraphs) > 1:
+                    self._delete_paragraph(paragraph.paragraphs[-1])
+                paragraph = cell.paragraphs[0]
+                # Runs are added to the kept paragraph: remove the initial ones first
+                paragraph.text = ""
+        self._update_paragraph(paragraph, new_text)
+
+    def _update_table(self, md_table_text: str, json_table: bool = False) -> None:
         if len(self.list_pointer_source_data) > 0:
             doc_table: any = self.list_pointer_source_data[0]
             if len(self.list_pointer_source_data) > 1:
                 self.logger.log_warn(f"More than one table was registerd ({len(self.list_pointer_source_data)} registered), currently assuming only one table")
             self.logger.log_debug(f"Updating table {md_table_text} in microsoft document")
-            md_table_list: List = LLMUtils.md_to_lists(md_table_text, self.logger)
+            md_table_list: List = LLMUtils.md_to_lists(md_table_text, self.logger) if not json_table else \
+                                  TableJson.parse_table(md_table_text) or []
             self.logger.log_trace(f"Transformed text md table: \n{pformat(md_table_text)} to list based table:\n{pformat(md_table_list)}")
 
-            for row_id, row in enumerate(doc_table.rows):
-                for col_id, cell in enumerate(row.cells):
-                    if row_id < len(md_table_list) and col_id < len(md_table_list[row_id]):
-                        self.logger.log_trace(f"Updating cell (row_id:{row_id}, col_id: {col_id}) from {cell.text} to {md_table_list[row_id][col_id]}")
-                        paragraph: any = cell
-                        if hasattr(cell, "paragraphs"):
-                            if len(cell.paragraphs) == 0:
-                                paragraph = cell.add_paragraph()
-                            else:
-                                while len(paragraph.paragraphs) > 1:
-                                    self._delete_paragraph(paragraph.paragraphs[-1])
-                                paragraph = cell.paragraphs[0]
-                            
-                        self._update_paragraph(paragraph, md_table_list[row_id][col_id])
-                        #cell.text = md_table_list[row_id][col_id]
-                        self.logger.log_trace(f"Updated cell (row_id:{row_id}, col_id: {col_id}) is now {cell.text} ({md_table_list[row_id][col_id]})")
-                    else:
-                        error_message_list_table_row: str = len(md_table_list[row_id]) if row_id < len(md_table_list) else f"{row_id} is out of range (0 to {len(md_table_list)})"
-                        self.logger.log_error(f"Could not update cell having initial value {cell.text} because of index out of range at coordinate (Row: {row_id}, Col: {col_id}):\n"+\
-                                              f"  Doc Table size: Rows: {len(doc_table.rows)} x Cols: {len(doc_table.rows[row_id].cells)} and \n"+\
-                                              f"  List Table size: Rows: {len(md_table_list)} x Cols: {error_message_list_table_row}.\n"+\
-                                              f"  Skipping cell!")
+            doc_rows: List = list(doc_table.rows)
+            # Row group of a table split in several requests, the whole table otherwise
+            rows_locator: Dict = self.locator.get("rows") if self.locator is not None and "rows" in self.locator else \
+                                 {"first": 1, "count": len(doc_rows) - 1, "header_repeated": False}
+            row_ids: List[int] = [] if rows_locator["header_repeated"] else [0]
+            row_ids.extend(range(rows_locator["first"], rows_locator["first"] + rows_locator["count"]))
+            if len(md_table_list) != rows_locator["count"] + 1:
+                self.logger.log_error(f"Expected {rows_locator['count'] + 1} rows (header included) but the LLM returned {len(md_table_list)} rows, missing cells are kept unchanged")
+            updated_cells: int = 0
+            for row_id in row_ids:
+                md_row_id: int = 0 if row_id == 0 else row_id - rows_locator["first"] + 1
+                if md_row_id >= len(md_table_list) or row_id >= len(doc_rows):
+                    continue
+                md_row: List = md_table_list[md_row_id]
+                for col_id, cell in enumerate(doc_rows[row_id].cells):
+                    if col_id >= len(md_row):
+                        self.logger.log_error(f"Could not update cell having initial value {cell.text} at coordinate (Row: {row_id}, Col: {col_id}): "+\
+                                              f"the LLM returned {len(md_row)} columns. Skipping cell!")
+                        continue
+                    # Cells the LLM did not change are not rewritten
+                    if " ".join(self.__get_cell_text(cell).split()) == " ".join(md_row[col_id].split()):
+                        continue
+                    self.logger.log_trace(f"Updating cell (row_id:{row_id}, col_id: {col_id}) from {cell.text} to {md_row[col_id]}")
+                    self.__update_cell(cell, md_row[col_id])
+                    updated_cells += 1
+            self.logger.log_debug(f"Updated {updated_cells} cells of the table")
 
         else:
             self.logger.log_error(f"No table was registered for the context: {self.get_context()}\n"+\
@@ -109,16 +191,14 @@ class MetadataWindows(Metadata):
     
     # TODO: Has to be part of refactoring
     def _add_runs(self, new_paragraph: any, runs: List, style: any = None):
-        for want_bold, run_text in runs:
+        for run_style, run_text in runs:
             run = new_paragraph.add_run()
             run.text = run_text
             self.logger.log_trace(f"Text >{run_text}< was added to paragraph, initial style: Font name: '{run.font.name}', Font size: {run.font.size}, Underlines: {run.font.underline}, Bold: {run.font.bold}, Italic: {run.font.italic}")
             if style is not None:
                 self._set_paragraph_style_to_font(run, style)
-                self.logger.log_trace(f"Style updated to: Font name: '{run.font.name}', Font size: {run.font.size}, Underlines: {run.font.underline}, Bold: {run.font.bold}, Italic: {run.font.italic}, want_bold: {want_bold}")
-            if want_bold: 
-                run.font.bold = True
-                self.logger.log_trace(f"Text {run_text} was set to bold")
+                self.logger.log_trace(f"Style updated to: Font name: '{run.font.name}', Font size: {run.font.size}, Underlines: {run.font.underline}, Bold: {run.font.bold}, Italic: {run.font.italic}, run_style: {run_style}")
+            self._set_run_style(run, run_style)
         self.logger.log_trace(f"_add_runs with style: new_paragraph.text =  {new_paragraph.text}")
 
     def _update_paragraph_in_place(self, paragraph_pointer: any, runs: List):
@@ -140,32 +220,30 @@ class MetadataWindows(Metadata):
 
             self._add_runs(paragraph_pointer, runs, current_style)    
 
-    def _transform_paragraph_to_runs(self, paragraph: str) -> Tuple:
-        runs_boldstyle_text: List = []
-        for current_run in paragraph.split('\n'):
-            if len(current_run) == 0 or re.match('^[\s\n]*$', current_run):
+    def _transform_paragraph_to_runs(self, paragraph: str) -> List[Tuple[int, str]]:
+        # One (InlineMarkdown flags, text) run list per paragraph, each line ending with a new line
+        runs_style_text: List[Tuple[int, str]] = []
+        for current_line in paragraph.split('\n'):
+            if len(current_line) == 0 or current_line.isspace():
                 continue
-            current_run += '\n'
-            found_run: bool = True
-            self.logger.log_trace(f"Checking for bold text in >{current_run}<.")
-            while found_run:
-                m_run = re.match(r'^(?P<before_bold>.*?)\*\*(?P<in_bold>.*?)\*\*(?P<after_bold>.*)$', current_run)
-                if m_run is None:
-                    found_run = False
-                    runs_boldstyle_text.append((False, current_run))
-                    self.logger.log_trace(f"The text >{current_run}< has no MD bold requirement.")
-                else:
-                    runs_boldstyle_text.append((False, m_run.group('before_bold')))
-                    runs_boldstyle_text.append((True, m_run.group('in_bold')))
-                    current_run = m_run.group('after_bold')
-                    self.logger.log_trace(f"The text >{m_run.group('before_bold')}< will NOT be bold")
-                    self.logger.log_trace(f"The text >{m_run.group('in_bold')}< will be bold")
-                    self.logger.log_trace(f"The text >{m_run.group('after_bold')}< will NOT be bold")
-            style, text = runs_boldstyle_text[-1]
-            if not text.endswith('\n'):
-                runs_boldstyle_text[-1] = (style, text + '\n')
-                                 
-        return runs_boldstyle_text
+            line_runs: List[Tuple[int, str]] = InlineMarkdown.tokenize(current_line)
+            if len(line_runs) == 0:
+                continue
+            style, text = line_runs[-1]
+            line_runs[-1] = (style, text + '\n')
+            self.logger.log_trace(f"The text >{current_line}< is split in runs {line_runs}")
+            runs_style_text.extend(line_runs)
+        return runs_style_text
+
+    def _set_run_style(self, run: any, run_style: int) -> None:
+        if run_style & InlineMarkdown.BOLD:
+            run.font.bold = True
+        if run_style & InlineMarkdown.ITALIC:
+            run.font.italic = True
+        if run_style & InlineMarkdown.CODE:
+            run.font.name = InlineMarkdown.CODE_FONT
+        if run_style != InlineMarkdown.PLAIN:
+            self.logger.log_trace(f"Text {run.text} was set to style {run_style}")
 
     def _get_paragraph_style_from_font(self, pointer: any) -> Tuple:
         self.logger.log_trace(f"Pointer: {dir(pointer)}")
@@ -226,155 +304,123 @@ class MetadataDoc(MetadataWindows):
         paragraph_pointer.style = current_style
 
     def _add_runs(self, new_paragraph: any, runs: List):
-        for want_bold, run_text in runs:
+        for run_style, run_text in runs:
             # Skip empty lines (Will lead to more dense document)
             if not re.match(r'^\s*$', run_text):
                 run_text = run_text.replace('\n', ' ')
                 run = new_paragraph.add_run(run_text)
-                if want_bold: 
-                    run.bold = True
-                    self.logger.log_trace(f"Text {run_text} was set to bold")
+                self._set_run_style(run, run_style)
         self.logger.log_trace(f"_add_runs without style: new_paragraph.text =  {new_paragraph.text}")
 
-    def __paragraph_index(self, paragraph_pointer):
-        "Get the index of the paragraph in the document"
-        parent_doc = paragraph_pointer._parent
-        # the paragraphs elements are being generated on the fly,
-        # they change all the time
-        # so in order to index, we must use the elements
-        for p_idx, p in enumerate(parent_doc.paragraphs):
-            if p._element == paragraph_pointer._element:
-                return p_idx
-
-        self.logger.log_warn(f'Could not find paragraph {paragraph_pointer._element} (Text: {paragraph_pointer.text}) from list: {parent_doc.paragraphs} (Text: {pformat([p.text for p in parent_doc.paragraphs])})')
-        return -1
-        # l_elements = [p._element for p in doc.paragraphs]
-        # return l_elements.index(paragraph_pointer._element)
-
-                    
-    def __insert_paragraph_after(self, paragraph_pointer: any, runs: List, style=None):
-        self.logger.log_trace(f"Entering __insert_paragraph_after with {paragraph_pointer} = paragraph_pointer.text = {paragraph_pointer.text}")
-        parent_doc = paragraph_pointer._parent
-        self.logger.log_trace(f"__insert_paragraph_after, parent = {parent_doc}")
-        i = self.__paragraph_index(paragraph_pointer) + 1 # next
-        if i < len(parent_doc.paragraphs) and i > 0:
-            # we find the next paragraph and we insert before:
-            next_paragraph = parent_doc.paragraphs[i]
-            self.logger.log_trace(f"next_paragraph = {next_paragraph}, next_paragraph.text = {next_paragraph.text}")
-            new_paragraph = next_paragraph.insert_paragraph_before('', style)
-        else:
-            # we reached the end, so we need to create a new one:
-            new_paragraph = parent_doc.add_paragraph('', style)
-        self._add_runs(new_paragraph, runs)
-
-        return new_paragraph
-
-    def __split_paragraph(self, paragraphs: List, idx_paragraph: int, split_char: str = '.'):
-        paragraph: str = paragraphs[idx_paragraph]
-        first_paragraphs: List = paragraph.split(split_char)
-        self.logger.log_trace(f"Heading {paragraph} index {idx_paragraph} divided in {first_paragraphs}")
-        if len(first_paragraphs) > 1:
-            paragraphs[idx_paragraph] = '.'.join(first_paragraphs[1:])
-            paragraphs.insert(idx_paragraph, first_paragraphs[0])
-            self.logger.log_trace(f"Heading reduced to {paragraphs[0]}")
-            # We shoud not have a ':' in a heading
-            if ':' in paragraphs[0]: 
-                self.__split_paragraph(paragraphs, idx_paragraph, ':')
+    def __render_blocks(self, anchor_pointer: any, blocks: List[MarkdownBlock]) -> List:
+        # Paragraph elements are built detached from the document, through proxies bound to the parent of the anchor
+        elements: List = []
+        style: any = anchor_pointer.style
+        for block in blocks:
+            new_style: any = self.__get_style_from_style_name(BlockMarkdown.get_style_names(block))
+            if new_style is not None:
+                style = new_style
+            self.logger.log_trace(f"The block {block} has style >{style}<")
+            new_paragraph: any = type(anchor_pointer)(anchor_pointer._p.makeelement(anchor_pointer._p.tag), anchor_pointer._parent)
+            new_paragraph.style = style
+            self._add_runs(new_paragraph, self._transform_paragraph_to_runs(block.text))
+            elements.append(new_paragraph._p)
+        return elements
+
+    def __splice_after(self, anchor_element: any, elements: List) -> None:
+        # Linked right after the anchor: no scan of the paragraphs of the parent is needed, whatever the size of the document
+        for element in elements:
+            anchor_element.addnext(element)
+            anchor_element = element
 
     def __get_style_from_style_name(self, style_required_names: List):
         # Use style normal per default
         if "normal" not in style_required_names:
             style_required_names.append("normal")
         for style_required_name in style_required_names:
-            for style in self.document_style:
-                if style.name.lower().startswith(style_required_name.lower()):
-                    self.logger.log_trace(f"Using style {style} as found from {style_required_name}")
-                    return style
-            self.logger.log_trace(f"Style {style_required_name} not found in {self.document_style}")
-
+            style: any = self.document_style.get_style(style_required_name)
+            if style is not None:
+                self.logger.log_trace(f"Using style {style} as found from {style_required_name}")
+                return style
+            self.logger.log_trace(f"Style {style_required_name} not found in document styles")
 
-        self.logger.log_trace(f"None of the requested styles: {style_required_names} were found in {self.document_style}")
+        self.logger.log_trace(f"None of the requested styles: {style_required_names} were found in document styles")
         return None
     
-    def _update_text(self, text: str) -> None:
-
-        paragraphs: List = text.split("\n")
-        # Sometimes LLM returms a very long heading that should actually be a heading followed by a paragraph
-        for idx_paragraph in range(len(paragraphs)-1, -1, -1):
-            paragraph: str = paragraphs[idx_paragraph]
-            self.logger.log_trace(f"Checking {paragraph} index {idx_paragraph}, checking if it is a title")
-            if re.search(r'^\s*#', paragraph):
-                self.logger.log_trace(f"Yes {paragraph} is a title")
-                self.__split_paragraph(paragraphs, idx_paragraph)
-        
-        self.logger.log_trace(f"Initial data: len(paragraphs) {len(paragraphs)}, {paragraphs} len(self.list_pointer_source_data) {len(self.list_pointer_source_data)}, {pformat([str(pointer) + ': ' + pointer.text for pointer in self.list_pointer_source_data], width=200)}")
-        if len(paragraphs) > 0 and len(self.list_pointer_source_data) > 0:
-            self.list_pointer_source_data[0].text = ""
-            self.logger.log_trace(f"Checking style of existing paragraph {paragraph} style {self.list_pointer_source_data[0].style.name}")
-            if(self.list_pointer_source_data[0].style.name.lower().startswith("heading ")):
-                self.__split_paragraph(paragraphs, 0)
-
-        if len(self.list_pointer_source_data) > 1:
-            for paragraph_pointer in self.list_pointer_source_data[1:]:
+    def _update_text(self, text: str, list_pointers: List = None) -> None:
+        list_pointers = list_pointers if list_pointers is not None else self.list_pointer_source_data
+        if len(list_pointers) <= 0:
+            self.logger.log_warn(f"Was expecting at least one element in array of pointer but got {len(list_pointers)}: {list_pointers}")
+            return
+
+        first_pointer: any = list_pointers[0]
+        self.logger.log_trace(f"Checking style of existing paragraph {first_pointer.text} style {first_pointer.style.name}")
+        blocks: List[MarkdownBlock] = BlockMarkdown.parse(text, first_pointer.style.name.lower().startswith("heading "))
+        self.logger.log_trace(f"Initial data: blocks {blocks} len(list_pointers) {len(list_pointers)}, {pformat([str(pointer) + ': ' + pointer.text for pointer in list_pointers], width=200)}")
+        first_pointer.text = ""
+        for paragraph_pointer in list_pointers[1:]:
+            # A heading without paragraph is registered both as heading and paragraph: never detach the kept paragraph
+            if paragraph_pointer._element is not first_pointer._element:
                 self._delete_paragraph(paragraph_pointer)
-        if len(self.list_pointer_source_data) <= 0:
-            self.logger.log_warn(f"Was expecting at least one element in array of pointer but got {len(self.list_pointer_source_data)}: {self.list_pointer_source_data}")
-        self.logger.log_trace(f"This pointer will not be deleted {self.list_pointer_source_data[0]}:  {self.list_pointer_source_data[0].text}")
-
-        self.logger.log_trace(f"After deletion of the pointers: len(paragraphs) {len(paragraphs)}, {paragraphs} len(self.list_pointer_source_data) Deleted are: {len(self.list_pointer_source_data) - 1}, {pformat([str(pointer) + ': ' + pointer.text for pointer in self.list_pointer_source_data[1:]], width=200)}")
-        next_paragraph_pointer: any = self.list_pointer_source_data[0]
-        next_paragraph_style = next_paragraph_pointer.style
-      
-        for paragraph_id, paragraph in enumerate(paragraphs):
-
-            # We keep style of first paragraph
-            if paragraph_id > 0:
-
-                style_required_names: List = ['normal']
-
-                match_heading = re.search(r'^\s*(?P<heading_deepness>[#]+)[^#]+', paragraph)
-                if match_heading:
-                    heading_class: int = len(match_heading.group('heading_deepness'))
-                    if heading_class > 0:
-                        style_required_names = [f'heading {heading_class}']
-
-                elif re.search(r'^\s*[\*\-]([^\*]+|$)', paragraph):
-                    style_required_names = ['bullet ', 'list ']
-
-                new_style: any = self.__get_style_from_style_name(style_required_names)
-                if new_style is not None: 
-                    next_paragraph_style = new_style
-
-                self.logger.log_trace(f"The paragraph >{paragraph}< has style >{next_paragraph_style}< as defined by >{style_required_names}<")
-            paragraph = re.sub(r'^\s*[#]+\s*', '', paragraph)
-            self.logger.log_trace(f"The paragraph >{paragraph}< was cleaned of heading marking if any were present")
-            
-            runs_style_text: List = self._transform_paragraph_to_runs(paragraph)
-
-            if paragraph_id > 0:
-                next_paragraph_pointer = self.__insert_paragraph_after(next_paragraph_pointer, runs_style_text, next_paragraph_style)
-            else:
-                self._update_paragraph_in_place(next_paragraph_pointer, runs_style_text)
+        self.logger.log_trace(f"This pointer will not be deleted {first_pointer}")
+        if len(blocks) == 0:
+            return
+
+        # We keep style of first paragraph
+        self._update_paragraph_in_place(first_pointer, self._transform_paragraph_to_runs(blocks[0].text))
+        self.__splice_after(first_pointer._p, self.__render_blocks(first_pointer, blocks[1:]))
+
+    def __update_segments(self, text: str, group_sizes: List[int]) -> None:
+        # Merged sections: each segment of the response is written back to the pointers of its section
+        segments: List[str] = TokenBudgetSegmenter.split_segments(text, len(group_sizes))
+        if segments is None:
+            self.logger.log_warn(f"The segment delimiters of a merged request were not kept, writing the whole response at the place of the first section")
+            self._update_text(TokenBudgetSegmenter.SEGMENT_MARK_REGEXP.sub('', text).replace(TokenBudgetSegmenter.SEGMENTS_RULE, '').strip('\n'))
+            return
+        first_pointer: int = 0
+        for segment, group_size in zip(segments, group_sizes):
+            self._update_text(segment, self.list_pointer_source_data[first_pointer:first_pointer + group_size])
+            first_pointer += group_size
 
     def update_llm_response_in_document(self, text: str, request_tyoe: str) -> None: 
         self.thread_lock_queue.acquire()
         self.logger.log_trace(f"Updating document with request type: {request_tyoe} and text: {text}")
-        if request_tyoe != LLMUtils.TABLE_REQUEST:
-            self._update_text(text)
+        group_sizes: List[int] = self.locator.get("groups") if self.locator is not None else None
+        if LLMUtils.is_table_request(request_tyoe):
+            self._update_table(text, request_tyoe == LLMUtils.TABLE_JSON_REQUEST)
+        elif group_sizes is not None and len(group_sizes) > 1:
+            self.__update_segments(text, group_sizes)
         else:
-            self._update_table(text)
+            self._update_text(text)
         self.thread_lock_queue.release() 
 
 class MetadataXls(MetadataWindows):
     thread_lock_queue = threading.Lock()
 
-    def get_text_to_transform(self) -> str:
-        return str(self.list_pointer_source_data.value)
     def update_llm_response_in_document(self, text: str, request_tyoe: str) -> None: 
         self.thread_lock_queue.acquire()
-        self.list_pointer_source_data.value = text
+        if request_tyoe == LLMUtils.BATCH_REQUEST:
+            # Cells sent in one request: each item of the response is written to the cell of its coordinate
+            items: Dict[str, str] = IndexedBatch.parse(text, self.locator["keys"])
+            for key, cell in zip(self.locator["keys"], self.list_pointer_source_data):
+                if key in items:
+                    cell.value = self.__to_cell_text(items[key])
+                else:
+                    self.logger.log_error(f"No response for cell {key}, keeping its initial text")
+        else:
+            for cell in self.list_pointer_source_data:
+                cell.value = self.__to_cell_text(text)
         self.thread_lock_queue.release() 
 
+    def __to_cell_text(self, text: str) -> str:
+        # Cells hold plain text: the inline markdown of the response is not kept
+        return "\n".join([InlineMarkdown.to_plain_text(line) for line in text.split("\n")])
+
+class MetadataText(Metadata):
+    # The pointer is the streamed document itself: responses are recorded by segment and written in the segment order
+    def update_llm_response_in_document(self, text: str, request_tyoe: str) -> None:
+        self.list_pointer_source_data[0].record_response(self.locator, text)
+
 class MetadataPpt(MetadataWindows):
     thread_lock_queue = threading.Lock()
 
@@ -382,12 +428,25 @@ class MetadataPpt(MetadataWindows):
     def update_llm_response_in_document(self, text: str, request_tyoe: str) -> None: 
         self.thread_lock_queue.acquire()
         self.logger.log_trace(f"Updating document with request type: {request_tyoe} and text: {text}")
-        if request_tyoe != LLMUtils.TABLE_REQUEST:
+        if request_tyoe == LLMUtils.BATCH_REQUEST:
+            self.__update_batch(text)
+        elif not LLMUtils.is_table_request(request_tyoe):
             self._update_text(text)
         else:
-            self._update_table(text)
+            self._update_table(text, request_tyoe == LLMUtils.TABLE_JSON_REQUEST)
         self.thread_lock_queue.release() 
 
+    def __update_batch(self, text: str) -> None:
+        # Shapes of one slide sent in one request: each item of the response is written back to the pointers of its shape
+        items: Dict[str, str] = IndexedBatch.parse(text, self.locator["keys"])
+        first_pointer: int = 0
+        for key, group_size in zip(self.locator["keys"], self.locator["groups"]):
+            if key in items:
+                self._update_text(items[key], self.list_pointer_source_data[first_pointer:first_pointer + group_size])
+            else:
+                self.logger.log_error(f"No response for shape {key}, keeping its initial text")
+            first_pointer += group_size
+
     def _get_pointer_to_text(self, pointer: any)-> any:
         self.logger.log_trace(f"_get_pointer_to_text, pointer has attributes {format(dir(pointer))}")
         new_pointer: any = None
@@ -403,27 +462,28 @@ class MetadataPpt(MetadataWindows):
 
         return new_pointer
                 
-    def _update_text(self, text:str) -> None:
+    def _update_text(self, text:str, list_pointers: List = None) -> None:
+        list_pointers = list_pointers if list_pointers is not None else self.list_pointer_source_data
         # Split LLM transformation per paragraph and ensure that the number of paragraph returned by LLM 
         # does not exceed the original number of paragraphs
         paragraphs = text.split("\n")
-        self.logger.log_trace(f"len(paragraphs): {len(paragraphs)}, len(self.list_pointer_source_data): {len(self.list_pointer_source_data)}, paragraphs: {pformat(paragraphs)}")
-        while (len(paragraphs) > 1 and len(paragraphs) > len(self.list_pointer_source_data)):
+        self.logger.log_trace(f"len(paragraphs): {len(paragraphs)}, len(list_pointers): {len(list_pointers)}, paragraphs: {pformat(paragraphs)}")
+        while (len(paragraphs) > 1 and len(paragraphs) > len(list_pointers)):
             paragraphs[-2] += "\n" + paragraphs[-1]
             paragraphs = paragraphs[:-1]
-            self.logger.log_trace(f"len(paragraphs): {len(paragraphs)}, len(self.list_pointer_source_data): {len(self.list_pointer_source_data)}, paragraphs: {pformat(paragraphs)}")
-        self.logger.log_trace(f"Processing {len(paragraphs)} paragraphs adapted to number of pointers: {len(self.list_pointer_source_data)}")
-        if len(paragraphs) > len(self.list_pointer_source_data):
-            self.logger.log_warn(f"len(paragraphs) ({len(paragraphs)}) > len(self.list_pointer_source_data) ({len(self.list_pointer_source_data)})")
+            self.logger.log_trace(f"len(paragraphs): {len(paragraphs)}, len(list_pointers): {len(list_pointers)}, paragraphs: {pformat(paragraphs)}")
+        self.logger.log_trace(f"Processing {len(paragraphs)} paragraphs adapted to number of pointers: {len(list_pointers)}")
+        if len(paragraphs) > len(list_pointers):
+            self.logger.log_warn(f"len(paragraphs) ({len(paragraphs)}) > len(list_pointers) ({len(list_pointers)})")
         # If the number of paragraphs returned by LLM is lower than the current number of paragraphs 
         # in the original document delete the remaining paragraphs.
-        for index in range(len(paragraphs), len(self.list_pointer_source_data)):
-             self.logger.log_trace(f"Deleting paragraph index: {index}, initial text: {self.list_pointer_source_data[index].text}")
-             self._delete_paragraph(self.list_pointer_source_data[index])
+        for index in range(len(paragraphs), len(list_pointers)):
+             self.logger.log_trace(f"Deleting paragraph index: {index}, initial text: {list_pointers[index].text}")
+             self._delete_paragraph(list_pointers[index])
         for index in range(len(paragraphs)):
             dbg_paragraph: str = paragraphs[index].replace('\n', '\\n')
-            self.logger.log_trace(f"Processing paragraph index: {index}, initial text: {self.list_pointer_source_data[index].text}, new text: {dbg_paragraph}")
-            self._update_paragraph(self.list_pointer_source_data[index], paragraphs[index])
+            self.logger.log_trace(f"Processing paragraph index: {index}, initial text: {list_pointers[index].text}, new text: {dbg_paragraph}")
+            self._update_paragraph(list_pointers[index], paragraphs[index])
 
 @dataclass
 class MultithreadedMetadata:
@@ -0,0 +1,73 @@
+import re
+from typing import Dict, List, Tuple
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from domain.logger import GenericLogger
+
+
+class SegmentFilter:
+    # Classifies all extracted segments at once before they are sent: segments with too few letters, or made only
+    # of a number, URL, email, date, code or path are not linguistic and are kept unchanged without any LLM call.
+    LETTERS: str = "letters"
+    MIN_LETTERS: int = 4
+    MIN_LETTER_RATIO: float = 0.4
+    DEFAULT_PATTERNS: Dict[str, str] = {
+        "number": r'[-+]?(?:\d[\d\s.,\'%]*)',
+        "url": r'(?:[a-zA-Z][\w+.-]*://|www\.)\S+',
+        "email": r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+',
+        "date": r'\d{1,4}[-/.]\d{1,2}[-/.]\d{1,4}(?:[ T]\d{1,2}:\d{2}(?::\d{2})?)?',
+        "code": r'[A-Z0-9]+(?:[-_./:#][A-Z0-9]+)+',
+        "path": r'(?:[A-Za-z]:)?[\\/]?(?:[\w.-]+[\\/])+[\w.-]*',
+    }
+
+    def __init__(self, logger: GenericLogger, patterns: List[str] = None):
+        self.logger: GenericLogger = logger
+        all_patterns: Dict[str, str] = {**self.DEFAULT_PATTERNS,
+                                        **{f"pattern_{index + 1}": pattern for index, pattern in enumerate(patterns or [])}}
+        self.patterns_regexp = re.compile('|'.join([f'(?P<{name}>{pattern})' for name, pattern in all_patterns.items()]))
+        self.skipped: Dict[str, int] = {}
+        self.checked: int = 0
+
+    @staticmethod
+    def __count_letters(texts: List[str]) -> List[int]:
+        if numpy is None:
+            return [sum(1 for char in text if char.isalpha()) for text in texts]
+        # One array of code points for all texts: letters are ASCII letters and non ASCII code points out of
+        # the punctuation blocks, counted per text from the cumulative sum at the boundaries of the texts
+        lengths: numpy.ndarray = numpy.fromiter((len(text) for text in texts), dtype=numpy.int64, count=len(texts))
+        codes: numpy.ndarray = numpy.frombuffer("".join(texts).encode("utf-32-le"), dtype=numpy.uint32)
+        lower_codes: numpy.ndarray = codes | 0x20
+        is_letter: numpy.ndarray = ((lower_codes >= 0x61) & (lower_codes <= 0x7A)) | \
+                                   ((codes >= 0xC0) & ~((codes >= 0x2000) & (codes <= 0x2BFF)) & ~((codes >= 0x3000) & (codes <= 0x303F)))
+        letters_sum: numpy.ndarray = numpy.concatenate(([0], numpy.cumsum(is_letter, dtype=numpy.int64)))
+        ends: numpy.ndarray = numpy.cumsum(lengths)
+        return (letters_sum[ends] - letters_sum[ends - lengths]).tolist()
+
+    def __get_skip_reason(self, text: str, letters: int) -> str:
+        if letters < self.MIN_LETTERS or letters < self.MIN_LETTER_RATIO * len(text.strip()):
+            return self.LETTERS
+        match: re.Match = self.patterns_regexp.fullmatch(text.strip())
+        return match.lastgroup if match is not None else None
+
+    def classify(self, texts: List[str]) -> List[bool]:
+        """
+        Returns for each text whether it has to be sent to the LLM.
+        """
+        keep: List[bool] = []
+        for text, letters in zip(texts, self.__count_letters(texts)):
+            reason: str = self.__get_skip_reason(text, letters)
+            if reason is not None:
+                self.skipped[reason] = self.skipped.get(reason, 0) + 1
+                self.logger.log_debug(f"Skipping {reason} segment: {text[0:50]}")
+            keep.append(reason is None)
+        self.checked += len(texts)
+        return keep
+
+    def get_statistics(self) -> str:
+        skipped_count: int = sum(self.skipped.values())
+        reasons: List[Tuple[str, int]] = sorted(self.skipped.items(), key=lambda reason: -reason[1])
+        return f"Prefilter skipped {skipped_count} of {self.checked} segments ({skipped_count} LLM calls saved)" + \
+               (f": {', '.join([f'{reason} {count}' for reason, count in reasons])}" if skipped_count > 0 else "")
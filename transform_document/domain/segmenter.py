@@ -0,0 +1,103 @@
+import math
+import re
+from typing import List
+
+from domain.logger import GenericLogger
+
+
+class TokenBudgetSegmenter:
+    # Keeps every request sent to the LLM close to a token budget: long sections are split on paragraph
+    # boundaries, consecutive small sections are merged into one request with delimiters mapping back to them.
+    DEFAULT_MAX_REQUEST_TOKENS: int = 3000
+    CHARS_PER_TOKEN: int = 4
+    SEGMENT_MARK: str = "[SEGMENT {index}]"
+    SEGMENT_MARK_REGEXP = re.compile(r'^\s*\[SEGMENT\s+(\d+)\]\s*$', re.MULTILINE)
+    SEGMENTS_RULE: str = "[Each [SEGMENT n] line delimits an independent text: keep all these lines unchanged, on their own line and in the same order]"
+    SENTENCE_END_REGEXP = re.compile(r'(?<=[.!?;…。！？])\s+(?=\S)')
+    WORD_END_REGEXP = re.compile(r'\s+(?=\S)')
+
+    def __init__(self, max_request_tokens: int, logger: GenericLogger):
+        # A budget of 0 or less disables splitting and merging
+        self.max_request_tokens: int = max_request_tokens
+        self.logger: GenericLogger = logger
+
+    def is_enabled(self) -> bool:
+        return self.max_request_tokens is not None and self.max_request_tokens > 0
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        return math.ceil(len(text) / TokenBudgetSegmenter.CHARS_PER_TOKEN)
+
+    def fits(self, texts: List[str]) -> bool:
+        # Account for one delimiter line per text when several texts are merged
+        tokens: int = sum([self.estimate_tokens(text) for text in texts])
+        if len(texts) > 1:
+            tokens += self.estimate_tokens(self.SEGMENTS_RULE) + len(texts) * self.estimate_tokens(self.SEGMENT_MARK.format(index=len(texts)))
+        return not self.is_enabled() or tokens <= self.max_request_tokens
+
+    def __group(self, texts: List[str], reserved_tokens: int = 0) -> List[List[int]]:
+        groups: List[List[int]] = []
+        current_group: List[int] = []
+        current_tokens: int = reserved_tokens
+        for index, text in enumerate(texts):
+            tokens: int = self.estimate_tokens(text)
+            if self.is_enabled() and len(current_group) > 0 and current_tokens + tokens > self.max_request_tokens:
+                groups.append(current_group)
+                current_group = []
+                current_tokens = reserved_tokens
+            current_group.append(index)
+            current_tokens += tokens
+        if len(current_group) > 0:
+            groups.append(current_group)
+        return groups
+
+    def split(self, texts: List[str]) -> List[List[int]]:
+        """
+        Group consecutive texts (typically paragraphs) so that each group fits the budget.
+        Returns the indexes of the texts of each group, a text larger than the budget is kept alone.
+        """
+        for text in texts:
+            if self.is_enabled() and self.estimate_tokens(text) > self.max_request_tokens:
+                self.logger.log_warn(f"Paragraph of about {self.estimate_tokens(text)} tokens exceeds the budget of {self.max_request_tokens} tokens, " +\
+                                     f"it is sent in parts split on sentence boundaries: {text[0:50]}...")
+        return self.__group(texts)
+
+    def __split_on(self, text: str, separator_regexp: re.Pattern, reserved_tokens: int) -> List[str]:
+        # Cut right after each separator: every piece keeps the spaces following it
+        pieces: List[str] = []
+        start: int = 0
+        for match in separator_regexp.finditer(text):
+            pieces.append(text[start:match.end()])
+            start = match.end()
+        pieces.append(text[start:])
+        return ["".join([pieces[index] for index in group]) for group in self.__group(pieces, reserved_tokens)]
+
+    def split_text(self, text: str, reserved_tokens: int = 0) -> List[str]:
+        """
+        Splits a text larger than the budget on sentence boundaries, on word boundaries for the sentences larger than
+        the budget. reserved_tokens are taken by the instructions sent with each part. The parts joined give the text.
+        """
+        parts: List[str] = [text]
+        for separator_regexp in [self.SENTENCE_END_REGEXP, self.WORD_END_REGEXP]:
+            parts = [piece for part in parts
+                     for piece in (self.__split_on(part, separator_regexp, reserved_tokens) if not self.fits_with(part, reserved_tokens) else [part])]
+        return parts
+
+    def fits_with(self, text: str, reserved_tokens: int) -> bool:
+        return not self.is_enabled() or self.estimate_tokens(text) + reserved_tokens <= self.max_request_tokens
+
+    @staticmethod
+    def join_segments(texts: List[str]) -> str:
+        return "\n".join([TokenBudgetSegmenter.SEGMENTS_RULE] +
+                         [f"{TokenBudgetSegmenter.SEGMENT_MARK.format(index=index + 1)}\n{text}" for index, text in enumerate(texts)])
+
+    @staticmethod
+    def split_segments(text: str, expected_segments: int) -> List[str]:
+        """
+        Split a response to merged texts back into one text per segment, None if the delimiters were not kept.
+        """
+        marks: List = list(TokenBudgetSegmenter.SEGMENT_MARK_REGEXP.finditer(text))
+        if len(marks) != expected_segments or [int(mark.group(1)) for mark in marks] != list(range(1, expected_segments + 1)):
+            return None
+        return [text[mark.end():marks[index + 1].start() if index + 1 < len(marks) else len(text)].strip('\n')
+                for index, mark in enumerate(marks)]
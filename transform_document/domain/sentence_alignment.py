@@ -0,0 +1,53 @@
+import re
+from typing import Dict, List, Tuple
+
+from domain.segmenter import TokenBudgetSegmenter
+
+
+class SentenceAlignment:
+    # Splits texts in lines and sentences so that a response can be stored and reassembled sentence by sentence.
+    # Lines delimiting merged sections are not sentences: they are kept as they are.
+    SENTENCE_END_REGEXP = TokenBudgetSegmenter.SENTENCE_END_REGEXP
+    SPACES_REGEXP = re.compile(r'\s+')
+
+    @staticmethod
+    def is_fixed_line(line: str) -> bool:
+        return TokenBudgetSegmenter.SEGMENT_MARK_REGEXP.match(line) is not None or line.strip() == TokenBudgetSegmenter.SEGMENTS_RULE
+
+    @staticmethod
+    def normalize(sentence: str) -> str:
+        return SentenceAlignment.SPACES_REGEXP.sub(' ', sentence).strip()
+
+    @staticmethod
+    def split(text: str) -> List[List[str]]:
+        """
+        Returns the sentences of each line of the text, empty and fixed lines have no sentence.
+        """
+        return [[] if len(line.strip()) == 0 or SentenceAlignment.is_fixed_line(line)
+                else [SentenceAlignment.normalize(sentence) for sentence in SentenceAlignment.SENTENCE_END_REGEXP.split(line.strip())]
+                for line in text.split('\n')]
+
+    @staticmethod
+    def get_sentences(text: str) -> List[str]:
+        return [sentence for line in SentenceAlignment.split(text) for sentence in line]
+
+    @staticmethod
+    def align(source: str, response: str) -> List[Tuple[str, str]]:
+        """
+        Returns the (source, response) sentence pairs when both texts have the same number of sentences on each
+        of their non empty lines, no pair otherwise: sentences are never guessed.
+        """
+        source_lines: List[List[str]] = [line for line in SentenceAlignment.split(source) if len(line) > 0]
+        response_lines: List[List[str]] = [line for line in SentenceAlignment.split(response) if len(line) > 0]
+        if len(source_lines) != len(response_lines) or \
+           any(len(source_line) != len(response_line) for source_line, response_line in zip(source_lines, response_lines)):
+            return []
+        return [pair for source_line, response_line in zip(source_lines, response_lines) for pair in zip(source_line, response_line)]
+
+    @staticmethod
+    def assemble(text: str, translations: Dict[str, str]) -> str:
+        # Each sentence of the text is replaced by its translation, line breaks and fixed lines are kept
+        lines: List[str] = []
+        for line, sentences in zip(text.split('\n'), SentenceAlignment.split(text)):
+            lines.append(' '.join([translations[sentence] for sentence in sentences]) if len(sentences) > 0 else line)
+        return '\n'.join(lines)
@@ -0,0 +1,62 @@
+from typing import Dict, List, Tuple
+
+from domain.logger import GenericLogger
+from domain.llm_utils import LLMUtils
+from domain.segmenter import TokenBudgetSegmenter
+from domain.table_json import TableJson
+
+
+class TableEngine:
+    # Builds the markdown tables sent to the LLM and splits large tables into row groups fitting the token budget.
+    # Every row group repeats the header row so that the LLM keeps the meaning of the columns.
+    # With json_tables the row groups are sent as JSON arrays of rows, the budget is still estimated on markdown.
+
+    def __init__(self, max_request_tokens: int, logger: GenericLogger, json_tables: bool = False):
+        self.segmenter: TokenBudgetSegmenter = TokenBudgetSegmenter(max_request_tokens, logger)
+        self.logger: GenericLogger = logger
+        self.json_tables: bool = json_tables
+
+    def get_request_type(self) -> str:
+        return LLMUtils.TABLE_JSON_REQUEST if self.json_tables else LLMUtils.TABLE_REQUEST
+
+    def format_table(self, rows: List[List[str]]) -> str:
+        return TableJson.to_json(rows) if self.json_tables else self.to_md_table(rows)
+
+    @staticmethod
+    def to_md_row(row: List[str]) -> str:
+        return "|" + "|".join([" ".join(cell_text.split()) for cell_text in row]) + "|"
+
+    @staticmethod
+    def to_md_table(rows: List[List[str]]) -> str:
+        if len(rows) == 0:
+            return ""
+        md_rows: List[str] = [TableEngine.to_md_row(rows[0]), "|" + "|".join(["---"] * len(rows[0])) + "|"]
+        md_rows.extend([TableEngine.to_md_row(row) for row in rows[1:]])
+        return "\n".join(md_rows)
+
+    @staticmethod
+    def get_rows_locator(first_row: int, row_count: int, header_repeated: bool) -> Dict:
+        # Rows of the document table updated by a row group: the first markdown row is the header,
+        # the following ones are the rows first_row to first_row + row_count - 1.
+        return {"first": first_row, "count": row_count, "header_repeated": header_repeated}
+
+    def split_rows(self, rows: List[List[str]]) -> List[Tuple[str, Dict]]:
+        """
+        Returns one table per row group with the locator of its rows.
+        """
+        if len(rows) <= 1:
+            return [(self.format_table(rows), self.get_rows_locator(1, 0, False))]
+        body_rows: List[str] = [self.to_md_row(row) for row in rows[1:]]
+        if self.segmenter.fits([self.to_md_table(rows)]):
+            return [(self.format_table(rows), self.get_rows_locator(1, len(body_rows), False))]
+
+        header_tokens: int = 2 * self.segmenter.estimate_tokens(self.to_md_row(rows[0]))
+        body_segmenter: TokenBudgetSegmenter = TokenBudgetSegmenter(max(1, self.segmenter.max_request_tokens - header_tokens), self.logger)
+        row_groups: List[List[int]] = body_segmenter.split(body_rows)
+        self.logger.log_debug(f"Splitting table of {len(rows)} rows in {len(row_groups)} row groups")
+        md_tables: List[Tuple[str, Dict]] = []
+        for group_index, row_group in enumerate(row_groups):
+            group_rows: List[List[str]] = [rows[0]] + [rows[1 + index] for index in row_group]
+            # Only the first row group writes the header back
+            md_tables.append((self.format_table(group_rows), self.get_rows_locator(1 + row_group[0], len(row_group), group_index > 0)))
+        return md_tables
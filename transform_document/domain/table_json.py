@@ -0,0 +1,101 @@
+import json
+from typing import Dict, List, Tuple
+
+from domain.llm_utils import LLMUtils
+
+
+class TableJson:
+    # Tables exchanged with the LLM as JSON arrays of rows instead of markdown: the shape of the response
+    # can be validated and only the missing or malformed cells are requested again.
+    TABLE_INSTRUCTION: str = "[Process the table as per request. The table is a JSON array of rows, each row being an array of cell texts: " +\
+                             "return a JSON object {\"rows\": [...]} keeping the STRICT same number of rows and of cells in each row]"
+    CELLS_INSTRUCTION: str = "[Process the text of each cell as per request. The cells are a JSON array of objects {\"row\", \"column\", \"text\"}: " +\
+                             "return a JSON object {\"cells\": [...]} with exactly the same rows and columns]"
+
+    RESPONSE_FORMAT: Dict = {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "table",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {"rows": {"type": "array", "items": {"type": "array", "items": {"type": "string"}}}},
+                "required": ["rows"],
+                "additionalProperties": False
+            }
+        }
+    }
+    CELLS_RESPONSE_FORMAT: Dict = {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "cells",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {"cells": {"type": "array", "items": {
+                    "type": "object",
+                    "properties": {"row": {"type": "integer"}, "column": {"type": "integer"}, "text": {"type": "string"}},
+                    "required": ["row", "column", "text"],
+                    "additionalProperties": False
+                }}},
+                "required": ["cells"],
+                "additionalProperties": False
+            }
+        }
+    }
+
+    @staticmethod
+    def to_json(rows: List[List[str]]) -> str:
+        return json.dumps(rows, ensure_ascii=False)
+
+    @staticmethod
+    def extract_table(request: str) -> List[List[str]]:
+        return json.loads(request[request.index(TableJson.TABLE_INSTRUCTION) + len(TableJson.TABLE_INSTRUCTION):].strip())
+
+    @staticmethod
+    def parse_table(text: str) -> List:
+        table: any = LLMUtils.load_json(text)
+        if isinstance(table, dict):
+            table = table.get("rows")
+        return table if isinstance(table, list) else None
+
+    @staticmethod
+    def validate(expected_rows: List[List[str]], table: List) -> Tuple[List[List[str]], List[Tuple[int, int]]]:
+        """
+        Map the response on the shape of the expected table: returns the cells found, None for the cells
+        missing or malformed, and the coordinates of these cells.
+        A row whose number of cells differs cannot be trusted: all its cells are considered malformed.
+        """
+        table = table if table is not None else []
+        cells: List[List[str]] = []
+        invalid_cells: List[Tuple[int, int]] = []
+        for row_id, expected_row in enumerate(expected_rows):
+            row: any = table[row_id] if row_id < len(table) else None
+            if not isinstance(row, list) or len(row) != len(expected_row):
+                row = [None] * len(expected_row)
+            row = [value if isinstance(value, str) else str(value) if isinstance(value, (int, float)) else None for value in row]
+            invalid_cells.extend([(row_id, col_id) for col_id, value in enumerate(row) if value is None])
+            cells.append(row)
+        return cells, invalid_cells
+
+    @staticmethod
+    def get_cells_request(request: str, expected_rows: List[List[str]], invalid_cells: List[Tuple[int, int]]) -> str:
+        # Same context and instructions as the table request, only the cells to repair are sent
+        prefix: str = request[0:request.index(TableJson.TABLE_INSTRUCTION)]
+        cells: List[Dict] = [{"row": row_id, "column": col_id, "text": expected_rows[row_id][col_id]} for row_id, col_id in invalid_cells]
+        return f"{prefix}{TableJson.CELLS_INSTRUCTION} {json.dumps(cells, ensure_ascii=False)}"
+
+    @staticmethod
+    def apply_cells(cells: List[List[str]], text: str) -> None:
+        response: any = LLMUtils.load_json(text)
+        if isinstance(response, dict):
+            response = response.get("cells")
+        if not isinstance(response, list):
+            return
+        for cell in response:
+            if not isinstance(cell, dict) or not isinstance(cell.get("text"), str):
+                continue
+            row_id: any = cell.get("row")
+            col_id: any = cell.get("column")
+            if isinstance(row_id, int) and isinstance(col_id, int) and 0 <= row_id < len(cells) and 0 <= col_id < len(cells[row_id]):
+                cells[row_id][col_id] = cell["text"]
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from domain.queue import Metadata
+from domain.queue import Metadata, IQueue
 from domain.logger import GenericLogger
 class IProcessorType(ABC):
     def process_next(self) -> None:
@@ -32,6 +32,24 @@ class IProcessorType(ABC):
     def join_all(self) -> None:
         pass
 
+    def set_queue(self, queue: IQueue) -> bool:
+        # Needs to be overriden by processors able to work with another queue implementation
+        return False
+
+    def set_journal(self, journal: any) -> bool:
+        # Needs to be overriden by processors able to journal and replay LLM responses
+        return False
+
+    def set_llm_request(self, llm_request: any) -> bool:
+        # Needs to be overriden by processors able to switch to another transformation between two runs
+        return False
+
+    def request_drain(self, grace_seconds: float) -> None:
+        """
+        Stop dispatching new elements and give grace_seconds to the requests in flight to complete.
+        May be called from a signal handler: implementations must not acquire any lock.
+        """
+
     @abstractmethod
     def pack(self) -> None:
         """
@@ -54,6 +72,26 @@ class Worker:
     def process_all(self) -> None:
         self.processor_type.process_all()
 
+    def use_queue(self, queue: IQueue) -> bool:
+        queue_used: bool = self.processor_type.set_queue(queue)
+        if not queue_used:
+            self.logger.log_warn(f"Processor {type(self.processor_type).__name__} cannot use the queue {type(queue).__name__}, keeping its own queue.")
+        return queue_used
+
+    def request_drain(self, grace_seconds: float) -> None:
+        self.processor_type.request_drain(grace_seconds)
+
+    def use_llm_request(self, llm_request: any) -> bool:
+        llm_request_used: bool = self.processor_type.set_llm_request(llm_request)
+        if not llm_request_used:
+            self.logger.log_warn(f"Processor {type(self.processor_type).__name__} cannot switch to another transformation.")
+        return llm_request_used
+
+    def use_journal(self, journal: any) -> bool:
+        journal_used: bool = self.processor_type.set_journal(journal)
+        if not journal_used:
+            self.logger.log_warn(f"Processor {type(self.processor_type).__name__} does not support journaling, responses will not be checkpointed.")
+        return journal_used
 
 class MultithreadedWorkers(Worker):
 
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict
+
+from domain.queue import Metadata
+from domain.logger import GenericLogger
+
+
+class CheckpointJournal:
+    # Append only journal of the LLM responses already received, one JSON object per line.
+    # Entries are keyed by a fingerprint of the segment and only replayed for the same input file and run settings.
+    FSYNC_EVERY: int = 10
+    FSYNC_MAX_SECONDS: float = 5.0
+
+    def __init__(self, journal_path: str, input_file_hash: str, run_key: str, resume: bool, logger: GenericLogger):
+        self.journal_path: str = journal_path
+        self.input_file_hash: str = input_file_hash
+        self.run_key: str = run_key
+        self.logger: GenericLogger = logger
+        self.thread_lock = threading.Lock()
+        self.responses: Dict[str, str] = {}
+        self.unsynced: int = 0
+        self.last_sync: float = time.monotonic()
+        if resume:
+            self.__load()
+        elif os.path.exists(journal_path):
+            self.logger.log_warn(f"Discarding previous journal {journal_path} (use --resume to replay it)")
+            os.remove(journal_path)
+        self.journal_file = open(journal_path, "a", encoding="utf-8")
+
+    @staticmethod
+    def compute_file_hash(file_path: str) -> str:
+        file_hash = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+    @staticmethod
+    def fingerprint(metadata: Metadata) -> str:
+        segment: str = "\0".join([str(metadata.get_request_type()),
+                                  str(metadata.get_context()),
+                                  str(metadata.get_text_to_transform()),
+                                  json.dumps(metadata.get_locator(), sort_keys=True)])
+        return hashlib.sha256(segment.encode("utf-8")).hexdigest()
+
+    def __load(self) -> None:
+        if not os.path.exists(self.journal_path):
+            self.logger.log_warn(f"No journal {self.journal_path} found: nothing to resume, processing the whole document")
+            return
+        ignored: int = 0
+        with open(self.journal_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry: Dict = json.loads(line)
+                except json.JSONDecodeError:
+                    # Typically the last line when the process was killed while writing
+                    self.logger.log_warn(f"Ignoring truncated journal line: {line[0:50]}...")
+                    continue
+                if entry["file_hash"] != self.input_file_hash or entry["run_key"] != self.run_key:
+                    ignored += 1
+                    continue
+                self.responses[entry["fingerprint"]] = entry["response"]
+        self.logger.log_info(f"Resuming from journal {self.journal_path}: {len(self.responses)} responses available, {ignored} ignored (other input file or settings)")
+        with open(self.journal_path, "rb+") as f:
+            # Terminate a truncated last line so that new entries start on their own line
+            f.seek(0, os.SEEK_END)
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+
+    def get_response(self, fingerprint: str) -> str:
+        self.thread_lock.acquire()
+        response: str = self.responses.get(fingerprint)
+        self.thread_lock.release()
+        return response
+
+    def __sync(self) -> None:
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def append(self, fingerprint: str, request_type: str, response: str) -> None:
+        entry: Dict = {"file_hash": self.input_file_hash, "run_key": self.run_key,
+                       "fingerprint": fingerprint, "request_type": request_type, "response": response}
+        self.thread_lock.acquire()
+        self.journal_file.write(json.dumps(entry) + "\n")
+        # Flushing to the OS is enough to survive the process being killed, fsync protects against a machine crash
+        self.journal_file.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.FSYNC_EVERY or time.monotonic() - self.last_sync > self.FSYNC_MAX_SECONDS:
+            self.__sync()
+        self.thread_lock.release()
+
+    def close(self, remove: bool = False) -> None:
+        self.thread_lock.acquire()
+        if not self.journal_file.closed:
+            self.__sync()
+            self.journal_file.close()
+        self.thread_lock.release()
+        if remove and os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
@@ -0,0 +1,165 @@
+from typing import Dict, List, Tuple
+import threading
+import time
+
+from domain.llm_endpoint_request import LLMEndpointRequest
+from domain.queue import Metadata
+from domain.logger import GenericLogger
+from infrastructure.processors import SerializedDocProcessorType
+from infrastructure.job_store import JobStore
+
+
+class JobStoreCoordinatorProcessorType(SerializedDocProcessorType):
+    # Requests are built locally and published to the job store, the LLM calls are performed by
+    # `transform_document worker` processes. Responses are written back here, in their order of completion.
+    EXECUTOR_NAME: str = "job_store"
+    PUBLISH_BATCH: int = 500
+    POLL_SECONDS: float = 1.0
+    PROGRESS_SECONDS: float = 30.0
+
+    def __init__(self, llm_request: LLMEndpointRequest, logger: GenericLogger, job_store: JobStore):
+        super().__init__(llm_request, logger)
+        self.job_store: JobStore = job_store
+
+    def __publish(self) -> Dict[int, Metadata]:
+        published: Dict[int, Metadata] = {}
+        items: List[Tuple[int, str, str]] = []
+        while not self.is_empty() and not self._is_draining():
+            metadata: Metadata = self.pop_next_element()
+            if self._replay(metadata):
+                continue
+            request: str = self._build_request(metadata)
+            if request is None:
+                continue
+            item_id: int = len(published)
+            published[item_id] = metadata
+            items.append((item_id, request, metadata.get_request_type()))
+            if len(items) >= self.PUBLISH_BATCH:
+                self.job_store.add_items(items)
+                items = []
+        if len(items) > 0:
+            self.job_store.add_items(items)
+        self.logger.log_info(f"Published {len(published)} requests to the job store {self.job_store.store_path}, waiting for workers")
+        return published
+
+    def __apply_finished_items(self, published: Dict[int, Metadata]) -> int:
+        finished_items: List[Tuple[int, str, str]] = self.job_store.get_finished_items()
+        for item_id, status, response in finished_items:
+            metadata: Metadata = published.pop(item_id)
+            if status == JobStore.FAILED:
+                self.logger.log_error(f"All workers failed to process {metadata.get_text_to_transform()[0:50]}..., keeping the initial text")
+                continue
+            self._write_back(metadata, response)
+        if len(finished_items) > 0:
+            self.job_store.mark_applied([item_id for item_id, _, _ in finished_items])
+        return len(finished_items)
+
+    def process_all(self) -> None:
+        self.trigger_process_start()
+        self.metrics.start()
+        published: Dict[int, Metadata] = self.__publish()
+        total: int = len(published)
+        last_progress: float = time.monotonic()
+        try:
+            while len(published) > 0 and self._get_grace_seconds_left() != 0.0:
+                if self.__apply_finished_items(published) > 0:
+                    self.logger.log_info(f"Applied {total - len(published)} responses out of {total}")
+                    continue
+                if time.monotonic() - last_progress > self.PROGRESS_SECONDS:
+                    self.logger.log_info(f"Waiting for workers, job store status: {self.job_store.get_status_counts()}")
+                    last_progress = time.monotonic()
+                time.sleep(self.POLL_SECONDS)
+        finally:
+            # Workers stop polling once the job is closed
+            self.job_store.close_job()
+            if len(published) > 0:
+                self.logger.log_warn(f"Grace period expired, {len(published)} published requests were not applied")
+            if self._is_draining():
+                self.logger.log_warn(f"Stopped publishing requests, {self.size()} elements were not published")
+        self.metrics.stop()
+        self.logger.log_info(self.metrics.get_statistics())
+
+
+class JobStoreWorker:
+    # Claims requests from the job store, keeps their lease alive while the LLM is working on them and posts the responses.
+    POLL_SECONDS: float = 2.0
+    MAX_ATTEMPTS: int = 3
+
+    def __init__(self, job_store: JobStore, llm_request: LLMEndpointRequest, logger: GenericLogger,
+                 worker_id: str, lease_seconds: float = 120, max_parallel_thread: int = 1, exit_when_idle: bool = False):
+        self.job_store: JobStore = job_store
+        self.llm_request: LLMEndpointRequest = llm_request
+        self.logger: GenericLogger = logger
+        self.worker_id: str = worker_id
+        self.lease_seconds: float = lease_seconds
+        self.max_parallel_thread: int = max(1, max_parallel_thread)
+        self.exit_when_idle: bool = exit_when_idle
+        self.stop_now: bool = False
+        self.thread_lock = threading.Lock()
+        self.processed: int = 0
+
+    def request_stop(self) -> None:
+        # Single assignment: safe to be called from a signal handler
+        self.stop_now = True
+
+    def is_stopping(self) -> bool:
+        return self.stop_now
+
+    def __keep_lease(self, item_id: int, owner: str, done: threading.Event) -> None:
+        while not done.wait(self.lease_seconds / 3):
+            if not self.job_store.heartbeat(item_id, owner, self.lease_seconds):
+                self.logger.log_warn(f"{owner}: lease lost for request {item_id}")
+                break
+        # Closes the connection opened by this thread, if any
+        self.job_store.close()
+
+    def __process_item(self, item_id: int, request: str, request_type: str, owner: str) -> None:
+        done: threading.Event = threading.Event()
+        heartbeat_thread: threading.Thread = threading.Thread(target=self.__keep_lease, args=(item_id, owner, done), daemon=True)
+        heartbeat_thread.start()
+        try:
+            response: str = self.llm_request.transform_text(request, request_type)
+        except Exception as err:
+            self.logger.log_error(f"{owner}: request {item_id} failed: {err=}, {type(err)=}")
+            done.set()
+            heartbeat_thread.join()
+            self.job_store.release_item(item_id, owner, self.MAX_ATTEMPTS)
+            return
+        done.set()
+        heartbeat_thread.join()
+        if not self.job_store.post_response(item_id, owner, response):
+            self.logger.log_warn(f"{owner}: response to request {item_id} discarded, its lease expired and it was claimed again")
+            return
+        self.thread_lock.acquire()
+        self.processed += 1
+        self.thread_lock.release()
+
+    def __work(self, owner: str) -> None:
+        while not self.stop_now:
+            item: Tuple[int, str, str] = self.job_store.claim_item(owner, self.lease_seconds)
+            if item is None:
+                if self.exit_when_idle or self.job_store.is_job_closed():
+                    break
+                time.sleep(self.POLL_SECONDS)
+                continue
+            item_id, request, request_type = item
+            self.logger.log_debug(f"{owner}: processing request {item_id}")
+            self.__process_item(item_id, request, request_type, owner)
+        self.job_store.close()
+
+    def run(self) -> int:
+        threads: List[threading.Thread] = [threading.Thread(target=self.__work, args=(f"{self.worker_id}-{index}",), name=f"{self.worker_id}-{index}")
+                                           for index in range(self.max_parallel_thread)]
+        for thread in threads:
+            thread.start()
+        stop_logged: bool = False
+        for thread in threads:
+            # A timeout lets the main thread handle signals while waiting
+            while thread.is_alive():
+                thread.join(timeout=1.0)
+                if self.stop_now and not stop_logged:
+                    # Logged here: the signal handler only sets the flag
+                    stop_logged = True
+                    self.logger.log_warn(f"Request to stop worker {self.worker_id}: posting the requests in flight then exiting. Send the signal again to abort.")
+        self.logger.log_info(f"Worker {self.worker_id} processed {self.processed} requests")
+        return self.processed
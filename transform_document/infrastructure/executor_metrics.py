@@ -0,0 +1,84 @@
+import threading
+import time
+
+from domain.logger import GenericLogger
+
+
+class ExecutorMetrics:
+    def __init__(self, executor_name: str, logger: GenericLogger):
+        self.executor_name: str = executor_name
+        self.logger: GenericLogger = logger
+        self.thread_lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.thread_lock.acquire()
+        self.requests: int = 0
+        self.skipped: int = 0
+        self.replayed: int = 0
+        self.reused: int = 0
+        self.llm_seconds: float = 0.0
+        self.max_llm_seconds: float = 0.0
+        self.write_back_seconds: float = 0.0
+        self.request_chars: int = 0
+        self.response_chars: int = 0
+        self.started: float = None
+        self.stopped: float = None
+        self.thread_lock.release()
+
+    def start(self) -> None:
+        self.reset()
+        self.started = time.perf_counter()
+
+    def stop(self) -> None:
+        self.stopped = time.perf_counter()
+
+    def add_request(self, elapsed_seconds: float, request_chars: int, response_chars: int) -> None:
+        self.thread_lock.acquire()
+        self.requests += 1
+        self.llm_seconds += elapsed_seconds
+        self.max_llm_seconds = max(self.max_llm_seconds, elapsed_seconds)
+        self.request_chars += request_chars
+        self.response_chars += response_chars
+        self.thread_lock.release()
+
+    def add_skipped(self) -> None:
+        self.thread_lock.acquire()
+        self.skipped += 1
+        self.thread_lock.release()
+
+    def add_replayed(self) -> None:
+        self.thread_lock.acquire()
+        self.replayed += 1
+        self.thread_lock.release()
+
+    def add_reused(self) -> None:
+        self.thread_lock.acquire()
+        self.reused += 1
+        self.thread_lock.release()
+
+    def add_write_back(self, elapsed_seconds: float) -> None:
+        self.thread_lock.acquire()
+        self.write_back_seconds += elapsed_seconds
+        self.thread_lock.release()
+
+    def get_wall_seconds(self) -> float:
+        if self.started is None:
+            return 0.0
+        stopped: float = self.stopped if self.stopped is not None else time.perf_counter()
+        return stopped - self.started
+
+    def get_statistics(self) -> str:
+        self.thread_lock.acquire()
+        wall_seconds: float = self.get_wall_seconds()
+        average_llm_seconds: float = self.llm_seconds / self.requests if self.requests > 0 else 0.0
+        throughput: float = self.requests / wall_seconds if wall_seconds > 0 else 0.0
+        statistics: str = f'\nExecutor metrics ({self.executor_name}):\n' +\
+                          f'  Requests sent to LLM: {self.requests}, skipped: {self.skipped}, replayed from journal: {self.replayed}, ' +\
+                          f'reused from near duplicates: {self.reused}\n' +\
+                          f'  Wall time: {wall_seconds:.2f} s, throughput: {throughput:.2f} requests/s\n' +\
+                          f'  LLM time: total {self.llm_seconds:.2f} s, average {average_llm_seconds:.2f} s, max {self.max_llm_seconds:.2f} s\n' +\
+                          f'  Write back time: {self.write_back_seconds:.2f} s\n' +\
+                          f'  Characters sent: {self.request_chars}, received: {self.response_chars}'
+        self.thread_lock.release()
+        return statistics
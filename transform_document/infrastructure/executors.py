@@ -0,0 +1,173 @@
+from abc import abstractmethod
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Tuple, Type
+import asyncio
+import time
+
+from domain.llm_endpoint_request import LLMEndpointRequest
+from domain.queue import Metadata
+from domain.logger import GenericLogger
+from domain.worker_class import Worker
+from infrastructure.processors import SerializedDocProcessorType
+
+
+class ConcurrentFuturesDocProcessorType(SerializedDocProcessorType):
+    # Requests are built and written back in the calling thread, only the LLM call runs in the executor.
+    # At most max_parallel_thread elements are taken out of the queue at any time.
+
+    @abstractmethod
+    def _create_executor(self) -> Executor:
+        """
+        """
+
+    def _submit(self, executor: Executor, request: str, request_type: str) -> Future:
+        return executor.submit(self._request_llm, request, request_type)
+
+    def _get_response(self, future: Future) -> str:
+        return future.result()
+
+    def __dispatch(self, executor: Executor, in_flight: Dict[Future, Metadata]) -> None:
+        while not self.is_empty() and not self._is_draining() and len(in_flight) < self.max_parallel_thread:
+            metadata: Metadata = self.pop_next_element()
+            if self._replay(metadata):
+                continue
+            request: str = self._build_request(metadata)
+            if request is not None:
+                in_flight[self._submit(executor, request, metadata.get_request_type())] = metadata
+
+    def process_all(self) -> None:
+        self.trigger_process_start()
+        self.metrics.start()
+        in_flight: Dict[Future, Metadata] = {}
+        executor: Executor = self._create_executor()
+        try:
+            self.__dispatch(executor, in_flight)
+            while len(in_flight) > 0 and self._get_grace_seconds_left() != 0.0:
+                done, _ = wait(in_flight.keys(), timeout=self.WAIT_SECONDS, return_when=FIRST_COMPLETED)
+                for future in done:
+                    metadata: Metadata = in_flight.pop(future)
+                    try:
+                        self._write_back(metadata, self._get_response(future))
+                    except Exception as err:
+                        self.logger.log_error(f"Request failed for {metadata.get_text_to_transform()[0:50]}...: {err=}, {type(err)=}")
+                    self.display_remaining_effort()
+                self.__dispatch(executor, in_flight)
+        finally:
+            if len(in_flight) > 0:
+                self.logger.log_warn(f"Grace period expired, abandoning {len(in_flight)} requests in flight")
+            if self._is_draining():
+                self.logger.log_warn(f"Stopped dispatching requests, {self.size()} elements were not processed")
+            # Requests abandoned after the grace period are never written back
+            executor.shutdown(wait=len(in_flight) == 0, cancel_futures=True)
+        self.metrics.stop()
+        self.logger.log_info(self.metrics.get_statistics())
+
+
+class ThreadPoolDocProcessorType(ConcurrentFuturesDocProcessorType):
+    EXECUTOR_NAME: str = "threads"
+
+    def _create_executor(self) -> Executor:
+        return ThreadPoolExecutor(max_workers=self.max_parallel_thread, thread_name_prefix="llm-request")
+
+
+# Each child process receives its own copy of the LLM requester once, when it starts
+_process_llm_request: LLMEndpointRequest = None
+
+def _init_process_llm_request(llm_request: LLMEndpointRequest) -> None:
+    global _process_llm_request
+    _process_llm_request = llm_request
+
+def _transform_text_in_process(request: str, request_type: str) -> Tuple[str, float]:
+    started: float = time.perf_counter()
+    new_text: str = _process_llm_request.transform_text(request, request_type)
+    return new_text, time.perf_counter() - started
+
+
+class ProcessPoolDocProcessorType(ConcurrentFuturesDocProcessorType):
+    # Document objects cannot be shared between processes: only the prompt is sent to the
+    # child processes, the write back happens in the parent process.
+    EXECUTOR_NAME: str = "processes"
+
+    def __init__(self, llm_request: LLMEndpointRequest, logger: GenericLogger, max_parallel_thread: int = 1):
+        super().__init__(llm_request, logger, max_parallel_thread)
+        self.request_sizes: Dict[Future, int] = {}
+
+    def _create_executor(self) -> Executor:
+        return ProcessPoolExecutor(max_workers=self.max_parallel_thread,
+                                   initializer=_init_process_llm_request,
+                                   initargs=(self.llm_request,))
+
+    def _submit(self, executor: Executor, request: str, request_type: str) -> Future:
+        future: Future = executor.submit(_transform_text_in_process, request, request_type)
+        self.request_sizes[future] = len(request)
+        return future
+
+    def _get_response(self, future: Future) -> str:
+        request_size: int = self.request_sizes.pop(future, 0)
+        new_text, elapsed_seconds = future.result()
+        self.metrics.add_request(elapsed_seconds, request_size, len(new_text))
+        return new_text
+
+
+class AsyncioDocProcessorType(SerializedDocProcessorType):
+    # All requests are awaited from a single event loop, write back happens in the loop thread.
+    EXECUTOR_NAME: str = "asyncio"
+
+    async def __request_llm_async(self, request: str, request_type: str) -> str:
+        started: float = time.perf_counter()
+        new_text: str = await self.llm_request.transform_text_async(request, request_type)
+        self.metrics.add_request(time.perf_counter() - started, len(request), len(new_text))
+        return new_text
+
+    def __dispatch(self, in_flight: Dict[asyncio.Task, Metadata]) -> None:
+        while not self.is_empty() and not self._is_draining() and len(in_flight) < self.max_parallel_thread:
+            metadata: Metadata = self.pop_next_element()
+            if self._replay(metadata):
+                continue
+            request: str = self._build_request(metadata)
+            if request is not None:
+                task: asyncio.Task = asyncio.create_task(self.__request_llm_async(request, metadata.get_request_type()))
+                in_flight[task] = metadata
+
+    async def __process_all_async(self) -> None:
+        in_flight: Dict[asyncio.Task, Metadata] = {}
+        self.__dispatch(in_flight)
+        while len(in_flight) > 0 and self._get_grace_seconds_left() != 0.0:
+            done, _ = await asyncio.wait(in_flight.keys(), timeout=self.WAIT_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                metadata: Metadata = in_flight.pop(task)
+                try:
+                    self._write_back(metadata, task.result())
+                except Exception as err:
+                    self.logger.log_error(f"Request failed for {metadata.get_text_to_transform()[0:50]}...: {err=}, {type(err)=}")
+                self.display_remaining_effort()
+            self.__dispatch(in_flight)
+        if len(in_flight) > 0:
+            self.logger.log_warn(f"Grace period expired, cancelling {len(in_flight)} requests in flight")
+            for task in in_flight.keys():
+                task.cancel()
+        if self._is_draining():
+            self.logger.log_warn(f"Stopped dispatching requests, {self.size()} elements were not processed")
+
+    def process_all(self) -> None:
+        self.trigger_process_start()
+        self.metrics.start()
+        asyncio.run(self.__process_all_async())
+        self.metrics.stop()
+        self.logger.log_info(self.metrics.get_statistics())
+
+
+EXECUTOR_BACKENDS: Dict[str, Type[SerializedDocProcessorType]] = {
+    SerializedDocProcessorType.EXECUTOR_NAME: SerializedDocProcessorType,
+    ThreadPoolDocProcessorType.EXECUTOR_NAME: ThreadPoolDocProcessorType,
+    AsyncioDocProcessorType.EXECUTOR_NAME: AsyncioDocProcessorType,
+    ProcessPoolDocProcessorType.EXECUTOR_NAME: ProcessPoolDocProcessorType,
+}
+
+def get_executor_names() -> List[str]:
+    return list(EXECUTOR_BACKENDS.keys())
+
+def create_worker(executor_name: str, llm_request: LLMEndpointRequest, logger: GenericLogger, max_parallel_thread: int) -> Worker:
+    processor_type: SerializedDocProcessorType = EXECUTOR_BACKENDS[executor_name](llm_request, logger, max_parallel_thread)
+    logger.log_info(f"Running with executor {executor_name} ({processor_type.max_parallel_thread} parallel requests)")
+    return Worker(processor_type, logger)
@@ -0,0 +1,48 @@
+import hashlib
+import json
+import os
+from typing import Dict, List
+
+from domain.logger import GenericLogger
+
+
+class ExtractionCache:
+    # Segments extracted from an input file, stored as records (text, context, request type, locator) in their order.
+    # Further runs on the same file with the same extraction options skip the parsing and go straight to dispatch,
+    # the locators are resolved to the objects of the document only when the responses are written back.
+    VERSION: int = 1
+
+    def __init__(self, cache_directory: str, input_file_hash: str, options: Dict, logger: GenericLogger):
+        self.logger: GenericLogger = logger
+        key: str = hashlib.sha256(json.dumps({"version": self.VERSION, "file_hash": input_file_hash, "options": options},
+                                             sort_keys=True).encode("utf-8")).hexdigest()
+        self.cache_path: str = os.path.join(cache_directory, f"{key}.json")
+
+    def load(self) -> List[Dict]:
+        """
+        Returns the cached records, None when the input file was not extracted yet with these options.
+        """
+        if not os.path.exists(self.cache_path):
+            self.logger.log_info(f"No extraction cached in {self.cache_path}, extracting the document")
+            return None
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                records: List[Dict] = json.load(f)["records"]
+        except (OSError, json.JSONDecodeError, KeyError) as err:
+            self.logger.log_warn(f"Ignoring unreadable extraction cache {self.cache_path}: {err=}")
+            return None
+        self.logger.log_info(f"Using {len(records)} segments extracted in a previous run from {self.cache_path}")
+        return records
+
+    def save(self, records: List[Dict]) -> None:
+        temporary_path: str = f"{self.cache_path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            with open(temporary_path, "w", encoding="utf-8") as f:
+                json.dump({"version": self.VERSION, "records": records}, f, ensure_ascii=False)
+            # Concurrent runs on the same file never read a partially written cache
+            os.replace(temporary_path, self.cache_path)
+        except OSError as err:
+            self.logger.log_warn(f"Could not write the extraction cache {self.cache_path}: {err=}")
+            return
+        self.logger.log_info(f"Cached {len(records)} extracted segments in {self.cache_path}")
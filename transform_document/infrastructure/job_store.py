@@ -0,0 +1,165 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Tuple
+
+from domain.logger import GenericLogger
+
+
+class JobStore:
+    # Shared SQLite job store used to fan out the requests of one document over several worker processes or hosts.
+    # The coordinator adds the requests and applies the responses, workers lease requests, keep their lease
+    # alive with heartbeats and post the responses. A request whose lease expired can be claimed again.
+    PENDING: str = "pending"
+    LEASED: str = "leased"
+    DONE: str = "done"
+    FAILED: str = "failed"
+    APPLIED: str = "applied"
+
+    JOB_OPEN: str = "open"
+    JOB_CLOSED: str = "closed"
+
+    BUSY_TIMEOUT_SECONDS: float = 60.0
+
+    def __init__(self, store_path: str, logger: GenericLogger):
+        self.store_path: str = store_path
+        self.logger: GenericLogger = logger
+        # One connection per thread: SQLite connections cannot be shared across threads
+        self.thread_local = threading.local()
+        # Stamp of the job this store works on: a store replaced by the one of another job is considered closed
+        self.job_id: str = None
+
+    def __get_connection(self) -> sqlite3.Connection:
+        connection: sqlite3.Connection = getattr(self.thread_local, "connection", None)
+        if connection is None:
+            # isolation_level None: transactions are explicitly started with BEGIN IMMEDIATE
+            connection = sqlite3.connect(self.store_path, timeout=self.BUSY_TIMEOUT_SECONDS, isolation_level=None)
+            # WAL is not reliable on network file systems, keep the default rollback journal
+            connection.execute("PRAGMA journal_mode=DELETE")
+            self.thread_local.connection = connection
+        return connection
+
+    def create_job(self, job_configuration: Dict) -> None:
+        # The store is built aside and moved into place once complete: workers never see a partial store,
+        # and the ones still connected to a previous store keep reading it instead of a removed file.
+        self.close()
+        self.job_id = uuid.uuid4().hex
+        building_path: str = f'{self.store_path}.tmp'
+        if os.path.exists(building_path):
+            os.remove(building_path)
+        connection: sqlite3.Connection = sqlite3.connect(building_path, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=DELETE")
+        connection.execute("BEGIN IMMEDIATE")
+        connection.execute("CREATE TABLE job (key TEXT PRIMARY KEY, value TEXT)")
+        connection.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, request TEXT, request_type TEXT, " +\
+                           "status TEXT, lease_owner TEXT, lease_expires REAL, heartbeat REAL, attempts INTEGER DEFAULT 0, response TEXT)")
+        connection.execute("CREATE INDEX items_status ON items (status, id)")
+        connection.execute("INSERT INTO job VALUES ('configuration', ?), ('status', ?), ('job_id', ?)",
+                           (json.dumps(job_configuration), self.JOB_OPEN, self.job_id))
+        connection.execute("COMMIT")
+        connection.close()
+        if os.path.exists(self.store_path):
+            self.logger.log_warn(f"Replacing previous job store {self.store_path}")
+        os.replace(building_path, self.store_path)
+        self.logger.log_info(f"Created job store {self.store_path} for job {self.job_id}")
+
+    def __read_job(self, connection: sqlite3.Connection) -> Dict[str, str]:
+        try:
+            return dict(connection.execute("SELECT key, value FROM job").fetchall())
+        except sqlite3.OperationalError as err:
+            # Store created by an older coordinator still being built
+            if "no such table" in str(err):
+                return {}
+            raise
+
+    def get_job_configuration(self) -> Dict:
+        """
+        Returns the configuration of the open job of the store and binds this store to it, None while no job is open.
+        """
+        job: Dict[str, str] = self.__read_job(self.__get_connection())
+        if "configuration" not in job or job.get("status") != self.JOB_OPEN:
+            # The next attempt reads the file found at the path, it may have been replaced meanwhile
+            self.close()
+            return None
+        self.job_id = job.get("job_id")
+        return json.loads(job["configuration"])
+
+    def is_job_closed(self) -> bool:
+        job: Dict[str, str] = self.__read_job(self.__get_connection())
+        if job.get("status") != self.JOB_OPEN:
+            return True
+        # The connection reads the store opened first: a coordinator restarted meanwhile replaced it with a new job
+        if not os.path.exists(self.store_path):
+            return True
+        connection: sqlite3.Connection = sqlite3.connect(self.store_path, timeout=self.BUSY_TIMEOUT_SECONDS)
+        try:
+            return self.__read_job(connection).get("job_id") != self.job_id
+        finally:
+            connection.close()
+
+    def close_job(self) -> None:
+        self.__get_connection().execute("UPDATE job SET value = ? WHERE key = 'status'", (self.JOB_CLOSED,))
+
+    def add_items(self, items: List[Tuple[int, str, str]]) -> None:
+        connection: sqlite3.Connection = self.__get_connection()
+        connection.execute("BEGIN IMMEDIATE")
+        connection.executemany("INSERT INTO items (id, request, request_type, status) VALUES (?, ?, ?, ?)",
+                               [(item_id, request, request_type, self.PENDING) for item_id, request, request_type in items])
+        connection.execute("COMMIT")
+
+    def claim_item(self, owner: str, lease_seconds: float) -> Tuple[int, str, str]:
+        connection: sqlite3.Connection = self.__get_connection()
+        now: float = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row: Tuple = connection.execute("SELECT id, request, request_type FROM items WHERE status = ? OR (status = ? AND lease_expires < ?) ORDER BY id LIMIT 1",
+                                            (self.PENDING, self.LEASED, now)).fetchone()
+            if row is not None:
+                connection.execute("UPDATE items SET status = ?, lease_owner = ?, lease_expires = ?, heartbeat = ?, attempts = attempts + 1 WHERE id = ?",
+                                   (self.LEASED, owner, now + lease_seconds, now, row[0]))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return row
+
+    def heartbeat(self, item_id: int, owner: str, lease_seconds: float) -> bool:
+        now: float = time.time()
+        cursor: sqlite3.Cursor = self.__get_connection().execute("UPDATE items SET lease_expires = ?, heartbeat = ? WHERE id = ? AND status = ? AND lease_owner = ?",
+                                                                 (now + lease_seconds, now, item_id, self.LEASED, owner))
+        return cursor.rowcount > 0
+
+    def post_response(self, item_id: int, owner: str, response: str) -> bool:
+        # Only the current lease owner can post: a worker whose lease expired lost the item
+        cursor: sqlite3.Cursor = self.__get_connection().execute("UPDATE items SET status = ?, response = ? WHERE id = ? AND status = ? AND lease_owner = ?",
+                                                                 (self.DONE, response, item_id, self.LEASED, owner))
+        return cursor.rowcount > 0
+
+    def release_item(self, item_id: int, owner: str, max_attempts: int) -> bool:
+        # A failed request is given back to any worker until it failed max_attempts times
+        cursor: sqlite3.Cursor = self.__get_connection().execute("UPDATE items SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, lease_owner = NULL " +\
+                                                                 "WHERE id = ? AND status = ? AND lease_owner = ?",
+                                                                 (max_attempts, self.FAILED, self.PENDING, item_id, self.LEASED, owner))
+        return cursor.rowcount > 0
+
+    def get_finished_items(self, limit: int = 100) -> List[Tuple[int, str, str]]:
+        return self.__get_connection().execute("SELECT id, status, response FROM items WHERE status IN (?, ?) ORDER BY id LIMIT ?",
+                                               (self.DONE, self.FAILED, limit)).fetchall()
+
+    def mark_applied(self, item_ids: List[int]) -> None:
+        connection: sqlite3.Connection = self.__get_connection()
+        connection.execute("BEGIN IMMEDIATE")
+        connection.executemany("UPDATE items SET status = ?, response = NULL WHERE id = ?", [(self.APPLIED, item_id) for item_id in item_ids])
+        connection.execute("COMMIT")
+
+    def get_status_counts(self) -> Dict[str, int]:
+        return dict(self.__get_connection().execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall())
+
+    def close(self) -> None:
+        connection: sqlite3.Connection = getattr(self.thread_local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.thread_local.connection = None
@@ -0,0 +1,158 @@
+import json
+import math
+import os
+import re
+from typing import Dict, List, Tuple
+
+from domain.logger import GenericLogger
+from domain.segmenter import TokenBudgetSegmenter
+
+
+class LanguageDetector:
+    # Offline language identification from character trigrams: each shipped profile gives the log probability of
+    # the most frequent trigrams of one language (words padded with spaces), the others get the unknown probability.
+    PROFILES_PATH: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "language_profiles.json")
+    WORD_REGEXP = re.compile(r'[^\W\d_]+')
+    MIN_NGRAMS: int = 20
+    # The probability is only relative to the shipped languages, a text in another language or mixing languages
+    # gets one of them with a probability close to 1: these thresholds do not depend on the length of the text.
+    MIN_COVERAGE: float = 0.45
+    MIN_MARGIN: float = 0.2
+    WINDOW_LETTERS: int = 40
+    WINDOW_MIN_MARGIN: float = 0.1
+
+    def __init__(self, logger: GenericLogger, profiles_path: str = None):
+        self.logger: GenericLogger = logger
+        with open(profiles_path or self.PROFILES_PATH, encoding="utf-8") as f:
+            profiles: Dict = json.load(f)
+        self.ngram_size: int = profiles["ngram_size"]
+        self.profiles: Dict[str, Dict] = profiles["languages"]
+
+    def get_languages(self) -> List[str]:
+        return list(self.profiles.keys())
+
+    def __get_ngrams(self, text: str) -> List[str]:
+        ngrams: List[str] = []
+        for word in self.WORD_REGEXP.findall(text.lower()):
+            word = f" {word} "
+            ngrams.extend([word[index:index + self.ngram_size] for index in range(len(word) - self.ngram_size + 1)])
+        return ngrams
+
+    def __get_scores(self, ngrams: List[str]) -> Dict[str, float]:
+        scores: Dict[str, float] = {}
+        for language, profile in self.profiles.items():
+            ngram_scores: Dict[str, float] = profile["ngrams"]
+            unknown_score: float = profile["unknown"]
+            scores[language] = sum(ngram_scores.get(ngram, unknown_score) for ngram in ngrams)
+        return scores
+
+    def __get_margin(self, scores: Dict[str, float], ngram_count: int) -> float:
+        # Mean log probability per trigram between the best language and the next one
+        best_scores: List[float] = sorted(scores.values(), reverse=True)
+        return (best_scores[0] - best_scores[1]) / ngram_count if len(best_scores) > 1 else math.inf
+
+    def detect(self, text: str) -> Tuple[str, float]:
+        """
+        Returns the most likely language of the text and its probability among the known languages,
+        (None, 0.0) when the text is too short to be identified.
+        """
+        ngrams: List[str] = self.__get_ngrams(text)
+        if len(ngrams) < self.MIN_NGRAMS:
+            return None, 0.0
+        scores: Dict[str, float] = self.__get_scores(ngrams)
+        best_language: str = max(scores, key=scores.get)
+        # Probabilities with uniform priors, relative to the best score to avoid underflows
+        total: float = sum(math.exp(score - scores[best_language]) for score in scores.values())
+        return best_language, 1.0 / total
+
+    def is_reliable(self, text: str, language: str) -> bool:
+        """
+        Returns whether the text is close enough to the profile of the language detected for it: enough of its
+        trigrams are frequent in this language and it is clearly closer to it than to any other known language.
+        """
+        ngrams: List[str] = self.__get_ngrams(text)
+        if len(ngrams) == 0:
+            return False
+        profile_ngrams: Dict[str, float] = self.profiles[language]["ngrams"]
+        coverage: float = sum(1 for ngram in ngrams if ngram in profile_ngrams) / len(ngrams)
+        return coverage >= self.MIN_COVERAGE and self.__get_margin(self.__get_scores(ngrams), len(ngrams)) >= self.MIN_MARGIN
+
+    def get_window_languages(self, text: str) -> List[str]:
+        """
+        Returns the language of each run of about WINDOW_LETTERS letters of the text, None for the runs too close
+        to several languages: a paragraph mixing languages has runs in each of them.
+        """
+        windows: List[List[str]] = [[]]
+        letters: int = 0
+        for word in self.WORD_REGEXP.findall(text):
+            if letters >= self.WINDOW_LETTERS:
+                windows.append([])
+                letters = 0
+            windows[-1].append(word)
+            letters += len(word)
+        if len(windows) > 1 and letters < self.WINDOW_LETTERS / 2:
+            windows[-2].extend(windows.pop())
+        window_languages: List[str] = []
+        for window in windows:
+            ngrams: List[str] = self.__get_ngrams(" ".join(window))
+            if len(ngrams) == 0:
+                continue
+            scores: Dict[str, float] = self.__get_scores(ngrams)
+            window_languages.append(max(scores, key=scores.get) if self.__get_margin(scores, len(ngrams)) >= self.WINDOW_MIN_MARGIN else None)
+        return window_languages
+
+
+class TargetLanguageFilter:
+    # Segments already written in the target language of a translation are kept unchanged without any LLM call.
+    # Sections can mix languages: every paragraph long enough to be identified must be in the target language.
+    DEFAULT_MIN_CONFIDENCE: float = 0.95
+
+    def __init__(self, target_language: str, logger: GenericLogger, min_confidence: float = DEFAULT_MIN_CONFIDENCE):
+        self.logger: GenericLogger = logger
+        self.detector: LanguageDetector = LanguageDetector(logger)
+        self.target_language: str = target_language.strip().lower()
+        self.min_confidence: float = min_confidence
+        self.skipped: int = 0
+        self.checked: int = 0
+        self.detected: Dict[str, int] = {}
+
+    def is_supported(self) -> bool:
+        return self.target_language in self.detector.get_languages()
+
+    def __is_in_target_language(self, text: str) -> bool:
+        # Delimiters of merged sections are not part of the text of the document
+        text = TokenBudgetSegmenter.SEGMENT_MARK_REGEXP.sub('', text.replace(TokenBudgetSegmenter.SEGMENTS_RULE, ''))
+        identified_paragraphs: int = 0
+        for paragraph in text.split('\n'):
+            language, confidence = self.detector.detect(paragraph)
+            if language is None:
+                continue
+            self.detected[language] = self.detected.get(language, 0) + 1
+            if language != self.target_language or confidence < self.min_confidence:
+                return False
+            # Languages without profile and mixed paragraphs are also detected as one of the known languages
+            if not self.detector.is_reliable(paragraph, language):
+                return False
+            if any(window_language not in [None, self.target_language] for window_language in self.detector.get_window_languages(paragraph)):
+                return False
+            identified_paragraphs += 1
+        return identified_paragraphs > 0
+
+    def classify(self, texts: List[str]) -> List[bool]:
+        """
+        Returns for each text whether it has to be sent to the LLM.
+        """
+        keep: List[bool] = []
+        for text in texts:
+            already_translated: bool = self.__is_in_target_language(text)
+            if already_translated:
+                self.logger.log_debug(f"Skipping segment already in {self.target_language}: {text[0:50]}")
+                self.skipped += 1
+            keep.append(not already_translated)
+        self.checked += len(texts)
+        return keep
+
+    def get_statistics(self) -> str:
+        languages: str = ', '.join([f"{language} {count}" for language, count in sorted(self.detected.items(), key=lambda detected: -detected[1])])
+        return f"Language filter skipped {self.skipped} of {self.checked} segments already in {self.target_language} " + \
+               f"({self.skipped} LLM calls saved), languages of the paragraphs checked: {languages}"
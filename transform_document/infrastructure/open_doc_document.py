@@ -1,172 +1,196 @@
 import re
 from docx import Document
-from typing  import List, Dict
-from pprint import pprint, pformat
+from typing  import List, Dict, Tuple
+from pprint import pprint
 
 from domain.llm_utils import LLMUtils
 from domain.worker_class import Worker
-from domain.queue import MetadataDoc
+from domain.queue import Metadata, MetadataDoc, DocumentStyles
+from domain.segmenter import TokenBudgetSegmenter
+from domain.table_engine import TableEngine
 from infrastructure.open_microsoft_document import IOpenAndUpdateDocument
 from infrastructure.generic_logger import GenericLogger
 from docx.enum.style import WD_STYLE_TYPE
+from docx.text.paragraph import Paragraph
+from docx.table import Table
+from docx.oxml.ns import qn
+
+class Section:
+    # One heading of the document with the paragraphs and tables up to the next heading, sub headings are children.
+    # The body items keep the document order: positions in the paragraph lists and tables.
+    __slots__ = ("level", "heading_name", "heading_pointer", "paragraph_pointers", "paragraph_texts", "body_items", "children", "_text")
+
+    def __init__(self, level: int, heading_name: str = None, heading_pointer: any = None):
+        self.level: int = level
+        self.heading_name: str = heading_name
+        self.heading_pointer: any = heading_pointer
+        self.paragraph_pointers: List = []
+        self.paragraph_texts: List[str] = []
+        self.body_items: List = []
+        self.children: List[Section] = []
+        self._text: str = None
+
+    def add_paragraph(self, paragraph_pointer: any, paragraph_text: str) -> None:
+        self.paragraph_pointers.append(paragraph_pointer)
+        self.paragraph_texts.append(paragraph_text)
+        self.body_items.append(len(self.paragraph_pointers) - 1)
+        self._text = None
+
+    def add_table(self, table_pointer: Table) -> None:
+        self.body_items.append(table_pointer)
+
+    def has_tables(self) -> bool:
+        return len(self.body_items) > len(self.paragraph_pointers)
+
+    def get_runs(self) -> List[Tuple[List[int], Table]]:
+        """
+        Returns the paragraphs of the section split at its tables: each run of paragraph positions with the table
+        following it, None for the last run.
+        """
+        runs: List[Tuple[List[int], Table]] = []
+        paragraph_indexes: List[int] = []
+        for body_item in self.body_items:
+            if isinstance(body_item, Table):
+                runs.append((paragraph_indexes, body_item))
+                paragraph_indexes = []
+            else:
+                paragraph_indexes.append(body_item)
+        runs.append((paragraph_indexes, None))
+        return runs
+
+    def get_pointers(self) -> List:
+        return [self.heading_pointer] + self.paragraph_pointers
+
+    def get_text(self) -> str:
+        # Joined only when requested: the text of a section is built once, not grown paragraph per paragraph
+        if self._text is None:
+            self._text = "".join([f"{self.heading_name}\n"] + [f"{paragraph_text}\n" for paragraph_text in self.paragraph_texts])
+        return self._text
+
 
 class OpenDOCDocument(IOpenAndUpdateDocument):
-    HEADING_NAME: str = "Heading name"
-    SECTION_TEXT: str = "Paragraph text"
-    HEADING_POINTER: str = "Heading Pointer"
-    PARAGRAPH_POINTERS: str = "Paragraph Pointers"
-    INIT_HEADING = "no heading"
+    SAVES_MODIFIED_PARTS: bool = True
+    # Level given to the main title of the document, when it starts with a paragraph instead of a heading
+    TITLE_LEVEL: int = 0
+    PARAGRAPH_TAG: str = qn('w:p')
+    TABLE_TAG: str = qn('w:tbl')
     def __init__(self, 
                  document_path: str,
                  worker: Worker, 
                  paragraph_start_min_word_numbers: int,
                  paragraph_start_min_word_length: int, 
-                 logger: GenericLogger,  force_context: str = None):
+                 logger: GenericLogger,  force_context: str = None,
+                 max_request_tokens: int = TokenBudgetSegmenter.DEFAULT_MAX_REQUEST_TOKENS,
+                 json_tables: bool = False):
         super().__init__(document_path, worker, 
                          paragraph_start_min_word_numbers, paragraph_start_min_word_length, 
                          logger)
         self.document =  Document(document_path)
-        self.document_styles: List = [ s for s in self.document.styles if s.type in [WD_STYLE_TYPE.PARAGRAPH, WD_STYLE_TYPE.LIST] ]
+        self.document_styles: DocumentStyles = DocumentStyles([ s for s in self.document.styles if s.type in [WD_STYLE_TYPE.PARAGRAPH, WD_STYLE_TYPE.LIST] ])
         self.logger.log_info("Styles found in document:")
         self.force_context = force_context
+        self.segmenter: TokenBudgetSegmenter = TokenBudgetSegmenter(max_request_tokens, logger)
+        self.table_engine: TableEngine = TableEngine(max_request_tokens, logger, json_tables)
         for style in self.document_styles:
             self.logger.log_info(f' * {style.name}')
+        self.__index_body()
 
-    def __get_heading_deepness(self, heading_style) -> int:
-        regexp = re.compile(r'^heading\s+(?P<heading_deepness>\d+)')
-        m = regexp.match(heading_style)
-        if m:
-            return int(m.group('heading_deepness'))
-        return -1
+    def _fork_document(self) -> None:
+        super()._fork_document()
+        self.document_styles = DocumentStyles([ s for s in self.document.styles if s.type in [WD_STYLE_TYPE.PARAGRAPH, WD_STYLE_TYPE.LIST] ])
+        self.__index_body()
 
-    def __prepend_heading_to_paragraph_text(self, heading_text, paragraph_text) -> str:
-        return heading_text + "\n" + paragraph_text
+    def __index_body(self):
+        # Single pass over the XML body: paragraphs and tables in document order, with the original position
+        # of each of them used to create and resolve locators. It must be computed before the document is updated.
+        self.body_elements: List = []
+        self.paragraph_elements: List = []
+        self.paragraph_positions: Dict = {}
+        self.table_elements: List = []
+        self.table_positions: Dict = {}
+        for element in self.document.element.body.iterchildren():
+            if element.tag == self.PARAGRAPH_TAG:
+                self.paragraph_positions[element] = len(self.paragraph_elements)
+                self.paragraph_elements.append(element)
+                self.body_elements.append(element)
+            elif element.tag == self.TABLE_TAG:
+                self.table_positions[element] = len(self.table_elements)
+                self.table_elements.append(element)
+                self.body_elements.append(element)
+        # Paragraph.style resolves the style in the styles part for every call: map style ids to names once
+        self.style_names: Dict[str, str] = {style.style_id: style.name.lower() for style in self.document.styles if style.name is not None}
+        default_style: any = self.document.styles.default(WD_STYLE_TYPE.PARAGRAPH)
+        self.default_style_name: str = default_style.name.lower() if default_style is not None else "normal"
 
-    def __append_data(self, file_content: List, current_heading_style: str, highest_heading_style: str, \
-                      latest_heading_pointer: any, heading_text: str, \
-                      latest_paragraphs_pointer: List, paragraph_text: str):
-        # When appending a new heading and assocaited text, we search for the latest element of file_content
-        # The we iterate over all heading searching for latest element of each array until parent heading is found
-        heading_deepness: int = self.__get_heading_deepness(current_heading_style)
-        if heading_deepness > 0:
-            heading_text = f"{'#' * heading_deepness} {heading_text}"
-            self.logger.log_trace(f"Found heading {current_heading_style}, deepness: {heading_deepness}, text: {heading_text}")
+    def __get_style_name(self, paragraph_element: any) -> str:
+        style_id: str = paragraph_element.style
+        if style_id is None:
+            return self.default_style_name
+        return self.style_names.get(style_id, self.default_style_name)
 
-        # paragraph_pointer: List = [latest_heading_pointer]
-        # if latest_paragraphs_pointer is not None and len(latest_paragraphs_pointer) > 0:
-        #     paragraph_pointer.extend(latest_paragraphs_pointer)
-        new_data_structure: Dict = {
-            current_heading_style:[
-                {self.HEADING_NAME: heading_text, self.HEADING_POINTER: latest_heading_pointer},
-                {self.SECTION_TEXT: self.__prepend_heading_to_paragraph_text(heading_text, paragraph_text), self.PARAGRAPH_POINTERS: latest_paragraphs_pointer}
-            ]
-        }
-        self.logger.log_trace(f"new_data_structure: {pformat(new_data_structure, width=200)}")
-        self.logger.log_trace(f"self.PARAGRAPH_POINTERS: {pformat(['Pointer: ' + str(pointer) + ', Text:' + pointer.text for pointer in new_data_structure[current_heading_style][1][self.PARAGRAPH_POINTERS]], width=200)}")
+    def resolve_locator(self, locator: Dict) -> List:
+        if "table" in locator:
+            table: Table = Table(self.table_elements[locator["table"]], self.document._body)
+            # Nested tables: row, column and index in the cell of each table from the top level one
+            for row_id, col_id, table_id in locator.get("nested", []):
+                table = table.cell(row_id, col_id).tables[table_id]
+            return [table]
+        return [Paragraph(self.paragraph_elements[position], self.document._body) for position in locator["paragraphs"]]
 
-        if (len(file_content) > 0 or current_heading_style < highest_heading_style) and \
-                            current_heading_style.startswith("heading"):
-            # Search for latest data structure indexed by a header higher than current one
-            sub_heading_found: bool = True
-            parent_data_structure: List = file_content
+    def _create_metadata(self, list_pointers: List, context: str, text: str, request_type: str, locator: Dict) -> Metadata:
+        # Only the paragraphs and tables of the body are transformed
+        self._mark_part_modified(self.document.part)
+        return MetadataDoc(list_pointers, context, text, request_type, self.logger, self.document_styles,
+                           locator=locator, pointer_resolver=self.resolve_locator)
 
-            if len(parent_data_structure) > 0:
-                while sub_heading_found:
-                    sub_heading_found = False
-                    for key, dictionary in parent_data_structure[-1].items():
-                        self.logger.log_trace(f"In for loop: key: {key}, \ndictionnary: {str(pformat(dictionary, width=200))[:100]}\n\n")
-                        if key.startswith("heading") and key < current_heading_style:
-                            self.logger.log_trace(f"**** Heading {key} accepted****")
-                            parent_data_structure = dictionary
-                            # There can be only one key
-                            sub_heading_found = True
-                            break
-            self.logger.log_trace(f"parent_data_structure: {pformat(parent_data_structure, width=200)}")
-            parent_data_structure.append(new_data_structure)
-        else:
-            file_content.append(new_data_structure)
-        self.logger.log_debug(f"file_content: {pformat(file_content, width=230)}")
+    def __get_locator(self, list_pointers: List, group_sizes: List[int] = None) -> Dict:
+        if len(list_pointers) == 1 and isinstance(list_pointers[0], Table):
+            return {"table": self.table_positions[list_pointers[0]._element]}
+        locator: Dict = {"paragraphs": [self.paragraph_positions[pointer._element] for pointer in list_pointers if pointer is not None]}
+        if group_sizes is not None:
+            # Number of pointers of each merged section, in order
+            locator["groups"] = group_sizes
+        return locator
 
-    def __iter_headings(self, paragraphs):
-        file_content: List = []
-        latest_heading_style: str = self.INIT_HEADING
-        highest_heading_style: str = self.INIT_HEADING
-        latest_heading_text: str = self.INIT_HEADING
-        latest_text_paragraph: str = ""
-        latest_paragraphs_pointer: List = []
-        latest_heading_pointer: any = None
-        # Below is an example of the data structure that is going to be created
-        # [{"Heading 1": [
-        #     {"Heading name": "Heading ...", "Pointer": pointer}
-        #     {"Text": "Full Text content below heading1", "Pointer": [pointer1, pointer2, ...]},
-        #     {"Heading 2": [
-        #         {"Heading name": "Heading ...", "Pointer": pointer}
-        #         {"Text": "Full Text content below Heading 2", "Pointer": [pointer1, pointer2, ...]},
-        #         {"Heading 3": [
-        #           {"Heading name": "Heading ...", "Pointer": pointer}
-        #           {"Text": "Full Text content below Heading 3", "Pointer": [pointer1, pointer2, ...]}
-        #         ]},
-        #         {"Heading 3": [
-        #           {"Heading name": "Heading ...", "Pointer": pointer}
-        #           {"Text": "Full Text content below Heading 3", "Pointer": [pointer1, pointer2, ...]},
-        #          ]},
-        #     ]}
-        #  ]},
-        #  {"Heading 1": [   // When appending search latest of each element until parent heading is found
-        #     {"Heading name": "Heading ...", "Pointer": pointer}
-        #     {"Text": "Full Text content below heading1", "Pointer": [pointer1, pointer2, ...]},
-        #     {"Heading 2": [
-        #         {"Heading name": "Heading ...", "Pointer": pointer}
-        #         {"Text": "Full Text content below Heading 2", "Pointer": [pointer1, pointer2, ...]}]
-        #     },
-        #     {"Heading 2": [
-        #         {"Heading name": "Heading ...", "Pointer": pointer}
-        #         {"Text": "Full Text content below Heading 2", "Pointer": [pointer1, pointer2, ...]}
-        #         {"Heading 3": [
-        #           {"Heading name": "Heading ...", "Pointer": pointer}
-        #           {"Text": "Full Text content below Heading 3", "Pointer": [pointer1, pointer2, ...]},
-        #          ]}
-        #       ]
-        #     }
-        #    ]
-        #  }
-        # ]
+    def __get_heading_deepness(self, heading_style) -> int:
+        regexp = re.compile(r'^heading\s+(?P<heading_deepness>\d+)')
+        m = regexp.match(heading_style)
+        if m:
+            return int(m.group('heading_deepness'))
+        return -1
 
-        for paragraph in paragraphs:
-            current_heading_style: str = paragraph.style.name.lower()
-            if current_heading_style.startswith('heading'):
-                # We need to consider cases where a document starts with Heading 2 and later gets Heading 1
-                if latest_heading_pointer is not None:
-                    self.logger.log_trace(f"Adding data from latest_heading_text = {latest_heading_text}")
-                    self.__append_data(file_content, latest_heading_style, highest_heading_style, \
-                                       latest_heading_pointer, latest_heading_text, \
-                                       latest_paragraphs_pointer, latest_text_paragraph)
-                latest_text_paragraph = ""
-                latest_paragraphs_pointer = []
-               
-                latest_heading_style = paragraph.style.name.lower()
-                latest_heading_text = paragraph.text
-                latest_heading_pointer = paragraph
-                current_heading_deepness: int = self.__get_heading_deepness(current_heading_style)
-                highest_heading_deepness: int = self.__get_heading_deepness(highest_heading_style)
-                if highest_heading_style == self.INIT_HEADING or \
-                   (current_heading_deepness < highest_heading_deepness and current_heading_deepness > 0):
-                    highest_heading_style = current_heading_style
+    def __iter_headings(self, body_elements: List) -> Section:
+        # The parent stack holds the sections the next heading can belong to, deepest last:
+        # appending a paragraph is O(1), a heading pops the sections of same or deeper level.
+        root: Section = Section(-1)
+        parent_stack: List[Section] = [root]
+        current_section: Section = None
+        for element in body_elements:
+            if element.tag == self.TABLE_TAG:
+                # Tables found before the first paragraph have no section to belong to and are attached to the root
+                (current_section if current_section is not None else root).add_table(Table(element, self.document._body))
+                continue
+            paragraph: Paragraph = Paragraph(element, self.document._body)
+            style_name: str = self.__get_style_name(element)
+            if style_name.startswith('heading'):
+                # Heading styles without number are considered as top level headings
+                level: int = max(self.__get_heading_deepness(style_name), self.TITLE_LEVEL)
+                heading_name: str = paragraph.text if level <= 0 else f"{'#' * level} {paragraph.text}"
+                current_section = Section(level, heading_name, paragraph)
+            elif current_section is None:
+                # Typcally a document starts with a main title that we represent here as a heading of level 0
+                current_section = Section(self.TITLE_LEVEL, paragraph.text, paragraph)
+                self.logger.log_debug(f"Found paragraph before any heading: {paragraph.text}, considering it as the title of the document")
             else:
-                # Typcally a document starts with a main title that we represent here as heading 0
-                if latest_heading_pointer == None:
-                    latest_heading_text = paragraph.text
-                    latest_heading_pointer = paragraph
-                    latest_heading_style = "heading 0"
-                    self.logger.log_debug(f"Found paragraph before any heading: {latest_heading_text}, creating fakes heading: {latest_heading_style}")
-
-                latest_text_paragraph += paragraph.text + "\n"
-                latest_paragraphs_pointer.append(paragraph)
-        self.__append_data(file_content, latest_heading_style, highest_heading_style, \
-                           latest_heading_pointer, latest_heading_text, \
-                           latest_paragraphs_pointer, latest_text_paragraph)
-        self.logger.log_debug(f"File content returned: \n{pformat(file_content, width=230)}")
-        return file_content
+                current_section.add_paragraph(paragraph, paragraph.text)
+                continue
+            # We need to consider cases where a document starts with Heading 2 and later gets Heading 1
+            while parent_stack[-1].level >= current_section.level:
+                parent_stack.pop()
+            parent_stack[-1].children.append(current_section)
+            parent_stack.append(current_section)
+            self.logger.log_trace(f"Found heading of level {current_section.level}: {current_section.heading_name}")
+        return root
     
     def __get_context(self, prev_headings: List) -> str:
         if self.force_context is not None:
@@ -175,123 +199,121 @@ class OpenDOCDocument(IOpenAndUpdateDocument):
             return "The context is a list of headings belonging to the document. This list is intended to provide guidance to the LLM:" +\
                       "\n".join(prev_headings)  
         
-    def __dispatch_requests(self, file_content: List, prev_headings: List):
-        paragraph_text: str = ""
-        list_pointers: List = []
-        heading_name: str = None
-        request_type: str = LLMUtils.DEFAULT_REQUEST
-        heading_found: bool = False
-        next_prev_headings: List = []
-        for key_in_section in [self.HEADING_POINTER, self.PARAGRAPH_POINTERS]:
-            for section in file_content:
-                if isinstance(section, dict):
-                    if not key_in_section in section:
-                        continue
-                    if self.SECTION_TEXT in section and len(section[self.SECTION_TEXT]) > 0:
-                        paragraph_text += section[self.SECTION_TEXT]
-                    if self.HEADING_POINTER in section:
-                        list_pointers.append(section[self.HEADING_POINTER])
-                    if self.PARAGRAPH_POINTERS in section: 
-                        list_pointers.extend(section[self.PARAGRAPH_POINTERS])
+    def __add_request(self, list_pointers: List, context: str, text: str, request_type: str, group_sizes: List[int] = None):
+        self.logger.log_trace(f"Preparing text to be used for the request: {text}")
+        self._add_work_element(self._create_metadata(list_pointers, \
+                                                           context, \
+                                                           text,
+                                                           request_type,
+                                                           self.__get_locator(list_pointers, group_sizes)))
 
-                    if self.HEADING_NAME in section:
-                        heading_name = section[self.HEADING_NAME]
-                        heading_found = True
-                        next_prev_headings.append(heading_name)
-                    
-        if heading_found and paragraph_text == self.__prepend_heading_to_paragraph_text(heading_name, ""):
-            request_type = LLMUtils.HEADING_REQUEST 
+    def __dispatch_text(self, section: Section, pointers: List, texts: List[str], context: str, request_type: str, prev_headings: List):
+        if self.segmenter.fits(["".join(texts)]):
+            self.__add_request(pointers, context, "".join(texts), request_type)
+            return
+        # Text too large for one request: split on paragraph boundaries, the heading stays with the first paragraphs
+        groups: List[List[int]] = self.segmenter.split(texts)
+        self.logger.log_debug(f"Splitting section {section.heading_name} in {len(groups)} requests")
+        for group in groups:
+            self.__add_request([pointers[index] for index in group], context, "".join([texts[index] for index in group]), LLMUtils.DEFAULT_REQUEST)
+            # The following parts of the section get its heading in their context
+            context = self.__get_context(prev_headings)
 
+    def __dispatch_section_body(self, section: Section, prev_headings: List):
+        # Paragraphs and tables are sent in document order: each run of paragraphs is sent before the table ending it,
+        # so that the write back of a run never moves it past a table.
         context: str = self.__get_context(prev_headings)
-        prev_headings.extend(next_prev_headings)
-        self.logger.log_trace(f"Preparing text to be used for the request: {paragraph_text}")
-        self.worker.add_work_element(MetadataDoc(list_pointers, \
-                                                 context, \
-                                                 paragraph_text,
-                                                 request_type,
-                                                 self.logger, self.document_styles))
-        match = re.compile(r'^heading\s+(\d+)')
-        for section in file_content:
-            for key, sub_section in section.items(): 
-                if match.match(key):
-                    self.__dispatch_requests(sub_section, prev_headings)
+        if section.heading_pointer is not None:
+            prev_headings.append(section.heading_name)
+        for run_index, (paragraph_indexes, doc_table) in enumerate(section.get_runs()):
+            pointers: List = [section.paragraph_pointers[index] for index in paragraph_indexes]
+            texts: List[str] = [f"{section.paragraph_texts[index]}\n" for index in paragraph_indexes]
+            request_type: str = LLMUtils.DEFAULT_REQUEST
+            if run_index == 0 and section.heading_pointer is not None:
+                request_type = LLMUtils.HEADING_REQUEST if len(pointers) == 0 else LLMUtils.DEFAULT_REQUEST
+                pointers = [section.heading_pointer] + pointers
+                texts = [f"{section.heading_name}\n"] + texts
+            if len(pointers) > 0:
+                self.__dispatch_text(section, pointers, texts, context, request_type, prev_headings)
+                context = self.__get_context(prev_headings)
+            if doc_table is not None:
+                # Tables get the headings up to their position as context
+                self.__dispatch_table(doc_table, self.__get_locator([doc_table]), prev_headings)
 
-    def __dispatch_requests_DELETEME(self, file_content: List, prev_headings: List):
-        for section in file_content:
-            heading_name: str = None
-            if isinstance(section, dict):
-                section_text: str = section[self.SECTION_TEXT] if self.SECTION_TEXT in section else ""
-                list_pointers: List = [section[self.HEADING_POINTER]] if self.HEADING_POINTER in section else []
-                list_pointers.extend(section[self.PARAGRAPH_POINTERS] if self.PARAGRAPH_POINTERS in section else [])
-                request_type: str = LLMUtils.DEFAULT_REQUEST
-
-                if self.HEADING_NAME in section:
-                    heading_name: str = section[self.HEADING_NAME]
-                    section_text = re.sub(r'^\s*$', '', section_text)
-                    if len(section) == 0: 
-                        request_type = LLMUtils.HEADING_REQUEST 
-                    else:
-                        section_text = heading_name + "\n" + section_text
-                    prev_headings.append(heading_name)
+    def __dispatch_merged_sections(self, sections: List[Section], prev_headings: List):
+        if len(sections) == 1:
+            self.__dispatch_requests(sections[0], prev_headings)
+            return
+        context: str = self.__get_context(prev_headings)
+        list_pointers: List = []
+        group_sizes: List[int] = []
+        for section in sections:
+            prev_headings.append(section.heading_name)
+            list_pointers.extend(section.get_pointers())
+            group_sizes.append(len(section.get_pointers()))
+        self.logger.log_debug(f"Merging {len(sections)} small sections starting at {sections[0].heading_name} in one request")
+        self.__add_request(list_pointers, context, TokenBudgetSegmenter.join_segments([section.get_text() for section in sections]),
+                           LLMUtils.DEFAULT_REQUEST, group_sizes)
 
-                context: str = self.__get_context(prev_headings)
-                self.logger.log_trace(f'Extracted text section for LLM request: {section_text}')
-                self.worker.add_work_element(MetadataDoc(list_pointers, \
-                                                         context, \
-                                                         section_text,
-                                                         request_type,
-                                                         self.logger, self.document_styles))
+    def __is_mergeable(self, section: Section) -> bool:
+        # Only sections without tables or sub sections can be merged without changing the order of the requests
+        return self.segmenter.is_enabled() and len(section.children) == 0 and not section.has_tables()
 
-                match = re.compile(r'^heading\s+(\d+)')
-                for key, sub_section in section.items(): 
-                    if match.match(key):
-                        self.__dispatch_requests(sub_section, prev_headings)
+    def __dispatch_requests(self, section: Section, prev_headings: List):
+        self.__dispatch_section_body(section, prev_headings)
+        merged_sections: List[Section] = []
+        for sub_section in section.children:
+            if self.__is_mergeable(sub_section) and self.segmenter.fits([merged_section.get_text() for merged_section in merged_sections + [sub_section]]):
+                merged_sections.append(sub_section)
+                continue
+            if len(merged_sections) > 0:
+                self.__dispatch_merged_sections(merged_sections, prev_headings)
+                merged_sections = []
+            if self.__is_mergeable(sub_section) and self.segmenter.fits([sub_section.get_text()]):
+                merged_sections.append(sub_section)
+            else:
+                self.__dispatch_requests(sub_section, prev_headings)
+        if len(merged_sections) > 0:
+            self.__dispatch_merged_sections(merged_sections, prev_headings)
 
-    def __doc_table_to_md_table(self, doc_table):        
-        md_table: str = ""
-        first_row: bool = True
-        for row in doc_table.rows:
-            current_row: str = ""
-            for cell in row.cells:
-                self.logger.log_debug("Transforming DOC table to MD Table")
-                cell_value: str = ""
-                if len(cell.paragraphs) > 0:
-                    cell_value = " ".join([paragraph_pointer.text for paragraph_pointer in cell.paragraphs]) + "\n"
-                    for paragraph_pointer in cell.paragraphs:
-                        paragraph_pointer.text = ""
-                    
-                if len(cell.tables) > 0:
-                    for doc_table in cell.tables:
-                        md_table_in_cell_value: str = self.__doc_table_to_md_table(cell) + "\n"
-                        cell_value += md_table_in_cell_value
+    def __get_table_rows(self, doc_table: Table, nested_tables: List) -> List[List[str]]:
+        # Text of the cells without the nested tables: these are collected with their coordinates and sent on their own
+        rows: List[List[str]] = []
+        visited_cells: set = set()
+        for row_id, row in enumerate(doc_table.rows):
+            row_texts: List[str] = []
+            for col_id, cell in enumerate(row.cells):
+                row_texts.append(" ".join([paragraph.text for paragraph in cell.paragraphs]))
+                # Merged cells are returned once per grid column
+                if cell._tc in visited_cells:
+                    continue
+                visited_cells.add(cell._tc)
+                for table_id, nested_table in enumerate(cell.tables):
+                    nested_tables.append(([row_id, col_id, table_id], nested_table))
+            rows.append(row_texts)
+        return rows
 
-                current_row += f"|{cell_value}"
-            if len(current_row) > 0:
-                md_table += "\n" + current_row + "|"
-            if first_row:
-                md_table = "\n" + "-" * len(md_table)
-                first_row = False
-        return md_table
+    def __dispatch_table(self, doc_table: Table, locator: Dict, prev_headings: List):
+        nested_tables: List = []
+        rows: List[List[str]] = self.__get_table_rows(doc_table, nested_tables)
+        if any([len(cell_text.strip()) > 0 for row in rows for cell_text in row]):
+            context: str = self.__get_context(prev_headings)
+            # Large tables are sent as several row groups, each of them written back to its own rows
+            for md_table, rows_locator in self.table_engine.split_rows(rows):
+                self._add_work_element(self._create_metadata([doc_table], \
+                                                                   context, \
+                                                                   md_table,
+                                                                   self.table_engine.get_request_type(),
+                                                                   {**locator, "rows": rows_locator}))
+        for path, nested_table in nested_tables:
+            self.__dispatch_table(nested_table, {"table": locator["table"], "nested": locator.get("nested", []) + [path]}, prev_headings)
 
     #TODO: All requests should be running in multiple threads
-    def __fill_tasks(self, document: any):
-        file_content: List = self.__iter_headings(document.paragraphs)
+    def __fill_tasks(self):
+        root: Section = self.__iter_headings(self.body_elements)
         prev_headings: List = []
-        self.__dispatch_requests(file_content, prev_headings)
-
-        for doc_table in document.tables:
-            md_table = self.__doc_table_to_md_table(doc_table)
-            context: str = self.__get_context(prev_headings)
-
-            # In word dpcument we are going to replace a table 
-            self.worker.add_work_element(MetadataDoc([doc_table], \
-                                                      context, \
-                                                      md_table,
-                                                      LLMUtils.TABLE_REQUEST,
-                                                      self.logger, self.document_styles
-                                                      ))            
+        self.__dispatch_requests(root, prev_headings)
 
-    def process(self):
-        self.__fill_tasks(self.document)
-        self.worker.process_all()
+    def _extract(self) -> None:
+        self.__fill_tasks()
 
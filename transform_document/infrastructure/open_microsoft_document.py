@@ -1,16 +1,29 @@
+import copy
 import re
+from abc import abstractmethod
 from openpyxl import load_workbook
+from openpyxl.utils import get_column_letter, range_boundaries
 from pptx import Presentation
-from typing  import List, Dict
+from typing  import List, Dict, Tuple
 from pprint import pprint, pformat
 import sys
 
 from domain.iopen_document import IOpenDocument
 from domain.worker_class import Worker
-from domain.queue import MetadataDoc, MetadataXls, MetadataPpt
+from domain.queue import Metadata, MetadataDoc, MetadataXls, MetadataPpt
+from domain.llm_utils import LLMUtils
+from domain.indexed_batch import IndexedBatch
+from domain.segmenter import TokenBudgetSegmenter
+from domain.near_duplicates import MinHashIndex, NearDuplicateGroup
 from infrastructure.generic_logger import GenericLogger
+from infrastructure.package_writer import PackageWriter
+from infrastructure.extraction_cache import ExtractionCache
+from infrastructure.worksheet_patcher import WorksheetPatcher
 
 class IOpenAndUpdateDocument(IOpenDocument):
+    # Documents whose write-backs are tracked per package part can be saved rewriting only these parts
+    SAVES_MODIFIED_PARTS: bool = False
+
     def __init__(self, document_path: str, 
                  worker: Worker, 
                  paragraph_start_min_word_numbers: int, paragraph_start_min_word_length: int,  
@@ -21,41 +34,271 @@ class IOpenAndUpdateDocument(IOpenDocument):
         self.paragraph_start_min_word_length = paragraph_start_min_word_length
         self.paragraph_start_min_word_numbers = paragraph_start_min_word_numbers
         self.worker: Worker = worker
+        self.modified_parts: Dict[str, any] = {}
+        self.extraction_cache: ExtractionCache = None
+        self.extracted_records: List[Dict] = None
+        # Segment filters provide classify(texts) and get_statistics()
+        self.segment_filters: List = []
+        self.filtered_elements: List[Metadata] = []
+        self.near_duplicate_index: MinHashIndex = None
+        # Records of the segments, kept to dispatch them again to the forks of the document
+        self.records: List[Dict] = None
+        self.keeps_records: bool = False
+        self.paragraph_regexp = re.compile(f'(\\w{{{self.paragraph_start_min_word_length},}}\\b\\s+){{{int(self.paragraph_start_min_word_numbers)},}}\\w{{{self.paragraph_start_min_word_length},}}\\b')
+
+    def use_extraction_cache(self, extraction_cache: ExtractionCache) -> None:
+        self.extraction_cache = extraction_cache
+
+    def keep_records(self) -> None:
+        self.keeps_records = True
+
+    def get_records(self) -> List[Dict]:
+        return self.records
+
+    def use_records(self, records: List[Dict]) -> None:
+        # The segments are dispatched from these records, the document is not walked
+        self.records = records
+
+    def fork(self) -> 'IOpenAndUpdateDocument':
+        """
+        Returns a copy of the document as parsed, updated and saved independently of this one: it has to be
+        created before this document is updated. Segment filters are not copied.
+        """
+        forked: IOpenAndUpdateDocument = copy.copy(self)
+        forked.modified_parts = {}
+        forked.extraction_cache = None
+        forked.extracted_records = None
+        forked.segment_filters = []
+        forked.filtered_elements = []
+        forked.near_duplicate_index = None
+        forked.records = None
+        forked.keeps_records = False
+        forked._fork_document()
+        return forked
+
+    def _fork_document(self) -> None:
+        # The parsed package is copied in memory rather than read again from disk
+        self.document = copy.deepcopy(self.document)
+
+    def use_segment_filter(self, segment_filter: any) -> None:
+        # Filters are applied in their order, each one only to the segments kept by the previous ones
+        self.segment_filters.append(segment_filter)
+
+    def use_near_duplicate_index(self, near_duplicate_index: MinHashIndex) -> None:
+        self.near_duplicate_index = near_duplicate_index
+
+    @abstractmethod
+    def _extract(self) -> None:
+        """
+        Walks the document and adds one work element per segment through _add_work_element.
+        """
+
+    def _add_work_element(self, metadata: Metadata) -> None:
+        if self.extracted_records is not None:
+            self.extracted_records.append(metadata.to_record())
+        self.__dispatch(metadata)
+
+    def _skip_work_element(self, metadata: Metadata) -> None:
+        """
+        Called for the segments kept unchanged by a segment filter, they are never sent to the worker.
+        """
+
+    def __dispatch(self, metadata: Metadata) -> None:
+        # Plain text segments are held back to be classified all at once, tables and batches are always sent
+        if (len(self.segment_filters) > 0 or self.near_duplicate_index is not None) and not LLMUtils.is_table_request(metadata.get_request_type()) \
+           and metadata.get_request_type() != LLMUtils.BATCH_REQUEST:
+            self.filtered_elements.append(metadata)
+        else:
+            self.worker.add_work_element(metadata)
+
+    def __flush_filtered_elements(self) -> None:
+        if len(self.segment_filters) == 0 and self.near_duplicate_index is None:
+            return
+        for segment_filter in self.segment_filters:
+            keep: List[bool] = segment_filter.classify([metadata.get_text_to_transform() for metadata in self.filtered_elements])
+            for metadata in [metadata for metadata, keep_metadata in zip(self.filtered_elements, keep) if not keep_metadata]:
+                self._skip_work_element(metadata)
+            self.filtered_elements = [metadata for metadata, keep_metadata in zip(self.filtered_elements, keep) if keep_metadata]
+            self.logger.log_info(segment_filter.get_statistics())
+        if self.near_duplicate_index is not None:
+            self.__group_near_duplicates()
+        for metadata in self.filtered_elements:
+            self.worker.add_work_element(metadata)
+        self.filtered_elements = []
+
+    def __group_near_duplicates(self) -> None:
+        # Leaders are queued first so that their responses are known, in most cases, when their near duplicates are processed
+        leaders: List[int] = self.near_duplicate_index.find_leaders([metadata.get_text_to_transform() for metadata in self.filtered_elements],
+                                                                    [metadata.get_request_type() for metadata in self.filtered_elements])
+        followers: List[Metadata] = []
+        for metadata, leader in zip(self.filtered_elements, leaders):
+            if leader is None:
+                continue
+            leader_metadata: Metadata = self.filtered_elements[leader]
+            if leader_metadata.near_duplicate is None:
+                leader_metadata.near_duplicate = NearDuplicateGroup(leader_metadata)
+            metadata.near_duplicate = leader_metadata.near_duplicate
+            followers.append(metadata)
+        self.filtered_elements = [metadata for metadata, leader in zip(self.filtered_elements, leaders) if leader is None] + followers
+        self.logger.log_info(self.near_duplicate_index.get_statistics())
+
+    def process(self):
+        if self.records is None and self.extraction_cache is not None:
+            self.records = self.extraction_cache.load()
+        if self.records is not None:
+            for record in self.records:
+                self.__dispatch(self.metadata_from_record(record))
+        else:
+            self.extracted_records = [] if self.extraction_cache is not None or self.keeps_records else None
+            self._extract()
+            if self.extraction_cache is not None:
+                self.extraction_cache.save(self.extracted_records)
+            if self.keeps_records:
+                self.records = self.extracted_records
+            self.extracted_records = None
+        self.__flush_filtered_elements()
+        self.worker.process_all()
+
+    def _mark_part_modified(self, part: any) -> None:
+        self.modified_parts[part.partname] = part
 
     def is_paragraph(self, text: str):
-        minwords: int = int(self.paragraph_start_min_word_numbers)  # - 1 if int(self.paragraph_start_min_word_numbers) - 1 >= 0 else 0
-        regexp: str = f'(\\w{{{self.paragraph_start_min_word_length},}}\\b\\s+){{{minwords},}}\w{{{self.paragraph_start_min_word_length},}}\\b'
-        paragraph_found: bool = (re.search(regexp, text) is not None)
-        self.logger.log_trace(f"Checking for paragraph for {text} with regexp: {regexp} is {paragraph_found}")
+        paragraph_found: bool = (self.paragraph_regexp.search(text) is not None)
+        self.logger.log_trace(f"Checking for paragraph for {text} is {paragraph_found}")
         return paragraph_found
         
     def save(self, filename: str) -> None:
+        if self.SAVES_MODIFIED_PARTS and PackageWriter(self.document_path, self.logger).save(list(self.modified_parts.values()), filename):
+            self.logger.log_info(f"Saved final document as {filename}, {len(self.modified_parts)} modified parts were rewritten")
+            return
         self.document.save(filename)
         self.logger.log_info(f"Saved final document as {filename}")
 
+    @abstractmethod
+    def resolve_locator(self, locator: Dict) -> List:
+        """
+        Returns the pointers referenced by a locator created by this document.
+        """
+
+    @abstractmethod
+    def _create_metadata(self, list_pointers: List, context: str, text: str, request_type: str, locator: Dict) -> Metadata:
+        """
+        Creates the metadata type of this document, list_pointers can be None when a locator is provided.
+        """
+
+    def metadata_from_record(self, record: Dict) -> Metadata:
+        # Pointers are only resolved from the locator when the document is updated
+        return self._create_metadata(None, record["context"], record["text"], record["request_type"], record["locator"])
+
 
 class OpenXLSDocument(IOpenAndUpdateDocument):
+    # The workbook is read in read-only mode, only populated cells are visited. Responses are recorded as patches
+    # of the worksheet parts, streamed to the output package on save: sheets are never loaded as a whole.
     def __init__(self, document_path: str, 
                  worker: Worker, 
                  paragraph_start_min_word_numbers: int,
                  paragraph_start_min_word_length: int, 
-                 logger: GenericLogger):
+                 logger: GenericLogger,
+                 max_request_tokens: int = TokenBudgetSegmenter.DEFAULT_MAX_REQUEST_TOKENS,
+                 batch_cells: bool = False,
+                 cell_ranges: List[str] = None):
         super().__init__(document_path, 
                          worker, 
                          paragraph_start_min_word_numbers, paragraph_start_min_word_length, 
                          logger)
-        self.document =  load_workbook(document_path)
+        self.segmenter: TokenBudgetSegmenter = TokenBudgetSegmenter(max_request_tokens, logger)
+        self.batch_cells: bool = batch_cells
+        self.cell_ranges: List[Tuple] = [self.__parse_cell_range(cell_range) for cell_range in cell_ranges or []]
+        self.document =  load_workbook(document_path, read_only=True)
+        self.worksheet_paths: Dict[str, str] = {ws.title: ws._worksheet_path for ws in self.document.worksheets}
+        self.worksheet_patcher: WorksheetPatcher = WorksheetPatcher(document_path, logger)
     
+    @staticmethod
+    def __parse_cell_range(cell_range: str) -> Tuple:
+        # Sheet1!A2:C100, 'My sheet'!B:B or A2:A100 (all sheets): unbounded rows or columns are kept as None
+        sheet, _, cells = cell_range.rpartition('!')
+        min_col, min_row, max_col, max_row = range_boundaries(cells.replace('$', ''))
+        return sheet.strip("'") if len(sheet) > 0 else None, min_col, min_row, max_col, max_row
+
+    def __find_cell_range(self, ranges: List[Tuple], row: int, col: int) -> int:
+        for range_idx, (_, min_col, min_row, max_col, max_row) in enumerate(ranges):
+            if (min_col is None or min_col <= col) and (max_col is None or col <= max_col) and \
+               (min_row is None or min_row <= row) and (max_row is None or row <= max_row):
+                return range_idx
+        return None
+
+    def resolve_locator(self, locator: Dict) -> List:
+        worksheet_path: str = self.worksheet_paths[locator["sheet"]]
+        return [self.worksheet_patcher.get_cell(worksheet_path, coordinate) for coordinate in locator.get("coordinates", [locator.get("coordinate")])]
+
+    def _create_metadata(self, list_pointers: List, context: str, text: str, request_type: str, locator: Dict) -> Metadata:
+        return MetadataXls(list_pointers, context, text, request_type, self.logger,
+                           locator=locator, pointer_resolver=self.resolve_locator)
+
+    def __dispatch_cells(self, sheet: str, cells: List[Tuple[str, str]]) -> None:
+        # Cells of one column run or one range are sent as indexed JSON objects keyed by coordinate, split to fit the token budget
+        for group in self.segmenter.split([text for _, text in cells]) if len(cells) > 1 else [[0]]:
+            if len(group) == 1:
+                coordinate, text = cells[group[0]]
+                self._add_work_element(self._create_metadata(None, "", text, LLMUtils.DEFAULT_REQUEST, {"sheet": sheet, "coordinate": coordinate}))
+                continue
+            coordinates: List[str] = [cells[index][0] for index in group]
+            items: Dict[str, str] = {coordinate: cells[index][1] for coordinate, index in zip(coordinates, group)}
+            locator: Dict = {"sheet": sheet, "coordinates": coordinates, **IndexedBatch.get_locator(coordinates, [1] * len(group))}
+            self.logger.log_debug(f"Batching cells {coordinates[0]} to {coordinates[-1]} of sheet {sheet} in one request")
+            self._add_work_element(self._create_metadata(None, "", IndexedBatch.to_json(items), LLMUtils.BATCH_REQUEST, locator))
+
     def __fill_tasks(self, xls_obj: any):
         for ws in xls_obj.worksheets:
+            ranges: List[Tuple] = [cell_range for cell_range in self.cell_ranges if cell_range[0] is None or cell_range[0] == ws.title]
+            if len(self.cell_ranges) > 0 and len(ranges) == 0:
+                self.logger.log_info(f"Skipped sheet {ws.title}: none of the requested cell ranges")
+                continue
+            # Cells are batched per requested range, or per run of consecutive rows of one column
+            runs: Dict[int, List[Tuple[str, str]]] = {}
+            # The dimension stored in the sheet can be wrong: rows are read up to their last populated cell
+            ws.reset_dimensions()
+            for row, values in enumerate(ws.iter_rows(min_row=1, min_col=1, values_only=True), start=1):
+                extended_runs: List[int] = []
+                for col, value in enumerate(values, start=1):
+                    if value is None:
+                        continue
+                    range_idx: int = self.__find_cell_range(ranges, row, col) if len(ranges) > 0 else None
+                    if len(ranges) > 0 and range_idx is None:
+                        continue
+                    current_text = str(value)
+                    if self.is_paragraph(current_text): 
+                        coordinate: str = f"{get_column_letter(col)}{row}"
+                        if not self.batch_cells:
+                            self._add_work_element(self._create_metadata(None, "", current_text, LLMUtils.DEFAULT_REQUEST,
+                                                                         {"sheet": ws.title, "coordinate": coordinate}))
+                            continue
+                        run_key: int = range_idx if range_idx is not None else col
+                        runs.setdefault(run_key, []).append((coordinate, current_text))
+                        extended_runs.append(run_key)
+                if len(ranges) == 0:
+                    # A column run ends with the first row without a text to process in this column
+                    for run_key in [run_key for run_key in runs if run_key not in extended_runs]:
+                        self.__dispatch_cells(ws.title, runs.pop(run_key))
+            for run_key in sorted(runs.keys()):
+                self.__dispatch_cells(ws.title, runs[run_key])
 
-            for row in range(1,ws.max_row + 1):
-                for col in range(1,ws.max_column + 1):
-                    current_text = str(ws.cell(row,col).value)
-                    if current_text is not None and current_text != 'None' and self.is_paragraph(current_text): 
-                        self.worker.add_work_element(MetadataXls(ws.cell(row,col)))
-
-    def process(self):
+    def _extract(self) -> None:
         self.__fill_tasks(self.document)
-        self.worker.process_all()
+        self.document.close()
+
+    def _fork_document(self) -> None:
+        # The workbook is only read during the extraction: a fork only needs its own patches
+        self.worksheet_patcher = WorksheetPatcher(self.document_path, self.logger)
 
+    def save(self, filename: str) -> None:
+        if PackageWriter(self.document_path, self.logger).save_members(self.worksheet_patcher.get_members(), filename):
+            self.logger.log_info(f"Saved final document as {filename}, {self.worksheet_patcher.get_patch_count()} cells were patched")
+            return
+        # The patches are applied to the workbook loaded as a whole
+        document: any = load_workbook(self.document_path)
+        for title, worksheet_path in self.worksheet_paths.items():
+            for coordinate, text in self.worksheet_patcher.patches.get(worksheet_path, {}).items():
+                document[title][coordinate].value = text
+        document.save(filename)
+        self.logger.log_info(f"Saved final document as {filename}")
@@ -5,21 +5,30 @@ from typing import List, Dict
 from pprint import pprint, pformat
 from pptx import Presentation
 from pptx.enum.shapes import MSO_SHAPE_TYPE
+from pptx.text.text import TextFrame
+from pptx.table import Table
 
 from infrastructure.ppt_reader import PPTReader
 from infrastructure.open_microsoft_document import IOpenAndUpdateDocument
 from infrastructure.generic_logger import GenericLogger
 from domain.llm_utils import LLMUtils
-from domain.queue import MetadataPpt
+from domain.queue import Metadata, MetadataPpt
+from domain.segmenter import TokenBudgetSegmenter
+from domain.table_engine import TableEngine
+from domain.indexed_batch import IndexedBatch
 from domain.worker_class import Worker
 
 class OpenPPTDocument(IOpenAndUpdateDocument): 
+    SAVES_MODIFIED_PARTS: bool = True
     def __init__(self, document_path: str, 
                  worker: Worker, 
                  paragraph_start_min_word_numbers: int,
                  paragraph_start_min_word_length: int,
                  slides_to_skip: List, slides_to_keep: List,\
-                 logger: GenericLogger, llm_utils: LLMUtils):
+                 logger: GenericLogger, llm_utils: LLMUtils,
+                 max_request_tokens: int = TokenBudgetSegmenter.DEFAULT_MAX_REQUEST_TOKENS,
+                 json_tables: bool = False,
+                 batch_slides: bool = False):
         self.logger = logger
         self.document =  Presentation(document_path)
         self.llm_utils = llm_utils
@@ -28,11 +37,81 @@ class OpenPPTDocument(IOpenAndUpdateDocument):
         self.slides_to_keep = slides_to_keep
         self.paragraph_start_min_word_numbers = paragraph_start_min_word_numbers
         self.paragraph_start_min_word_length = paragraph_start_min_word_length
+        self.table_engine: TableEngine = TableEngine(max_request_tokens, logger, json_tables)
+        self.segmenter: TokenBudgetSegmenter = TokenBudgetSegmenter(max_request_tokens, logger)
+        self.batch_slides: bool = batch_slides
 
         super().__init__(document_path, worker, 
                          paragraph_start_min_word_numbers, paragraph_start_min_word_length, 
                          logger)
     
+    def __find_shape(self, shapes: any, shape_id: int) -> any:
+        for shape in shapes:
+            if shape.shape_id == shape_id:
+                return shape
+            if shape.shape_type == MSO_SHAPE_TYPE.GROUP:
+                found_shape: any = self.__find_shape(shape.shapes, shape_id)
+                if found_shape is not None:
+                    return found_shape
+        return None
+
+    def __get_pointer_locator(self, pointer: any) -> Dict:
+        if isinstance(pointer, TextFrame):
+            return {"shape_id": pointer._parent.shape_id, "kind": "text_frame"}
+        if isinstance(pointer, Table):
+            return {"shape_id": pointer._graphic_frame.shape_id, "kind": "table"}
+        return {"shape_id": pointer.shape_id, "kind": "shape"}
+
+    def __get_locator(self, slide_idx: int, list_pointers: List) -> Dict:
+        return {"slide": slide_idx, "pointers": [self.__get_pointer_locator(pointer) for pointer in list_pointers]}
+
+    def resolve_locator(self, locator: Dict) -> List:
+        slide: any = self.document.slides[locator["slide"]]
+        list_pointers: List = []
+        for pointer_locator in locator["pointers"]:
+            shape: any = self.__find_shape(slide.shapes, pointer_locator["shape_id"])
+            if shape is None:
+                self.logger.log_warn(f"Could not find shape {pointer_locator['shape_id']} in slide {locator['slide'] + 1}")
+            elif pointer_locator["kind"] == "text_frame":
+                list_pointers.append(shape.text_frame)
+            elif pointer_locator["kind"] == "table":
+                list_pointers.append(shape.table)
+            else:
+                list_pointers.append(shape)
+        return list_pointers
+
+    def _create_metadata(self, list_pointers: List, context: str, text: str, request_type: str, locator: Dict) -> Metadata:
+        self._mark_part_modified(self.document.slides[locator["slide"]].part)
+        return MetadataPpt(list_pointers, context, text, request_type, self.logger,
+                           locator=locator, pointer_resolver=self.resolve_locator)
+
+    def __get_batch_key(self, list_pointers: List, keys: List[str]) -> str:
+        key: str = str(self.__get_pointer_locator(list_pointers[0])["shape_id"])
+        # Several descriptions can point to the same shape (typically a title): keys must stay unique
+        return key if key not in keys else f"{key}-{len(keys)}"
+
+    def __dispatch_batches(self, slide_idx: int, context: str, batch_items: List) -> None:
+        # Text shapes of one slide are sent as indexed JSON objects, split to fit the token budget
+        for group in self.segmenter.split([text for text, _ in batch_items]):
+            if len(group) == 1:
+                text, list_pointers = batch_items[group[0]]
+                self._add_work_element(self._create_metadata(list_pointers, context, text, LLMUtils.DEFAULT_REQUEST,
+                                                             self.__get_locator(slide_idx, list_pointers)))
+                continue
+            keys: List[str] = []
+            items: Dict[str, str] = {}
+            all_pointers: List = []
+            for index in group:
+                text, list_pointers = batch_items[index]
+                key: str = self.__get_batch_key(list_pointers, keys)
+                keys.append(key)
+                items[key] = text
+                all_pointers.extend(list_pointers)
+            locator: Dict = {**self.__get_locator(slide_idx, all_pointers),
+                             **IndexedBatch.get_locator(keys, [len(batch_items[index][1]) for index in group])}
+            self.logger.log_debug(f"Batching {len(keys)} shapes of slide {slide_idx + 1} in one request")
+            self._add_work_element(self._create_metadata(all_pointers, context, IndexedBatch.to_json(items), LLMUtils.BATCH_REQUEST, locator))
+
     def __print_slide_keep_skip_info(self, keep_skip_info: str) -> None:
         self.logger.log_info(keep_skip_info)
 
@@ -84,19 +163,11 @@ class OpenPPTDocument(IOpenAndUpdateDocument):
                 elif shape.has_table: 
                     table = shape.table
                     pointer_list: List = [table]
-                    table_md_str: str = ""
-                    first_row: bool = True
-                    for row in table.rows:
-                        table_md_str += "\n|"
-                        for cell in row.cells:
-                            text: str = ""
-                            if cell.text_frame is not None:
-                              text = cell.text_frame.text.replace("\n", " ")
-                            table_md_str += text + "|"
-                        if first_row: table_md_str += "\n" + ("-" * max(3, len(table_md_str)))
-                        first_row = False
-                        
-                    self.__append(shape_descriptions, PPTReader.get_table_info(slide_number, shape, table_md_str, pointer_list, self))
+                    rows: List[List[str]] = [[cell.text_frame.text if cell.text_frame is not None else "" for cell in row.cells] for row in table.rows]
+                    table_description: Dict = PPTReader.get_table_info(slide_number, shape, TableEngine.to_md_table(rows), pointer_list, self)
+                    if table_description is not None:
+                        table_description["json"]["rows"] = rows
+                    self.__append(shape_descriptions, table_description)
 
                 elif shape.shape_type == MSO_SHAPE_TYPE.GROUP: 
                     self.__append(shape_descriptions, PPTReader.get_group_info(slide_number, shape, self))
@@ -135,6 +206,7 @@ class OpenPPTDocument(IOpenAndUpdateDocument):
                         context += text + "\n"
 
             self.logger.log_trace(f"Transformed slide {slide_idx}, {slide}:\n{pformat(sorted_shapes)}")
+            batch_items: List = []
             for shape_description in sorted_shapes:
                 if isinstance(shape_description['raw_text'], str):
                     text: str = shape_description['raw_text']
@@ -142,18 +214,30 @@ class OpenPPTDocument(IOpenAndUpdateDocument):
                     if len(text) > 0:
                         request_type: str = LLMUtils.DEFAULT_REQUEST
                         if shape_description['json']['type'] == str(MSO_SHAPE_TYPE.TABLE):
-                            request_type = LLMUtils.TABLE_REQUEST
+                            request_type = self.table_engine.get_request_type()
                         if shape_description['json']['is_title'] == True:
                             self.logger.log_trace(f"Adding heading {text}")
                             request_type = LLMUtils.HEADING_REQUEST
 
                         self.logger.log_trace(f"Populating requests: shape_description = {pformat(shape_description)}")
-                        self.worker.add_work_element(MetadataPpt(shape_description["json"]["pointers"], \
-                                                                context, text, \
-                                                                request_type, self.logger))   
+                        list_pointers: List = shape_description["json"]["pointers"]
+                        if LLMUtils.is_table_request(request_type):
+                            # Large tables are sent as several row groups, each of them written back to its own rows
+                            for md_table, rows_locator in self.table_engine.split_rows(shape_description["json"]["rows"]):
+                                self._add_work_element(self._create_metadata(list_pointers, \
+                                                                                   context, md_table, request_type, \
+                                                                                   {**self.__get_locator(slide_idx, list_pointers), "rows": rows_locator}))
+                            continue
+                        if self.batch_slides and request_type == LLMUtils.DEFAULT_REQUEST:
+                            batch_items.append((text, list_pointers))
+                            continue
+                        self._add_work_element(self._create_metadata(list_pointers, \
+                                                                           context, text, \
+                                                                           request_type, self.__get_locator(slide_idx, list_pointers)))
+            if len(batch_items) > 0:
+                self.__dispatch_batches(slide_idx, context, batch_items)
             
-    def process(self):
+    def _extract(self) -> None:
         self.__ppt_to_json()
-        self.worker.process_all()
 
         
\ No newline at end of file
@@ -0,0 +1,357 @@
+import csv
+import os
+import re
+import shutil
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Dict, Iterator, List, TextIO, Tuple
+
+from domain.worker_class import Worker
+from domain.queue import Metadata, MetadataText
+from domain.llm_utils import LLMUtils
+from domain.inline_markdown import InlineMarkdown
+from infrastructure.generic_logger import GenericLogger
+from infrastructure.open_microsoft_document import IOpenAndUpdateDocument
+
+
+class OpenStreamDocument(IOpenAndUpdateDocument, ABC):
+    # Documents read lazily from start to end: every segment gets an increasing index, responses are buffered only
+    # until all the previous segments are answered, they are then written to a temporary output renamed on save.
+    def __init__(self, document_path: str,
+                 worker: Worker,
+                 paragraph_start_min_word_numbers: int,
+                 paragraph_start_min_word_length: int,
+                 logger: GenericLogger):
+        super().__init__(document_path,
+                         worker,
+                         paragraph_start_min_word_numbers, paragraph_start_min_word_length,
+                         logger)
+        self.segment_count: int = 0
+        self.next_index: int = 0
+        self.responses: Dict[int, Tuple[Dict, str]] = {}
+        self.output_path: str = None
+        self.updated_segments: int = 0
+        self.thread_lock = threading.Lock()
+
+    def resolve_locator(self, locator: Dict) -> List:
+        return [self]
+
+    def _fork_document(self) -> None:
+        # Nothing is parsed ahead: a fork only needs its own output
+        self.next_index = 0
+        self.responses = {}
+        self.output_path = None
+        self.updated_segments = 0
+        self.thread_lock = threading.Lock()
+
+    def _create_metadata(self, list_pointers: List, context: str, text: str, request_type: str, locator: Dict) -> Metadata:
+        return MetadataText(list_pointers, context, text, request_type, self.logger,
+                            locator=locator, pointer_resolver=self.resolve_locator)
+
+    def _add_segment(self, context: str, text: str, request_type: str, locator: Dict) -> None:
+        self._add_work_element(self._create_metadata(None, context, text, request_type, {"index": self.segment_count, **locator}))
+        self.segment_count += 1
+
+    def _skip_work_element(self, metadata: Metadata) -> None:
+        # Segments kept unchanged must not hold back the writing of the next ones
+        self.record_response(metadata.get_locator(), None)
+
+    def record_response(self, locator: Dict, text: str) -> None:
+        """
+        Records the response of one segment, None keeps the segment unchanged.
+        """
+        self.thread_lock.acquire()
+        self.responses[locator["index"]] = (locator, text)
+        if self.next_index in self.responses:
+            if self.output_path is None:
+                self.__open_output()
+            while self.next_index in self.responses:
+                self.__write_segment(*self.responses.pop(self.next_index))
+                self.next_index += 1
+        self.thread_lock.release()
+
+    def __write_segment(self, locator: Dict, text: str) -> None:
+        if text is not None:
+            self.updated_segments += 1
+        self._write_segment(locator, text)
+
+    def __open_output(self) -> None:
+        # Next to the input document rather than in the temporary folder: the output is as large as the input
+        handle, self.output_path = tempfile.mkstemp(prefix=".", suffix=f"-{os.path.basename(self.document_path)}",
+                                                    dir=os.path.dirname(os.path.abspath(self.document_path)))
+        os.close(handle)
+        self._open_output(self.output_path)
+
+    def _to_plain_text(self, text: str) -> str:
+        return "\n".join([InlineMarkdown.to_plain_text(line) for line in text.split("\n")])
+
+    @abstractmethod
+    def _open_output(self, output_path: str) -> None:
+        """
+        Opens the output and a second reader of the input used to copy what is not replaced.
+        """
+
+    @abstractmethod
+    def _write_segment(self, locator: Dict, text: str) -> None:
+        """
+        Writes the input up to the segment and the response of the segment, the segment is kept when text is None.
+        """
+
+    @abstractmethod
+    def _close_output(self) -> None:
+        """
+        Writes the rest of the input and closes the output.
+        """
+
+    def save(self, filename: str) -> None:
+        self.thread_lock.acquire()
+        if self.output_path is None:
+            self.__open_output()
+        # Segments never answered (drained run, responses of followers still missing) are kept unchanged
+        for index in sorted(self.responses.keys()):
+            self.__write_segment(*self.responses.pop(index))
+        self._close_output()
+        shutil.move(self.output_path, filename)
+        self.output_path = None
+        self.thread_lock.release()
+        self.logger.log_info(f"Saved final document as {filename}, {self.updated_segments} segments were updated")
+
+
+class OpenTextDocument(OpenStreamDocument):
+    # Paragraphs are blocks of non blank lines located by their byte offsets: the output is a copy of the input
+    # where the answered paragraphs are replaced, the line breaks of the input are kept.
+    ENCODING: str = "utf-8"
+    BYTE_ORDER_MARK: bytes = b'\xef\xbb\xbf'
+    COPY_CHUNK_SIZE: int = 1024 * 1024
+
+    def __init__(self, document_path: str,
+                 worker: Worker,
+                 paragraph_start_min_word_numbers: int,
+                 paragraph_start_min_word_length: int,
+                 logger: GenericLogger):
+        super().__init__(document_path,
+                         worker,
+                         paragraph_start_min_word_numbers, paragraph_start_min_word_length,
+                         logger)
+        self.input: BinaryIO = None
+        self.output: BinaryIO = None
+        self.position: int = 0
+
+    def _iter_lines(self) -> Iterator[Tuple[int, bytes]]:
+        # Lines are read as bytes: their offsets are the positions in the input file
+        offset: int = 0
+        with open(self.document_path, "rb") as f:
+            for line in f:
+                yield offset, line
+                offset += len(line)
+
+    def _decode(self, line: bytes) -> str:
+        return line.decode(self.ENCODING, errors="replace").lstrip('\ufeff').rstrip('\r\n')
+
+    def _to_block(self, lines: List[Tuple[int, bytes]], request_type: str, context: str) -> Tuple[int, int, str, str, str]:
+        # Neither the byte order mark of the input nor the line break of the last line are part of the block
+        first_offset, first_line = lines[0]
+        last_offset, last_line = lines[-1]
+        start: int = first_offset + (len(self.BYTE_ORDER_MARK) if first_offset == 0 and first_line.startswith(self.BYTE_ORDER_MARK) else 0)
+        return start, last_offset + len(last_line.rstrip(b'\r\n')), '\n'.join([self._decode(line) for _, line in lines]), request_type, context
+
+    def _iter_blocks(self) -> Iterator[Tuple[int, int, str, str, str]]:
+        """
+        Returns the (start, end, text, request type, context) of the blocks of the input.
+        """
+        lines: List[Tuple[int, bytes]] = []
+        for offset, line in self._iter_lines():
+            if len(self._decode(line).strip()) > 0:
+                lines.append((offset, line))
+            elif len(lines) > 0:
+                yield self._to_block(lines, LLMUtils.DEFAULT_REQUEST, "")
+                lines = []
+        if len(lines) > 0:
+            yield self._to_block(lines, LLMUtils.DEFAULT_REQUEST, "")
+
+    def _extract(self) -> None:
+        for start, end, text, request_type, context in self._iter_blocks():
+            if request_type == LLMUtils.DEFAULT_REQUEST and not self.is_paragraph(text):
+                continue
+            self._add_segment(context, text, request_type, {"start": start, "end": end})
+
+    def _to_output_text(self, text: str) -> str:
+        return self._to_plain_text(text)
+
+    def __copy_input(self, size: int) -> None:
+        while size > 0:
+            chunk: bytes = self.input.read(min(size, self.COPY_CHUNK_SIZE))
+            if len(chunk) == 0:
+                break
+            self.output.write(chunk)
+            size -= len(chunk)
+
+    def _open_output(self, output_path: str) -> None:
+        self.input = open(self.document_path, "rb")
+        self.output = open(output_path, "wb")
+        self.position = 0
+
+    def _write_segment(self, locator: Dict, text: str) -> None:
+        if text is None:
+            return
+        self.__copy_input(locator["start"] - self.position)
+        original: bytes = self.input.read(locator["end"] - locator["start"])
+        self.position = locator["end"]
+        newline: bytes = b'\r\n' if b'\r\n' in original else b'\n'
+        self.output.write(newline.join([line.encode(self.ENCODING) for line in self._to_output_text(text).strip('\n').split('\n')]))
+
+    def _close_output(self) -> None:
+        shutil.copyfileobj(self.input, self.output, self.COPY_CHUNK_SIZE)
+        self.input.close()
+        self.output.close()
+
+
+class OpenMarkdownDocument(OpenTextDocument):
+    # Headings are sent alone and are the context of the next blocks, tables are sent as tables. Front matter,
+    # code and HTML blocks are kept unchanged. Responses are written as markdown.
+    HEADING_REGEXP = re.compile(r'^ {0,3}(#{1,6})\s+(.*?)\s*#*\s*$')
+    FENCE_REGEXP = re.compile(r'^ {0,3}(`{3,}|~{3,})')
+    TABLE_REGEXP = re.compile(r'^\s*\|')
+    HTML_REGEXP = re.compile(r'^ {0,3}<')
+    INDENTED_CODE_REGEXP = re.compile(r'^(    |\t)')
+    FRONT_MATTER_DELIMITERS: List[str] = ["---", "..."]
+    TEXT: str = "text"
+    TABLE: str = "table"
+    KEPT: str = "kept"
+
+    def __get_block(self, lines: List[Tuple[int, bytes]], kind: str, context: str) -> Tuple[int, int, str, str, str]:
+        request_type: str = LLMUtils.TABLE_REQUEST if kind == self.TABLE else LLMUtils.DEFAULT_REQUEST
+        return self._to_block(lines, request_type, context) if kind != self.KEPT else None
+
+    def __get_line_kind(self, text: str, kind: str) -> str:
+        if self.TABLE_REGEXP.match(text):
+            return self.TABLE
+        if kind is None and (self.HTML_REGEXP.match(text) or self.INDENTED_CODE_REGEXP.match(text)):
+            return self.KEPT
+        # Lines continue the block they belong to: an HTML or code block ends with a blank line
+        return kind if kind == self.KEPT else self.TEXT
+
+    def _iter_blocks(self) -> Iterator[Tuple[int, int, str, str, str]]:
+        lines: List[Tuple[int, bytes]] = []
+        kind: str = None
+        context: str = ""
+        fence: str = None
+        front_matter: bool = False
+        for line_number, (offset, line) in enumerate(self._iter_lines()):
+            text: str = self._decode(line)
+            if line_number == 0 and text.strip() == self.FRONT_MATTER_DELIMITERS[0]:
+                front_matter = True
+                continue
+            if front_matter:
+                front_matter = text.strip() not in self.FRONT_MATTER_DELIMITERS
+                continue
+            fence_match: re.Match = self.FENCE_REGEXP.match(text)
+            if fence is not None:
+                if fence_match is not None and fence_match.group(1)[0] == fence[0] and len(fence_match.group(1)) >= len(fence):
+                    fence = None
+                continue
+            heading_match: re.Match = self.HEADING_REGEXP.match(text)
+            line_kind: str = self.__get_line_kind(text, kind) if len(text.strip()) > 0 and fence_match is None and heading_match is None else None
+            if len(lines) > 0 and line_kind != kind:
+                block: Tuple = self.__get_block(lines, kind, context)
+                if block is not None:
+                    yield block
+                lines = []
+            kind = line_kind
+            if fence_match is not None:
+                fence = fence_match.group(1)
+            elif heading_match is not None:
+                yield self._to_block([(offset, line)], LLMUtils.HEADING_REQUEST, context)
+                context = heading_match.group(2)
+            elif line_kind is not None:
+                lines.append((offset, line))
+        if len(lines) > 0:
+            block: Tuple = self.__get_block(lines, kind, context)
+            if block is not None:
+                yield block
+
+    def _extract(self) -> None:
+        for start, end, text, request_type, context in self._iter_blocks():
+            # Tables and headings are always sent, as for the other documents
+            if request_type == LLMUtils.DEFAULT_REQUEST and not self.is_paragraph(text):
+                continue
+            self._add_segment(context, text, request_type, {"start": start, "end": end})
+
+    def _to_output_text(self, text: str) -> str:
+        return text
+
+
+class OpenCSVDocument(OpenStreamDocument):
+    # Records are read one by one, each field long enough to be a paragraph is one segment with the header of its
+    # column as context. Records are written with the dialect of the input as soon as all their fields are answered.
+    SNIFF_SIZE: int = 64 * 1024
+    DELIMITERS: str = ",;\t|"
+
+    def __init__(self, document_path: str,
+                 worker: Worker,
+                 paragraph_start_min_word_numbers: int,
+                 paragraph_start_min_word_length: int,
+                 logger: GenericLogger):
+        super().__init__(document_path,
+                         worker,
+                         paragraph_start_min_word_numbers, paragraph_start_min_word_length,
+                         logger)
+        with open(document_path, "rb") as f:
+            self.encoding: str = "utf-8-sig" if f.read(3) == b'\xef\xbb\xbf' else "utf-8"
+        with open(document_path, newline='', encoding=self.encoding, errors="replace") as f:
+            sample: str = f.read(self.SNIFF_SIZE)
+        try:
+            self.dialect: any = csv.Sniffer().sniff(sample, self.DELIMITERS)
+            self.has_header: bool = csv.Sniffer().has_header(sample)
+        except csv.Error:
+            self.logger.log_warn(f"Could not detect the CSV dialect of {document_path}, assuming comma separated values with a header")
+            self.dialect = csv.excel
+            self.has_header = True
+        self.line_terminator: str = '\r\n' if '\r\n' in sample else '\n'
+        self.input: TextIO = None
+        self.output: TextIO = None
+        self.rows: Iterator[List[str]] = None
+        self.writer: any = None
+        self.record: int = -1
+        self.row: List[str] = None
+
+    def _extract(self) -> None:
+        header: List[str] = []
+        with open(self.document_path, newline='', encoding=self.encoding) as f:
+            for record, row in enumerate(csv.reader(f, self.dialect)):
+                if record == 0 and self.has_header:
+                    header = row
+                    continue
+                for field, text in enumerate(row):
+                    if self.is_paragraph(text):
+                        self._add_segment(header[field] if field < len(header) else "", text, LLMUtils.DEFAULT_REQUEST,
+                                          {"record": record, "field": field})
+
+    def _open_output(self, output_path: str) -> None:
+        self.input = open(self.document_path, newline='', encoding=self.encoding)
+        self.rows = csv.reader(self.input, self.dialect)
+        self.output = open(output_path, "w", newline='', encoding=self.encoding)
+        self.writer = csv.writer(self.output, self.dialect, lineterminator=self.line_terminator)
+        self.record = -1
+        self.row = None
+
+    def __next_row(self) -> None:
+        if self.row is not None:
+            self.writer.writerow(self.row)
+        self.row = next(self.rows, None)
+        self.record += 1
+
+    def _write_segment(self, locator: Dict, text: str) -> None:
+        if text is None:
+            return
+        while self.record < locator["record"]:
+            self.__next_row()
+        self.row[locator["field"]] = self._to_plain_text(text)
+
+    def _close_output(self) -> None:
+        if self.row is not None:
+            self.writer.writerow(self.row)
+        self.writer.writerows(self.rows)
+        self.input.close()
+        self.output.close()
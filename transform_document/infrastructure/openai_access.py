@@ -1,14 +1,19 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, APIStatusError, BadRequestError
+import asyncio
 import time
 import os
 import re 
-from typing import List
+from typing import Dict, List, Tuple
 
 from infrastructure.generic_logger import GenericLogger
 from domain.iml_access import IMLAccess
 from pprint import pformat
 
 class OpenAIAccess(IMLAccess):
+    MAX_ATTEMPTS: int = 10
+    # Client errors worth retrying: timeout, conflict and rate limit
+    TRANSIENT_STATUS_CODES: List[int] = [408, 409, 429]
+    CONTEXT_LENGTH_ERRORS: List[str] = ["context_length_exceeded", "ContextWindowExceededError", "maximum context length"]
     client = OpenAI(
         base_url=os.getenv("OPENAI_BASE_URL"),
         # base_url="https://api.openai.com/v1"
@@ -18,51 +23,121 @@ class OpenAIAccess(IMLAccess):
         logger.log_trace(f"Using OpenAI model: {model_name}")
         self.logger: GenericLogger = logger
         self.model_name = model_name
-    
-    def try_transform_line(self, text_to_transform: str, how_to_transform: List, temperature: float, top_p: float) -> str:
+        self.async_client: AsyncOpenAI = None
+        self.async_client_loop: asyncio.AbstractEventLoop = None
+        # Cleared as soon as the endpoint rejects structured outputs, the format is then only requested in the prompt
+        self.response_format_supported: bool = True
+
+    def __getstate__(self):
+        # The asynchronous client is bound to an event loop and cannot be sent to another process
+        state = self.__dict__.copy()
+        state['async_client'] = None
+        state['async_client_loop'] = None
+        return state
+
+    def __get_messages(self, text_to_transform: str, how_to_transform: List) -> List:
         user_assistant_msgs = [
             {"role": "user", 
             "content": f'[Transform the text following strictly the associated requests] {text_to_transform}'} 
         ]
 
-        messages: List = how_to_transform
-        messages.extend(user_assistant_msgs)
+        # A new list: the instructions of the caller are sent again as they are by the next attempts
+        messages: List = how_to_transform + user_assistant_msgs
 
         self.logger.log_trace(f'OpenAILineUpdateText.try_transform_line:\n'+\
                               f' text_to_transform = {text_to_transform}\n '+\
                               f' how_to_transform = {how_to_transform}')
         
         self.logger.log_info(f'Request to LLM:\n{"-" * 15}\n{pformat(messages)}')
+        return messages
+
+    def __get_options(self, temperature: float, top_p: float, response_format: Dict) -> Dict:
+        options: Dict = {"temperature": temperature, "top_p": top_p}
+        if response_format is not None and self.response_format_supported:
+            options["response_format"] = response_format
+        return options
+
+    def __is_response_format_rejected(self, err: Exception, response_format: Dict) -> bool:
+        if response_format is None or not self.response_format_supported or not isinstance(err, BadRequestError):
+            return False
+        if "response_format" not in str(err) and "json_schema" not in str(err):
+            return False
+        self.logger.log_warn(f"Model {self.model_name} does not support structured outputs, requesting the format in the prompt only")
+        self.response_format_supported = False
+        return True
+
+    def __get_return_message(self, review: any) -> str:
+        return re.sub(r'\'\s+.*refusal=.*,.*role=.*\)', '', re.sub(r'ChatCompletionMessage\(content=', '', str(review.choices[0].message.content.strip())))
+
+    def try_transform_line(self, text_to_transform: str, how_to_transform: List, temperature: float, top_p: float, response_format: Dict = None) -> str:
+        messages: List = self.__get_messages(text_to_transform, how_to_transform)
 
         review = self.client.chat.completions.create(
             model=self.model_name,
             messages=messages,
-            temperature=temperature,
-            top_p=top_p
+            **self.__get_options(temperature, top_p, response_format)
         )
 
-        return_message = re.sub(r'\'\s+.*refusal=.*,.*role=.*\)', '', re.sub(r'ChatCompletionMessage\(content=', '', str(review.choices[0].message.content.strip())))
+        return self.__get_return_message(review)
+
+    async def try_transform_line_async(self, text_to_transform: str, how_to_transform: List, temperature: float, top_p: float, response_format: Dict = None) -> str:
+        current_loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        if self.async_client is None or self.async_client_loop is not current_loop:
+            self.async_client = AsyncOpenAI(base_url=os.getenv("OPENAI_BASE_URL"))
+            self.async_client_loop = current_loop
+        messages: List = self.__get_messages(text_to_transform, how_to_transform)
 
-        return return_message
+        review = await self.async_client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            **self.__get_options(temperature, top_p, response_format)
+        )
+
+        return self.__get_return_message(review)
         
-    def transform_line(self, line_to_transform: str, how_to_transform: str, temperature: float, top_p: float):
-        openai_response: bool = False
-        sleep_time = 10
-        response: dict = {}
+    def __is_fatal(self, err: Exception) -> bool:
+        # Sending the same request again cannot help when it is rejected for its content: too long, malformed or not allowed
+        if any(context_length_error in str(err) for context_length_error in self.CONTEXT_LENGTH_ERRORS):
+            return True
+        return isinstance(err, APIStatusError) and 400 <= err.status_code < 500 and err.status_code not in self.TRANSIENT_STATUS_CODES
 
+    def __get_backoff(self, err: Exception, line_to_transform: str, response_format: Dict, sleep_time: int, attempt: int) -> Tuple[int, int]:
+        """
+        Returns the seconds to wait before the next attempt, 0 to retry at once without structured outputs,
+        and the backoff of the following failure. Raises the error when the request cannot succeed.
+        """
+        if self.__is_response_format_rejected(err, response_format):
+            return 0, sleep_time
+        self.logger.log_warn(f"Caught exception {err=}, {type(err)=}\nMessage: {pformat(line_to_transform)}")
+        if self.__is_fatal(err):
+            self.logger.log_error("The request was rejected and is not retried, it may be too big for the context window of the model.")
+            raise err
+        if attempt >= self.MAX_ATTEMPTS:
+            self.logger.log_error(f"The request failed {attempt} times and is not retried.")
+            raise err
+        self.logger.log_warn(f"Backoff retry: Sleeping {sleep_time} seconds.")
+        return sleep_time, sleep_time * 2 if sleep_time < 30 else sleep_time
+
+    def transform_line(self, line_to_transform: str, how_to_transform: str, temperature: float, top_p: float, response_format: Dict = None):
+        sleep_time: int = 10
         self.logger.log_trace(f'OpenAILineUpdateText.transform_line:\n model = {self.model_name}\n line_to_transform = {line_to_transform}\n how_to_transform = {how_to_transform}')
-        while not openai_response:
+        attempt: int = 0
+        while True:
+            try:
+                return self.try_transform_line(line_to_transform, how_to_transform, temperature, top_p, response_format)
+            except Exception as err:
+                attempt += 1
+                delay, sleep_time = self.__get_backoff(err, line_to_transform, response_format, sleep_time, attempt)
+                time.sleep(delay)
+
+    async def transform_line_async(self, line_to_transform: str, how_to_transform: str, temperature: float, top_p: float, response_format: Dict = None):
+        sleep_time: int = 10
+        self.logger.log_trace(f'OpenAILineUpdateText.transform_line_async:\n model = {self.model_name}\n line_to_transform = {line_to_transform}\n how_to_transform = {how_to_transform}')
+        attempt: int = 0
+        while True:
             try:
-                response = self.try_transform_line(line_to_transform, how_to_transform, temperature, top_p)
-                openai_response = True
-            except Exception as err:                    
-                self.logger.log_warn(f"Caught exception {err=}, {type(err)=}\nMessage: {pformat(line_to_transform)}")
-                if "ContextWindowExceededError" in str(err):
-                    self.logger.log_error(f"It seems your request is too big.")
-                    #raise ContextWindowExceededError(f"{request_name}: It seems the size of your request is too big.")
-                self.logger.log_warn(f"Backoff retry: Sleeping {sleep_time} seconds.")
-                time.sleep(sleep_time)
-                if sleep_time < 30:
-                    sleep_time = sleep_time * 2
-        return response
-                    
+                return await self.try_transform_line_async(line_to_transform, how_to_transform, temperature, top_p, response_format)
+            except Exception as err:
+                attempt += 1
+                delay, sleep_time = self.__get_backoff(err, line_to_transform, response_format, sleep_time, attempt)
+                await asyncio.sleep(delay)
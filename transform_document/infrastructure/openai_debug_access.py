@@ -1,7 +1,7 @@
 import openai
 import time
 import random
-from typing import List
+from typing import Dict, List
 from infrastructure.generic_logger import GenericLogger
 from domain.iml_access import IMLAccess
 
@@ -11,7 +11,7 @@ class OpenAIDebugAccess(IMLAccess):
         self.logger: GenericLogger = logger
         self.paragraphs: List[str] = []
     
-    def try_transform_line(self, line_to_transform: str, how_to_transform: str) -> str:
+    def try_transform_line(self, line_to_transform: str, how_to_transform: str, temperature: float = None, top_p: float = None, response_format: Dict = None) -> str:
 
         if line_to_transform in self.paragraphs:
             self.logger.log_error(f"Paragraph {line_to_transform[0:50]} was already asked for being processed!")
@@ -26,7 +26,7 @@ class OpenAIDebugAccess(IMLAccess):
 
         return f"Successfully faked processe: {line_to_transform}"
         
-    def transform_line(self, line_to_transform: str, how_to_transform: str):
+    def transform_line(self, line_to_transform: str, how_to_transform: str, temperature: float = None, top_p: float = None, response_format: Dict = None):
         openai_response: bool = False
         sleep_time = 10
         response: dict = {}
@@ -0,0 +1,82 @@
+import os
+import shutil
+import zipfile
+from typing import Dict, Iterable, List, Set
+
+from domain.logger import GenericLogger
+
+
+class PackageWriter:
+    # Saves an Office Open XML package rewriting only the modified XML parts: every other zip member is streamed
+    # from the source archive in chunks, so that media never go through memory as a whole.
+    COPY_CHUNK_SIZE: int = 1024 * 1024
+
+    def __init__(self, source_path: str, logger: GenericLogger):
+        self.source_path: str = source_path
+        self.logger: GenericLogger = logger
+
+    @staticmethod
+    def get_members(parts: List) -> Dict[str, bytes]:
+        # Serialized modified parts (python-docx or python-pptx XmlPart) and their relationships, by zip member name
+        members: Dict[str, bytes] = {}
+        for part in parts:
+            members[part.partname.membername] = part.blob
+            if len(part.rels) > 0:
+                members[part.partname.rels_uri.membername] = part.rels.xml
+        return members
+
+    def __copy_member(self, source: zipfile.ZipFile, target: zipfile.ZipFile, info: zipfile.ZipInfo) -> None:
+        # Streamed through the public zipfile API with the compression of the source member
+        target_info: zipfile.ZipInfo = zipfile.ZipInfo(info.filename, info.date_time)
+        target_info.compress_type = info.compress_type
+        target_info.external_attr = info.external_attr
+        target_info.file_size = info.file_size
+        with source.open(info) as source_member, \
+             target.open(target_info, 'w', force_zip64=info.file_size >= zipfile.ZIP64_LIMIT) as target_member:
+            shutil.copyfileobj(source_member, target_member, self.COPY_CHUNK_SIZE)
+
+    def __write_chunks(self, target: zipfile.ZipFile, target_info: zipfile.ZipInfo, chunks: Iterable[bytes]) -> None:
+        with target.open(target_info, 'w') as target_member:
+            for chunk in chunks:
+                target_member.write(chunk)
+
+    def save(self, parts: List, filename: str) -> bool:
+        """
+        Returns False when the package cannot be saved this way (source not a zip archive, new parts), the caller
+        then saves the whole document.
+        """
+        return self.save_members(self.get_members(parts), filename)
+
+    def save_members(self, members: Dict[str, bytes], filename: str) -> bool:
+        """
+        Same as save, the modified parts being already serialized by zip member name. A member can also be
+        given as an iterable of chunks, it is then streamed to the archive.
+        """
+        temporary_name: str = f"{filename}.tmp"
+        try:
+            with zipfile.ZipFile(self.source_path) as source:
+                source_names: Set[str] = set(source.namelist())
+                new_members: List[str] = [name for name in members if name not in source_names]
+                if len(new_members) > 0:
+                    self.logger.log_debug(f"Parts {new_members} do not exist in {self.source_path}, saving the whole document")
+                    return False
+                with zipfile.ZipFile(temporary_name, 'w', zipfile.ZIP_DEFLATED) as target:
+                    for info in source.infolist():
+                        if info.filename in members:
+                            target_info: zipfile.ZipInfo = zipfile.ZipInfo(info.filename, info.date_time)
+                            target_info.compress_type = zipfile.ZIP_DEFLATED
+                            target_info.external_attr = info.external_attr
+                            if isinstance(members[info.filename], bytes):
+                                target.writestr(target_info, members[info.filename])
+                            else:
+                                self.__write_chunks(target, target_info, members[info.filename])
+                        else:
+                            self.__copy_member(source, target, info)
+            os.replace(temporary_name, filename)
+        except (zipfile.BadZipFile, OSError, NotImplementedError, RuntimeError) as err:
+            self.logger.log_warn(f"Could not save {filename} from the parts of {self.source_path}: {err=}, saving the whole document")
+            if os.path.exists(temporary_name):
+                os.remove(temporary_name)
+            return False
+        self.logger.log_debug(f"Saved {filename} rewriting {len(members)} modified parts out of {len(source_names)}")
+        return True
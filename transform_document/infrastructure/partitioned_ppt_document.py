@@ -0,0 +1,161 @@
+import signal
+import zipfile
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List
+from lxml import etree
+from pptx import Presentation
+from pptx.oxml import parse_xml
+
+from domain.iopen_document import IOpenDocument
+from domain.llm_endpoint_request import LLMEndpointRequest
+from domain.llm_utils import LLMUtils
+from domain.segmenter import TokenBudgetSegmenter
+from domain.segment_filter import SegmentFilter
+from domain.near_duplicates import MinHashIndex
+from domain.worker_class import Worker
+from infrastructure.executors import create_worker
+from infrastructure.generic_logger import GenericLogger
+from infrastructure.language_detector import TargetLanguageFilter
+from infrastructure.open_ppt_document import OpenPPTDocument
+from infrastructure.package_writer import PackageWriter
+from infrastructure.processors import SerializedDocProcessorType
+
+
+def _init_partition_process() -> None:
+    # Stopping the run is decided by the parent process: partitions already started are completed
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+def _process_slide_partition(document_path: str, slide_numbers: List[int], options: Dict,
+                             llm_request: LLMEndpointRequest, llm_utils: LLMUtils, logger: GenericLogger) -> Dict[str, bytes]:
+    # Runs in a child process: the package is loaded again, only the slides of the partition are extracted,
+    # transformed and written back, the modified slide parts are returned serialized.
+    worker: Worker = create_worker(options["executor"], llm_request, logger, options["max_parallel_thread"])
+    document: OpenPPTDocument = OpenPPTDocument(document_path,
+                                                worker,
+                                                options["paragraph_start_min_word_numbers"], options["paragraph_start_min_word_length"],
+                                                [], slide_numbers,
+                                                logger, llm_utils,
+                                                options["max_request_tokens"],
+                                                options["json_tables"],
+                                                options["batch_slides"])
+    if options["prefilter_patterns"] is not None:
+        document.use_segment_filter(SegmentFilter(logger, options["prefilter_patterns"]))
+    if options["target_language_filter"] is not None:
+        document.use_segment_filter(options["target_language_filter"])
+    if options["near_duplicate_threshold"] is not None:
+        document.use_near_duplicate_index(MinHashIndex(logger, options["near_duplicate_threshold"]))
+    document.process()
+    return PackageWriter.get_members(list(document.modified_parts.values()))
+
+
+class PartitionedPPTDocument(IOpenDocument):
+    # Slides are split in contiguous partitions processed by separate processes, each one walking and updating
+    # its own copy of the presentation: parsing and write back are not serialized anymore by the GIL.
+    # Only the modified slide parts come back to this process, they are merged in the source package on save.
+    PRESENTATION_PART: str = "ppt/presentation.xml"
+    SLIDE_ID_TAG: str = "{http://schemas.openxmlformats.org/presentationml/2006/main}sldId"
+    WAIT_SECONDS: float = 1.0
+
+    def __init__(self, document_path: str,
+                 llm_request: LLMEndpointRequest,
+                 executor: str,
+                 max_parallel_thread: int,
+                 paragraph_start_min_word_numbers: int,
+                 paragraph_start_min_word_length: int,
+                 slides_to_skip: List, slides_to_keep: List,
+                 logger: GenericLogger, llm_utils: LLMUtils,
+                 slide_partitions: int,
+                 max_request_tokens: int = TokenBudgetSegmenter.DEFAULT_MAX_REQUEST_TOKENS,
+                 json_tables: bool = False,
+                 batch_slides: bool = False,
+                 prefilter_patterns: List[str] = None,
+                 target_language_filter: TargetLanguageFilter = None,
+                 near_duplicate_threshold: float = None):
+        self.document_path: str = document_path
+        self.llm_request: LLMEndpointRequest = llm_request
+        self.logger: GenericLogger = logger
+        self.llm_utils: LLMUtils = llm_utils
+        self.slides_to_skip: List = slides_to_skip
+        self.slides_to_keep: List = slides_to_keep
+        self.slide_partitions: int = slide_partitions
+        self.members: Dict[str, bytes] = {}
+        self.drain_requested: bool = False
+        # The requests per second allowed to the whole run are shared between the partitions
+        partition_threads: int = max(1, max_parallel_thread // slide_partitions)
+        if executor == "processes":
+            self.logger.log_warn("Executor processes cannot run inside slide partitions, using threads")
+            executor = "threads"
+        if executor is None:
+            executor = "threads" if partition_threads > 1 else SerializedDocProcessorType.EXECUTOR_NAME
+        self.options: Dict = {"executor": executor, "max_parallel_thread": partition_threads,
+                              "paragraph_start_min_word_numbers": paragraph_start_min_word_numbers,
+                              "paragraph_start_min_word_length": paragraph_start_min_word_length,
+                              "max_request_tokens": max_request_tokens, "json_tables": json_tables, "batch_slides": batch_slides,
+                              "prefilter_patterns": prefilter_patterns, "target_language_filter": target_language_filter,
+                              "near_duplicate_threshold": near_duplicate_threshold}
+
+    def __get_slide_count(self) -> int:
+        # Only the slide list of the presentation part is read, the slides themselves are parsed by the partitions
+        with zipfile.ZipFile(self.document_path) as package:
+            presentation: etree._Element = etree.fromstring(package.read(self.PRESENTATION_PART))
+        return len(list(presentation.iter(self.SLIDE_ID_TAG)))
+
+    def __get_slide_numbers(self) -> List[int]:
+        slide_numbers: List[int] = []
+        for slide_number in range(1, self.__get_slide_count() + 1):
+            if slide_number in self.slides_to_skip:
+                continue
+            if self.slides_to_keep is not None and len(self.slides_to_keep) > 0 and slide_number not in self.slides_to_keep:
+                continue
+            slide_numbers.append(slide_number)
+        return slide_numbers
+
+    def __get_partitions(self, slide_numbers: List[int]) -> List[List[int]]:
+        # Contiguous slide ranges of the same size (+/- 1 slide), never empty: an empty list keeps all slides
+        partition_count: int = min(self.slide_partitions, len(slide_numbers))
+        partitions: List[List[int]] = []
+        start: int = 0
+        for partition_idx in range(partition_count):
+            end: int = start + len(slide_numbers) // partition_count + (1 if partition_idx < len(slide_numbers) % partition_count else 0)
+            partitions.append(slide_numbers[start:end])
+            start = end
+        return partitions
+
+    def process(self) -> None:
+        partitions: List[List[int]] = self.__get_partitions(self.__get_slide_numbers())
+        self.logger.log_info(f"Processing {sum(len(partition) for partition in partitions)} slides in {len(partitions)} partitions")
+        with ProcessPoolExecutor(max_workers=max(1, len(partitions)), initializer=_init_partition_process) as executor:
+            pending: Dict[Future, List[int]] = {executor.submit(_process_slide_partition, self.document_path, partition, self.options,
+                                                                self.llm_request, self.llm_utils, self.logger): partition
+                                                for partition in partitions}
+            while len(pending) > 0:
+                if self.drain_requested:
+                    for future in [future for future in pending if future.cancel()]:
+                        self.logger.log_warn(f"Slides {pending.pop(future)} were not processed")
+                done, _ = wait(pending.keys(), timeout=self.WAIT_SECONDS, return_when=FIRST_COMPLETED)
+                for future in done:
+                    partition: List[int] = pending.pop(future)
+                    try:
+                        members: Dict[str, bytes] = future.result()
+                    except Exception as err:
+                        self.logger.log_error(f"Partition of slides {partition[0]}-{partition[-1]} failed, its slides are kept unchanged: {err=}, {type(err)=}")
+                        continue
+                    self.members.update(members)
+                    self.logger.log_info(f"Partition of slides {partition[0]}-{partition[-1]} done, {len(members)} parts modified")
+
+    def request_drain(self) -> None:
+        # Called from a signal handler: partitions not started yet are cancelled
+        self.drain_requested = True
+
+    def save(self, filename: str) -> None:
+        if PackageWriter(self.document_path, self.logger).save_members(self.members, filename):
+            self.logger.log_info(f"Saved final document as {filename}, {len(self.members)} parts merged from the slide partitions")
+            return
+        # The merged parts replace the ones of the source presentation, saved as a whole
+        document: any = Presentation(self.document_path)
+        for part in document.part.package.iter_parts():
+            if part.partname.membername in self.members and hasattr(part, "_element"):
+                part._element = parse_xml(self.members[part.partname.membername])
+        document.save(filename)
+        self.logger.log_info(f"Saved final document as {filename}")
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, List
 from pprint import pformat
 import threading
 import time
@@ -6,26 +6,47 @@ from datetime import datetime
 import re
 
 from domain.llm_endpoint_request import LLMEndpointRequest
-from domain.queue import Queue, Metadata, ThreadSafeQueue
+from domain.queue import IQueue, Queue, Metadata, ThreadSafeQueue
 from domain.logger import GenericLogger
 from domain.worker_class import IProcessorType
 from domain.llm_utils import LLMUtils
+from domain.table_json import TableJson
+from domain.indexed_batch import IndexedBatch
+from domain.near_duplicates import NearDuplicateGroup, TokenPatch
 from infrastructure.openai_access_multithreaded import MultithreadedAccess, Statistics, BackoffTimeHandler
+from infrastructure.executor_metrics import ExecutorMetrics
+from infrastructure.checkpoint_journal import CheckpointJournal
 
 
 class SerializedDocProcessorType(IProcessorType):
-    def __init__(self, llm_request: LLMEndpointRequest, logger: GenericLogger):
-        self.queue: Queue = Queue()
+    EXECUTOR_NAME: str = "serial"
+    # Maximum time to wait for requests in flight before checking for a drain request
+    WAIT_SECONDS: float = 0.5
+
+    def __init__(self, llm_request: LLMEndpointRequest, logger: GenericLogger, max_parallel_thread: int = 1):
+        self.queue: IQueue = Queue()
         self.initial_size = 0
 
         self.llm_request: LLMEndpointRequest = llm_request
         self.logger: GenericLogger = logger
+        self.max_parallel_thread: int = max(1, max_parallel_thread)
+        self.metrics: ExecutorMetrics = ExecutorMetrics(self.EXECUTOR_NAME, logger)
+        self.journal: CheckpointJournal = None
+        self.drain_deadline: float = None
+        self.drain_logged: bool = False
 
     def add_element(self, metadata: Metadata) -> None:
         self.queue.add_element(metadata)
-        self.logger.log_trace(f"SerializedDocProcessorType: Saved elements in queue: Latest element: {metadata.get_text_to_transform()}\nAll elements: {pformat(['Element: ' + element.get_text_to_transform() for element in self.queue.get_all_queue_content()], width=250)}")
-        self.logger.log_trace(f"All text elements: {pformat(['Element: ' + element.get_text_to_transform() for element in self.queue.get_all_queue_content()], width=250)}")
-        #self.logger.log_trace(f"All pointers elements: {pformat(['Pointer: ' + ', '.join([str(pointer) + ': ' + pointer.text for pointer in element.get_pointers()]) + element.get_text_to_transform() for element in self.queue.get_all_queue_content()], width=250)}")
+        # Do not dump the whole queue here: it is quadratic and would load back every element spilled to disk
+        self.logger.log_trace(f"SerializedDocProcessorType: Saved element {self.queue.size()} in queue: {metadata.get_text_to_transform()}")
+
+    def set_queue(self, queue: IQueue) -> bool:
+        if not self.queue.is_empty():
+            self.logger.log_warn(f"Moving {self.queue.size()} elements to the new queue")
+            while not self.queue.is_empty():
+                queue.add_element(self.queue.pop_next_element())
+        self.queue = queue
+        return True
 
     def is_empty(self) -> bool:
         return self.queue.is_empty()
@@ -36,6 +57,32 @@ class SerializedDocProcessorType(IProcessorType):
     def pop_next_element(self) -> Metadata:
         return self.queue.pop_next_element()
     
+    def set_journal(self, journal: CheckpointJournal) -> bool:
+        self.journal = journal
+        return True
+
+    def set_llm_request(self, llm_request: LLMEndpointRequest) -> bool:
+        # Executors are created for each run: the next run uses the new requester
+        self.llm_request = llm_request
+        return True
+
+    def request_drain(self, grace_seconds: float) -> None:
+        # Single assignment: safe to be called from a signal handler
+        self.drain_deadline = time.monotonic() + grace_seconds
+
+    def _is_draining(self) -> bool:
+        if self.drain_deadline is not None and not self.drain_logged:
+            # Logged from the processing loop: the signal handler only sets the deadline
+            self.drain_logged = True
+            self.logger.log_warn(f"Request to stop: finishing the requests in flight (up to {self._get_grace_seconds_left():.0f} seconds). " +\
+                                 "Send the signal again to abort.")
+        return self.drain_deadline is not None
+
+    def _get_grace_seconds_left(self) -> float:
+        if self.drain_deadline is None:
+            return None
+        return max(0.0, self.drain_deadline - time.monotonic())
+
     def pack(self) -> None:
         pass
     
@@ -43,6 +90,8 @@ class SerializedDocProcessorType(IProcessorType):
         self.initial_size: int = self.size()
 
     def display_remaining_effort(self):
+        if self.initial_size <= 0:
+            return
         percent_done: int = int( 100 * (1 - self.size() / self.initial_size))
         self.logger.log_info(f"Processed {self.initial_size - self.size()} paragraphs out of {self.initial_size} paragraphs = {percent_done}%")
 
@@ -60,9 +109,19 @@ class SerializedDocProcessorType(IProcessorType):
     def __get_heading_request(self, heading_text: str) -> str:
         return f'[Process the text as per request considering it is a heading and ensure keeping one single line for the heading] {heading_text}'
 
+    def __get_near_duplicate_reference(self, metadata: Metadata) -> str:
+        group: NearDuplicateGroup = metadata.near_duplicate
+        if group is None or group.leader is metadata or group.response is None:
+            return ""
+        return f'[For consistency, a nearly identical text was processed before. Text: {group.leader.get_text_to_transform()} ' +\
+               f'Result: {group.response}] '
+
     
-    def process_next(self) -> None:
-        metadata: Metadata = self.pop_next_element()
+    def _build_request(self, metadata: Metadata) -> str:
+        """
+        Build the prompt sent to the LLM for one work element, None means nothing has to be sent.
+        Shared by all executor backends so that they can be compared on identical requests.
+        """
         text_to_transform: str = metadata.get_text_to_transform()
         context: str = metadata.get_context()
         request_type: str = metadata.get_request_type()
@@ -72,8 +131,14 @@ class SerializedDocProcessorType(IProcessorType):
         if request_type == LLMUtils.HEADING_REQUEST:
             if self.__is_single_line_heading(text_to_transform) or (text_to_transform is not None and len(text_to_transform) > 0):
                 request_str = self.__get_heading_request(text_to_transform)
+        elif request_type == LLMUtils.DEFAULT_REQUEST:
+            request_str = f'{self.__get_near_duplicate_reference(metadata)}{request_str}'
         elif request_type == LLMUtils.TABLE_REQUEST:
             request_str = f'[Process the table as per request and ensure keeping the STRICT same number of columns and rows] {text_to_transform}'
+        elif request_type == LLMUtils.TABLE_JSON_REQUEST:
+            request_str = f'{TableJson.TABLE_INSTRUCTION} {text_to_transform}'
+        elif request_type == LLMUtils.BATCH_REQUEST:
+            request_str = f'{IndexedBatch.INSTRUCTION} {text_to_transform}'
 
         if self.__is_context_needed(context, text_to_transform):
             request = f"[Considering the context: {context}] {request_str}"
@@ -84,22 +149,85 @@ class SerializedDocProcessorType(IProcessorType):
             request = f"{request_str}"
         else:
             self.logger.log_trace(f"Skipping request because initial_text = >{text_to_transform}<")
-            return
+            self.metrics.add_skipped()
+            return None
 
         request_info: str = '  ' + '\n  '.join(request.replace('\n', '').replace(']', ']\n').split('\n'))
         self.logger.log_trace(f'Request preparation to LLM:\n{"-" * 20}\n\n{request_info}')
-
-        new_text = self.llm_request.transform_text(request, request_type)
+        return request
+
+    def _request_llm(self, request: str, request_type: str) -> str:
+        started: float = time.perf_counter()
+        new_text: str = self.llm_request.transform_text(request, request_type)
+        self.metrics.add_request(time.perf_counter() - started, len(request), len(new_text))
+        return new_text
+
+    def _replay(self, metadata: Metadata) -> bool:
+        # Responses already paid for in a previous run are written back without calling the LLM
+        if self.journal is None:
+            return self.__reuse_near_duplicate(metadata)
+        new_text: str = self.journal.get_response(CheckpointJournal.fingerprint(metadata))
+        if new_text is None:
+            return self.__reuse_near_duplicate(metadata)
+        self.logger.log_debug(f"Replaying response from journal for: {metadata.get_text_to_transform()[0:50]}...")
+        self.metrics.add_replayed()
+        self._write_back(metadata, new_text, journaled=True)
+        return True
+
+    def __reuse_near_duplicate(self, metadata: Metadata) -> bool:
+        # The response of the leader is reused when the segment only differs by tokens found as is in this response
+        group: NearDuplicateGroup = metadata.near_duplicate
+        if group is None or group.leader is metadata or group.response is None:
+            return False
+        leader_text: str = group.leader.get_text_to_transform()
+        substitutions: Dict[str, str] = TokenPatch.get_substitutions(leader_text, metadata.get_text_to_transform())
+        new_text: str = TokenPatch.apply(leader_text, group.response, substitutions) if substitutions is not None else None
+        if new_text is None:
+            return False
+        self.logger.log_debug(f"Reusing the response of a near duplicate for: {metadata.get_text_to_transform()[0:50]}...")
+        self.metrics.add_reused()
+        self._write_back(metadata, new_text)
+        return True
+
+    def _write_back(self, metadata: Metadata, new_text: str, journaled: bool = False) -> None:
+        request_type: str = metadata.get_request_type()
+        if metadata.near_duplicate is not None and metadata.near_duplicate.leader is metadata:
+            metadata.near_duplicate.response = new_text
+        if self.journal is not None and not journaled:
+            self.journal.append(CheckpointJournal.fingerprint(metadata), request_type, new_text)
         new_text_info: str = '  ' + '\n  '.join(new_text.split('\n'))
         self.logger.log_info(f'\nLLM response:\n{"-" * 13}\n{new_text_info}\n')
 
+        started: float = time.perf_counter()
         metadata.update_llm_response_in_document(new_text, request_type)
+        self.metrics.add_write_back(time.perf_counter() - started)
         self.logger.log_info(f'\n  >> {"=" * 15} End document update for this request {"=" * 15}\n')
 
+    def process_next(self) -> None:
+        metadata: Metadata = self.pop_next_element()
+        if self._replay(metadata):
+            return
+        request: str = self._build_request(metadata)
+        if request is None:
+            return
+
+        try:
+            new_text = self._request_llm(request, metadata.get_request_type())
+        except Exception as err:
+            self.logger.log_error(f"Request failed for {metadata.get_text_to_transform()[0:50]}..., keeping the initial text: {err=}, {type(err)=}")
+            return
+        self._write_back(metadata, new_text)
+
     def process_all(self) -> None:
         self.trigger_process_start()
-        while not self.is_empty():
+        self.metrics.start()
+        # The request in flight is always completed: a second signal is needed to abort it
+        while not self.is_empty() and not self._is_draining():
             self.process_next()        
+        if self._is_draining():
+            self.logger.log_warn(f"Stopped dispatching requests, {self.size()} elements were not processed")
+        self.metrics.stop()
+        self.logger.log_info(self.metrics.get_statistics())
 
 class SerializedSynchronizedDocProcessorType(IProcessorType):
     class Metadata:
@@ -117,6 +245,7 @@ class SerializedSynchronizedDocProcessorType(IProcessorType):
         self.max_parallel_thread: int = max_parallel_thread
         self.running_thread_ids: List[MultithreadedAccess] = []
         self.statistics: Statistics = Statistics(logger)
+        self.drain_deadline: float = None
  
     def add_element(self, metadata: Metadata) -> None:
         self.queue.add_element(metadata)
@@ -149,6 +278,11 @@ class SerializedSynchronizedDocProcessorType(IProcessorType):
         self.stop_now = True
         self.thread_stop_thread.release()
 
+    def request_drain(self, grace_seconds: float) -> None:
+        # No lock here: this is called from a signal handler possibly interrupting __get_stop_now
+        self.drain_deadline = time.monotonic() + grace_seconds
+        self.stop_now = True
+
     def __get_stop_now(self) -> bool:
         stop_now: bool = False
 
@@ -219,8 +353,17 @@ class SerializedSynchronizedDocProcessorType(IProcessorType):
 
             time.sleep(0.1)
         
+        if self.drain_deadline is not None:
+            self.logger.log_warn(f"Request to stop: waiting for {len(self.running_thread_ids)} threads " +\
+                                 f"(up to {max(0.0, self.drain_deadline - time.monotonic()):.0f} seconds). Send the signal again to abort.")
         for thread_ptr in self.running_thread_ids:
             self.logger.log_info(f"Joining thread {thread_ptr.get_thread_id()}")            
-            thread_ptr.join()
+            if self.drain_deadline is None:
+                thread_ptr.join()
+            else:
+                thread_ptr.join(max(0.0, self.drain_deadline - time.monotonic()))
+                if thread_ptr.is_alive():
+                    self.logger.log_warn(f"Grace period expired, abandoning thread {thread_ptr.get_thread_id()}: {thread_ptr.get_transformed_text()[0:50]}...")
+                    thread_ptr.skip_this_thread()
         self.logger.log_info(self.statistics.get_statistics())
         self.logger.log_info("Done!")
\ No newline at end of file
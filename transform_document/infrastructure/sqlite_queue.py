@@ -0,0 +1,117 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Callable, Dict, List
+
+from domain.queue import IQueue, Metadata
+from domain.logger import GenericLogger
+
+
+class SQLiteQueue(IQueue):
+    # Pending work elements are spilled to a local SQLite file: only their text, context, request type
+    # and locator are stored, pointers to the document are resolved again when the element is popped.
+    COMMIT_EVERY: int = 500
+
+    def __init__(self, store_path: str, metadata_factory: Callable[[Dict], Metadata], logger: GenericLogger):
+        self.store_path: str = store_path
+        self.metadata_factory: Callable[[Dict], Metadata] = metadata_factory
+        self.logger: GenericLogger = logger
+        self.thread_lock_queue = threading.Lock()
+        if os.path.exists(store_path):
+            self.logger.log_warn(f"Removing previous work item store {store_path}")
+            os.remove(store_path)
+        self.connection: sqlite3.Connection = sqlite3.connect(store_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=OFF")
+        self.connection.execute("CREATE TABLE work_items (id INTEGER PRIMARY KEY AUTOINCREMENT, " +\
+                                "text TEXT, context TEXT, request_type TEXT, locator TEXT)")
+        self.queue_size: int = 0
+        self.uncommitted: int = 0
+        self.logger.log_info(f"Spilling pending work items to {store_path}")
+
+    def __commit(self) -> None:
+        if self.uncommitted > 0:
+            self.connection.commit()
+            self.uncommitted = 0
+
+    def __to_metadata(self, row: tuple) -> Metadata:
+        if row is None:
+            return None
+        _, text, context, request_type, locator = row
+        return self.metadata_factory({
+            "text": text,
+            "context": context,
+            "request_type": request_type,
+            "locator": json.loads(locator)
+        })
+
+    def add_element(self, metadata: Metadata) -> None:
+        record: Dict = metadata.to_record()
+        if record["locator"] is None:
+            raise ValueError(f"Work element without locator cannot be spilled to disk: {metadata.get_text_to_transform()[0:50]}")
+        self.thread_lock_queue.acquire()
+        self.connection.execute("INSERT INTO work_items (text, context, request_type, locator) VALUES (?, ?, ?, ?)",
+                                (record["text"], record["context"], record["request_type"], json.dumps(record["locator"])))
+        self.queue_size += 1
+        self.uncommitted += 1
+        if self.uncommitted >= self.COMMIT_EVERY:
+            self.__commit()
+        self.thread_lock_queue.release()
+
+    def get_element(self, index: int) -> Metadata:
+        self.thread_lock_queue.acquire()
+        row: tuple = self.connection.execute("SELECT * FROM work_items ORDER BY id LIMIT 1 OFFSET ?", (index,)).fetchone()
+        self.thread_lock_queue.release()
+        return self.__to_metadata(row)
+
+    def get_next_element(self) -> Metadata:
+        return self.get_element(0)
+
+    def delete_next_element(self) -> None:
+        self.thread_lock_queue.acquire()
+        cursor: sqlite3.Cursor = self.connection.execute("DELETE FROM work_items WHERE id = (SELECT MIN(id) FROM work_items)")
+        self.queue_size -= cursor.rowcount
+        self.uncommitted += 1
+        self.thread_lock_queue.release()
+
+    def pop_next_element(self) -> Metadata:
+        self.thread_lock_queue.acquire()
+        row: tuple = self.connection.execute("SELECT * FROM work_items ORDER BY id LIMIT 1").fetchone()
+        if row is not None:
+            self.connection.execute("DELETE FROM work_items WHERE id = ?", (row[0],))
+            self.queue_size -= 1
+            self.uncommitted += 1
+        self.thread_lock_queue.release()
+        return self.__to_metadata(row)
+
+    def del_element(self, index: int) -> None:
+        self.thread_lock_queue.acquire()
+        cursor: sqlite3.Cursor = self.connection.execute("DELETE FROM work_items WHERE id = (SELECT id FROM work_items ORDER BY id LIMIT 1 OFFSET ?)", (index,))
+        self.queue_size -= cursor.rowcount
+        self.uncommitted += 1
+        self.thread_lock_queue.release()
+
+    def is_empty(self) -> bool:
+        return self.size() == 0
+
+    def size(self) -> int:
+        self.thread_lock_queue.acquire()
+        queue_size: int = self.queue_size
+        self.thread_lock_queue.release()
+        return queue_size
+
+    def get_all_queue_content(self) -> List[Metadata]:
+        # Materializes every element in memory: only intended for debugging
+        self.thread_lock_queue.acquire()
+        rows: List = self.connection.execute("SELECT * FROM work_items ORDER BY id").fetchall()
+        self.thread_lock_queue.release()
+        return [self.__to_metadata(row) for row in rows]
+
+    def close(self) -> None:
+        self.thread_lock_queue.acquire()
+        self.__commit()
+        self.connection.close()
+        self.thread_lock_queue.release()
+        if os.path.exists(self.store_path):
+            os.remove(self.store_path)
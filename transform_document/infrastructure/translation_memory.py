@@ -0,0 +1,69 @@
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, List, Tuple
+
+from domain.logger import GenericLogger
+
+
+class TranslationMemory:
+    # SQLite store of the responses of previous runs sentence by sentence, keyed by the source sentence and the
+    # run (transformation, language, model): it survives changes of the sections the sentences belong to.
+    BUSY_TIMEOUT_SECONDS: float = 60.0
+    QUERY_CHUNK_SIZE: int = 500
+
+    def __init__(self, memory_path: str, run_key: str, logger: GenericLogger):
+        self.memory_path: str = memory_path
+        self.run_key: str = run_key
+        self.logger: GenericLogger = logger
+        # One connection per thread: SQLite connections cannot be shared across threads
+        self.thread_local = threading.local()
+        self.__get_connection().execute("CREATE TABLE IF NOT EXISTS sentences (source_hash TEXT, run_key TEXT, source TEXT, target TEXT, " +\
+                                        "PRIMARY KEY (source_hash, run_key))")
+
+    def __getstate__(self):
+        # Connections are opened again by the processes the memory is sent to
+        state = self.__dict__.copy()
+        del state['thread_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.thread_local = threading.local()
+
+    def __get_connection(self) -> sqlite3.Connection:
+        connection: sqlite3.Connection = getattr(self.thread_local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.memory_path, timeout=self.BUSY_TIMEOUT_SECONDS, isolation_level=None)
+            self.thread_local.connection = connection
+        return connection
+
+    @staticmethod
+    def __get_hash(sentence: str) -> str:
+        return hashlib.sha256(sentence.encode("utf-8")).hexdigest()
+
+    def get_translations(self, sentences: List[str]) -> Dict[str, str]:
+        """
+        Returns the known responses of the sentences, sentences never processed in this run configuration are missing.
+        """
+        hashes: Dict[str, str] = {self.__get_hash(sentence): sentence for sentence in sentences}
+        hash_list: List[str] = list(hashes.keys())
+        translations: Dict[str, str] = {}
+        for start in range(0, len(hash_list), self.QUERY_CHUNK_SIZE):
+            chunk: List[str] = hash_list[start:start + self.QUERY_CHUNK_SIZE]
+            rows: List[Tuple] = self.__get_connection().execute(
+                f"SELECT source_hash, source, target FROM sentences WHERE run_key = ? AND source_hash IN ({','.join('?' * len(chunk))})",
+                [self.run_key, *chunk]).fetchall()
+            # The source is compared as well: hash collisions never return the response of another sentence
+            translations.update({source: target for source_hash, source, target in rows if hashes[source_hash] == source})
+        return translations
+
+    def store(self, pairs: List[Tuple[str, str]]) -> None:
+        if len(pairs) == 0:
+            return
+        connection: sqlite3.Connection = self.__get_connection()
+        connection.execute("BEGIN IMMEDIATE")
+        connection.executemany("INSERT OR REPLACE INTO sentences VALUES (?, ?, ?, ?)",
+                               [(self.__get_hash(source), self.run_key, source, target) for source, target in pairs])
+        connection.execute("COMMIT")
+        self.logger.log_debug(f"Stored {len(pairs)} sentences in the translation memory {self.memory_path}")
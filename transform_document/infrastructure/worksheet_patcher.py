@@ -0,0 +1,81 @@
+import re
+import zipfile
+from typing import Dict, Iterator
+from xml.sax.saxutils import escape
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+from domain.logger import GenericLogger
+
+
+class PatchedCell:
+    # Stands for a worksheet cell when the workbook is not loaded: the value set is recorded as a patch of its sheet
+    __slots__ = ("patches", "coordinate")
+
+    def __init__(self, patches: Dict[str, str], coordinate: str):
+        self.patches: Dict[str, str] = patches
+        self.coordinate: str = coordinate
+
+    @property
+    def value(self) -> str:
+        return self.patches.get(self.coordinate)
+
+    @value.setter
+    def value(self, value: str) -> None:
+        self.patches[self.coordinate] = value
+
+
+class WorksheetPatcher:
+    # Rewrites the cells of xlsx worksheet parts without loading the workbook: the sheet XML is streamed from the
+    # source archive row by row and only the patched cells are replaced by inline strings keeping their style.
+    CHUNK_SIZE: int = 1024 * 1024
+    ROW_END: bytes = b"</row>"
+    CELL_REGEXP = re.compile(rb'<c\b(?P<attributes>[^>]*?)\s*(?:/>|>.*?</c>)', re.S)
+    COORDINATE_REGEXP = re.compile(rb'\br="(?P<coordinate>[A-Z]+\d+)"')
+    TYPE_REGEXP = re.compile(rb'\s+t="[^"]*"')
+
+    def __init__(self, source_path: str, logger: GenericLogger):
+        self.source_path: str = source_path
+        self.logger: GenericLogger = logger
+        self.patches: Dict[str, Dict[str, str]] = {}
+
+    def get_cell(self, worksheet_path: str, coordinate: str) -> PatchedCell:
+        return PatchedCell(self.patches.setdefault(worksheet_path, {}), coordinate)
+
+    def get_patch_count(self) -> int:
+        return sum(len(patches) for patches in self.patches.values())
+
+    @staticmethod
+    def __get_inline_string(attributes: bytes, text: str) -> bytes:
+        text = ILLEGAL_CHARACTERS_RE.sub("", text)
+        return b'<c' + WorksheetPatcher.TYPE_REGEXP.sub(b'', attributes) + b' t="inlineStr"><is><t xml:space="preserve">' + \
+               escape(text).encode("utf-8") + b'</t></is></c>'
+
+    def __patch_rows(self, rows: bytes, patches: Dict[bytes, str]) -> bytes:
+        def patch_cell(match: re.Match) -> bytes:
+            coordinate: re.Match = self.COORDINATE_REGEXP.search(match.group("attributes"))
+            if coordinate is None or coordinate.group("coordinate") not in patches:
+                return match.group(0)
+            return self.__get_inline_string(match.group("attributes"), patches.pop(coordinate.group("coordinate")))
+        return self.CELL_REGEXP.sub(patch_cell, rows)
+
+    def stream_worksheet(self, worksheet_path: str) -> Iterator[bytes]:
+        """
+        Yields the patched XML of a worksheet part, only complete rows are patched at a time.
+        """
+        patches: Dict[bytes, str] = {coordinate.encode("ascii"): text for coordinate, text in self.patches[worksheet_path].items()}
+        buffer: bytes = b""
+        with zipfile.ZipFile(self.source_path) as source, source.open(worksheet_path) as member:
+            while True:
+                chunk: bytes = member.read(self.CHUNK_SIZE)
+                buffer += chunk
+                rows_end: int = buffer.rfind(self.ROW_END) + len(self.ROW_END) if len(chunk) > 0 else len(buffer)
+                if rows_end >= len(self.ROW_END) or len(chunk) == 0:
+                    yield self.__patch_rows(buffer[0:rows_end], patches) if len(patches) > 0 else buffer[0:rows_end]
+                    buffer = buffer[rows_end:]
+                if len(chunk) == 0:
+                    break
+        if len(patches) > 0:
+            self.logger.log_warn(f"Cells {[coordinate.decode('ascii') for coordinate in patches]} not found in {worksheet_path}, they are kept unchanged")
+
+    def get_members(self) -> Dict[str, Iterator[bytes]]:
+        return {worksheet_path: self.stream_worksheet(worksheet_path) for worksheet_path in self.patches if len(self.patches[worksheet_path]) > 0}
@@ -1,6 +1,6 @@
 import re
 import os
-from typing import Dict, List
+from typing import Dict, List, Tuple
 from pathlib import Path
 
 from domain.iopen_document import IOpenDocument
@@ -8,10 +8,23 @@ from domain.llm_endpoint_request import LLMEndpointRequest
 from domain.worker_class import IProcessorType, Worker, MultithreadedWorkers
 from domain.llm_utils import LLMUtils
 from domain.iml_access import IMLAccess
-from infrastructure.open_microsoft_document import OpenXLSDocument
+from domain.segmenter import TokenBudgetSegmenter
+from domain.segment_filter import SegmentFilter
+from domain.near_duplicates import MinHashIndex
+from infrastructure.open_microsoft_document import IOpenAndUpdateDocument, OpenXLSDocument
 from infrastructure.open_ppt_document import OpenPPTDocument
+from infrastructure.partitioned_ppt_document import PartitionedPPTDocument
 from infrastructure.open_doc_document import OpenDOCDocument
+from infrastructure.open_text_document import OpenStreamDocument, OpenTextDocument, OpenMarkdownDocument, OpenCSVDocument
 from infrastructure.processors import SerializedDocProcessorType, SerializedSynchronizedDocProcessorType
+from infrastructure.executors import create_worker
+from infrastructure.sqlite_queue import SQLiteQueue
+from infrastructure.checkpoint_journal import CheckpointJournal
+from infrastructure.extraction_cache import ExtractionCache
+from infrastructure.language_detector import TargetLanguageFilter
+from infrastructure.translation_memory import TranslationMemory
+from infrastructure.job_store import JobStore
+from infrastructure.distributed import JobStoreCoordinatorProcessorType
 from infrastructure.generic_logger import GenericLogger
 from infrastructure.openai_access import OpenAIAccess
 from infrastructure.openai_debug_access import OpenAIDebugAccess
@@ -30,18 +43,74 @@ class ApplicationService:
                  use_debugger_ai: bool = False,
                  slides_to_skip: List = None,
                  slides_to_keep: List = None,
-                 context_path: str = None):
+                 context_path: str = None,
+                 executor: str = None,
+                 work_item_store: str = None,
+                 resume: bool = False,
+                 journal_path: str = None,
+                 job_store_path: str = None,
+                 max_request_tokens: int = TokenBudgetSegmenter.DEFAULT_MAX_REQUEST_TOKENS,
+                 json_tables: bool = False,
+                 extraction_cache_path: str = None,
+                 batch_slides: bool = False,
+                 slide_partitions: int = 1,
+                 batch_cells: bool = False,
+                 cell_ranges: List = None,
+                 prefilter: bool = False,
+                 prefilter_patterns: List = None,
+                 skip_target_language: bool = False,
+                 target_language_confidence: float = TargetLanguageFilter.DEFAULT_MIN_CONFIDENCE,
+                 translation_memory_path: str = None,
+                 near_duplicates: bool = False,
+                 near_duplicate_threshold: float = MinHashIndex.DEFAULT_THRESHOLD,
+                 fan_out: List[Tuple[int, str, str]] = None):
         
         self.logger: GenericLogger = logger
         self.to_document = to_document
+        self.worker: Worker = None
+        self.drain_requested: bool = False
         self.open_document: IOpenDocument = None
         self.llm_utils = llm_utils
+        self.target_language: str = None
+        self.engine_name: str = engine_name
+        self.use_debugger_ai: bool = use_debugger_ai
+        self.translation_memory_path: str = translation_memory_path
+        self.max_parallel_thread: int = max_parallel_thread
+        self.max_request_tokens: int = max_request_tokens
+        self.executor: str = executor
+        self.resume: bool = resume
+        self.prefilter_patterns: List = prefilter_patterns if prefilter else None
+        self.skip_target_language: bool = skip_target_language
+        self.target_language_confidence: float = target_language_confidence
+        self.near_duplicate_threshold: float = near_duplicate_threshold if near_duplicates else None
+        # Other (transformation, language, output document) produced from the same extraction
+        self.fan_out: List[Tuple[int, str, str]] = fan_out or []
         llm_requester: LLMEndpointRequest = self.__create_line_udater(
             transformation, from_language, 
             engine_name,
             use_debugger_ai
         )
-        worker: Worker = ApplicationService.__create_worker(llm_requester, logger, max_parallel_thread)
+        run_key: str = self.__get_run_key(transformation, from_language)
+        self.__use_translation_memory(llm_requester, run_key)
+        self.job_store: JobStore = None
+        worker: Worker = None
+        # Each slide partition creates its own worker in its process
+        slide_partitioned: bool = slide_partitions > 1 and re.search(r'\.ppt[\w]*$', document_path) is not None
+        if slide_partitioned:
+            logger.log_info(f"Running in {slide_partitions} slide partitions")
+        elif job_store_path is not None:
+            if executor is not None:
+                logger.log_warn(f"Executor {executor} is ignored: requests are processed by the workers of the job store {job_store_path}")
+            self.job_store = JobStore(job_store_path, logger)
+            self.job_store.create_job({"how_to_transform": llm_requester.how_to_transform,
+                                       "temperature": llm_requester.temperature, "top_p": llm_requester.top_p,
+                                       "engine": engine_name, "use_debugger_ai": use_debugger_ai,
+                                       "max_request_tokens": max_request_tokens})
+            worker = Worker(JobStoreCoordinatorProcessorType(llm_requester, logger, self.job_store), logger)
+            logger.log_info(f"Running as coordinator, start workers with: transform_document worker --job_store {job_store_path}")
+        else:
+            worker = ApplicationService.__create_worker(llm_requester, logger, max_parallel_thread, executor)
+        self.worker = worker
         logger.log_info(f'Transforming from {document_path} to {to_document}.')
         if len(slides_to_skip) > 0: logger.log_info(f'Slides to skip: {slides_to_skip}.')
         if len(slides_to_keep) > 0: logger.log_info(f'Slides to keep: {slides_to_keep}.')
@@ -66,27 +135,153 @@ class ApplicationService:
                                                  worker, 
                                                  paragraph_start_min_word_numbers, paragraph_start_min_word_length, 
                                                  logger,
-                                                 force_context_content)
+                                                 force_context_content,
+                                                 max_request_tokens,
+                                                 json_tables)
         elif re.search(r'\.xls[\w]*$', document_path):
             logger.log_info("Handling XLS document")
             self.open_document = OpenXLSDocument(document_path, 
                                                  worker, 
                                                  paragraph_start_min_word_numbers, paragraph_start_min_word_length, 
-                                                 logger)        
+                                                 logger,
+                                                 max_request_tokens,
+                                                 batch_cells,
+                                                 cell_ranges)        
+        elif re.search(r'\.md$|\.markdown$', document_path):
+            logger.log_info("Handling Markdown document")
+            self.open_document = OpenMarkdownDocument(document_path,
+                                                      worker,
+                                                      paragraph_start_min_word_numbers, paragraph_start_min_word_length,
+                                                      logger)
+        elif re.search(r'\.txt$|\.text$', document_path):
+            logger.log_info("Handling text document")
+            self.open_document = OpenTextDocument(document_path,
+                                                  worker,
+                                                  paragraph_start_min_word_numbers, paragraph_start_min_word_length,
+                                                  logger)
+        elif re.search(r'\.csv$|\.tsv$', document_path):
+            logger.log_info("Handling CSV document")
+            self.open_document = OpenCSVDocument(document_path,
+                                                 worker,
+                                                 paragraph_start_min_word_numbers, paragraph_start_min_word_length,
+                                                 logger)
         elif re.search(r'\.ppt[\w]*$', document_path):
             logger.log_info("Handling PPT document")
 
-            self.open_document = OpenPPTDocument(document_path, 
-                                                 worker, 
-                                                 paragraph_start_min_word_numbers, paragraph_start_min_word_length, 
-                                                 slides_to_skip, slides_to_keep, 
-                                                 logger, llm_utils)
+            if slide_partitioned:
+                if job_store_path is not None or work_item_store is not None or extraction_cache_path is not None or resume:
+                    logger.log_warn("Job store, work item store, extraction cache and resume are not supported with slide partitions and are ignored")
+                self.open_document = PartitionedPPTDocument(document_path,
+                                                            llm_requester, executor, max_parallel_thread,
+                                                            paragraph_start_min_word_numbers, paragraph_start_min_word_length,
+                                                            slides_to_skip, slides_to_keep,
+                                                            logger, llm_utils,
+                                                            slide_partitions,
+                                                            max_request_tokens,
+                                                            json_tables,
+                                                            batch_slides,
+                                                            prefilter_patterns if prefilter else None,
+                                                            self.__get_target_language_filter(skip_target_language, target_language_confidence),
+                                                            near_duplicate_threshold if near_duplicates else None)
+            else:
+                self.open_document = OpenPPTDocument(document_path, 
+                                                     worker, 
+                                                     paragraph_start_min_word_numbers, paragraph_start_min_word_length, 
+                                                     slides_to_skip, slides_to_keep, 
+                                                     logger, llm_utils,
+                                                     max_request_tokens,
+                                                     json_tables,
+                                                     batch_slides)
+
+        self.input_file_hash: str = CheckpointJournal.compute_file_hash(document_path) if self.open_document is not None else None
+        # Slide partitions extract and update their own copies of the document in other processes
+        segments_in_process: bool = isinstance(self.open_document, IOpenAndUpdateDocument)
+        if extraction_cache_path is not None and segments_in_process:
+            # Every option changing the segments extracted from the document is part of the cache key
+            extraction_options: Dict = {"paragraph_start_min_word_numbers": str(paragraph_start_min_word_numbers),
+                                        "paragraph_start_min_word_length": str(paragraph_start_min_word_length),
+                                        "slides_to_skip": slides_to_skip, "slides_to_keep": slides_to_keep,
+                                        "context": force_context_content, "max_request_tokens": max_request_tokens,
+                                        "json_tables": json_tables, "batch_slides": batch_slides, "batch_cells": batch_cells, "cell_ranges": cell_ranges,
+                                        "document_type": type(self.open_document).__name__}
+            self.open_document.use_extraction_cache(ExtractionCache(extraction_cache_path, self.input_file_hash, extraction_options, logger))
+
+        if work_item_store is None and isinstance(self.open_document, OpenStreamDocument) and not near_duplicates and job_store_path is None:
+            # Streamed documents are not held in memory: neither are their pending segments, unless they are grouped
+            work_item_store = f'{to_document}.work_items'
+        if near_duplicates and segments_in_process and work_item_store is not None:
+            # Spilled work items are rebuilt from their records: they cannot share the response of their leader
+            logger.log_warn("Near duplicates are not grouped when the work items are spilled to a work item store")
+            self.near_duplicate_threshold = None
+        if segments_in_process:
+            self.__use_segment_stages(self.open_document)
+
+        if len(self.fan_out) > 0:
+            if not segments_in_process or self.job_store is not None:
+                logger.log_warn("Several transformations or languages are not supported with slide partitions or a job store, " +\
+                                f"only {to_document} is produced")
+                self.fan_out = []
+            else:
+                logger.log_info(f"The document is extracted once for {len(self.fan_out) + 1} transformations and languages")
+                self.open_document.keep_records()
+
+        self.work_item_store: SQLiteQueue = None
+        if work_item_store is not None and segments_in_process:
+            self.work_item_store = SQLiteQueue(work_item_store, self.open_document.metadata_from_record, logger)
+            if not worker.use_queue(self.work_item_store):
+                self.work_item_store.close()
+                self.work_item_store = None
+
+        self.journal: CheckpointJournal = None
+        if segments_in_process:
+            journal_path = journal_path if journal_path is not None else f'{to_document}.journal'
+            self.journal = CheckpointJournal(journal_path, self.input_file_hash, run_key, resume, logger)
+            if not worker.use_journal(self.journal):
+                self.journal.close(remove=True)
+                self.journal = None
+
+    def __get_run_key(self, transformation: int, from_language: str) -> str:
+        # Responses are only reusable by runs with the same transformation, language and model
+        return f'transformation={transformation}|language={from_language}|engine={self.engine_name}|debugger_ai={self.use_debugger_ai}'
+
+    def __use_translation_memory(self, llm_requester: LLMEndpointRequest, run_key: str) -> None:
+        if self.translation_memory_path is None:
+            return
+        if self.target_language is None:
+            self.logger.log_warn("The transformation is not a translation, the translation memory is not used")
+            return
+        self.logger.log_info(f"Reusing and storing the translated sentences in {self.translation_memory_path}")
+        llm_requester.use_translation_memory(TranslationMemory(self.translation_memory_path, run_key, self.logger))
+
+    def __use_segment_stages(self, open_document: IOpenAndUpdateDocument) -> None:
+        # Filters and grouping depend on the target language: they are created for each document produced
+        if self.prefilter_patterns is not None:
+            open_document.use_segment_filter(SegmentFilter(self.logger, self.prefilter_patterns))
+        target_language_filter: TargetLanguageFilter = self.__get_target_language_filter(self.skip_target_language, self.target_language_confidence)
+        if target_language_filter is not None:
+            open_document.use_segment_filter(target_language_filter)
+        if self.near_duplicate_threshold is not None:
+            open_document.use_near_duplicate_index(MinHashIndex(self.logger, self.near_duplicate_threshold))
+
+    def __get_target_language_filter(self, skip_target_language: bool, target_language_confidence: float) -> TargetLanguageFilter:
+        if not skip_target_language:
+            return None
+        if self.target_language is None:
+            self.logger.log_warn("The transformation is not a translation, segments already in the target language cannot be skipped")
+            return None
+        target_language_filter: TargetLanguageFilter = TargetLanguageFilter(self.target_language, self.logger, target_language_confidence)
+        if not target_language_filter.is_supported():
+            self.logger.log_warn(f"No language profile for {self.target_language}, segments already in the target language cannot be skipped")
+            return None
+        return target_language_filter
 
     @staticmethod
-    def __create_worker(line_updater: LLMEndpointRequest, logger: GenericLogger, max_parallel_thread: int) -> Worker:
+    def __create_worker(line_updater: LLMEndpointRequest, logger: GenericLogger, max_parallel_thread: int, executor: str = None) -> Worker:
         processor_type: IProcessorType = None
         worker: Worker = None
-        if max_parallel_thread <= 1:
+        if executor is not None:
+            worker = create_worker(executor, line_updater, logger, max_parallel_thread)
+        elif max_parallel_thread <= 1:
             processor_type = SerializedDocProcessorType(line_updater, logger)
             worker = Worker(processor_type, logger) 
             logger.log_info("Running in a single thread") 
@@ -100,19 +295,97 @@ class ApplicationService:
                              engine_name: str,
                              use_debugger_ai: bool) -> LLMEndpointRequest:
         line_updater: LLMEndpointRequest = None
-        mlaccess: IMLAccess = OpenAIAccess(self.logger, engine_name) if not use_debugger_ai else OpenAIDebugAccess(logger)
-        request: Dict = self.llm_utils.get_request(transformation)
+        mlaccess: IMLAccess = OpenAIAccess(self.logger, engine_name) if not use_debugger_ai else OpenAIDebugAccess(self.logger)
+        # Requests are built for the language of the run before one of them is selected
         self.llm_utils.set_requests(from_language)
+        request: Dict = self.llm_utils.get_request(transformation)
+        self.target_language = request.get(LLMUtils.TARGET_LANGUAGE)
         line_updater: LLMEndpointRequest = LLMEndpointRequest(mlaccess, request[self.llm_utils.HOW_TO_TRANSFORM], self.logger)
+        # Paragraphs larger than the budget are sent in parts
+        line_updater.use_segmenter(TokenBudgetSegmenter(self.max_request_tokens, self.logger))
 
         return line_updater
     
     def process(self):
-        self.open_document.process()
-        self.open_document.save(self.to_document)
+        # Copied before the first document is updated, each other output is forked from this copy
+        parsed_document: IOpenAndUpdateDocument = self.open_document.fork() if len(self.fan_out) > 0 else None
+        self.__process_document(self.open_document, self.to_document, self.journal)
+        for transformation, from_language, to_document in self.fan_out:
+            if self.drain_requested:
+                self.logger.log_warn(f"Stopped before producing {to_document}")
+                break
+            self.__process_fork(parsed_document, transformation, from_language, to_document)
+        if self.work_item_store is not None:
+            self.work_item_store.close()
+        if self.job_store is not None:
+            self.job_store.close()
+
+    def __process_document(self, open_document: IOpenDocument, to_document: str, journal: CheckpointJournal) -> None:
+        open_document.process()
+        if self.drain_requested:
+            # The journal is kept so that the run can be completed with --resume
+            self.save_partial(open_document, to_document, journal)
+        else:
+            open_document.save(to_document)
+            # The document is safely saved, the responses do not need to be replayed anymore
+            if journal is not None:
+                journal.close(remove=True)
+
+    def __process_fork(self, parsed_document: IOpenAndUpdateDocument, transformation: int, from_language: str, to_document: str) -> None:
+        # The segments extracted for the first document are dispatched again with the request of this transformation
+        self.logger.log_info(f'Transforming with transformation {transformation} and language {from_language} to {to_document}.')
+        llm_requester: LLMEndpointRequest = self.__create_line_udater(transformation, from_language, self.engine_name, self.use_debugger_ai)
+        run_key: str = self.__get_run_key(transformation, from_language)
+        self.__use_translation_memory(llm_requester, run_key)
+        open_document: IOpenAndUpdateDocument = parsed_document.fork()
+        open_document.use_records(self.open_document.get_records())
+        worker: Worker = self.worker
+        if worker.use_llm_request(llm_requester):
+            if self.work_item_store is not None:
+                # Spilled work items are written back to the document they were dispatched for
+                self.work_item_store.metadata_factory = open_document.metadata_from_record
+        else:
+            worker = ApplicationService.__create_worker(llm_requester, self.logger, self.max_parallel_thread, self.executor)
+            self.worker = worker
+        open_document.worker = worker
+        self.__use_segment_stages(open_document)
+        journal: CheckpointJournal = CheckpointJournal(f'{to_document}.journal', self.input_file_hash, run_key, self.resume, self.logger)
+        if not worker.use_journal(journal):
+            journal.close(remove=True)
+            journal = None
+        self.__process_document(open_document, to_document, journal)
+
+    def close(self) -> None:
+        # Stopped before processing: the journal is kept for --resume, the spilled work items are removed
+        if self.journal is not None:
+            self.journal.close()
+        if self.work_item_store is not None:
+            self.work_item_store.close()
+        if self.job_store is not None:
+            self.job_store.close_job()
+            self.job_store.close()
+
+    def request_drain(self, grace_seconds: float) -> None:
+        # Called from a signal handler: only flags are set here
+        self.drain_requested = True
+        if self.worker is not None:
+            self.worker.request_drain(grace_seconds)
+        if isinstance(self.open_document, PartitionedPPTDocument):
+            self.open_document.request_drain()
+
+    def is_draining(self) -> bool:
+        return self.drain_requested
 
-    def emergency_save(self):
-        emergency_file_name = f'{self.to_document}-emergency-saved'
-        self.logger.log_warn(f'Trying to emergency save the filw to {emergency_file_name}')
-        self.open_document.save(emergency_file_name)
+    def get_partial_document_name(self, to_document: str = None) -> str:
+        path: Path = Path(to_document or self.to_document)
+        return str(path.with_name(f'{path.stem}-partial{path.suffix}'))
 
+    def save_partial(self, open_document: IOpenDocument = None, to_document: str = None, journal: CheckpointJournal = None):
+        partial_file_name: str = self.get_partial_document_name(to_document)
+        open_document = open_document or self.open_document
+        journal = journal or self.journal
+        self.logger.log_warn(f'Saving the partially processed document to {partial_file_name}')
+        open_document.save(partial_file_name)
+        if journal is not None:
+            journal.close()
+            self.logger.log_warn(f'Run again with --resume to complete the document from the journal {journal.journal_path}')
@@ -0,0 +1,85 @@
+import os
+import socket
+import time
+from typing import Dict
+
+from domain.llm_endpoint_request import LLMEndpointRequest
+from domain.iml_access import IMLAccess
+from domain.segmenter import TokenBudgetSegmenter
+from infrastructure.distributed import JobStoreWorker
+from infrastructure.job_store import JobStore
+from infrastructure.generic_logger import GenericLogger
+from infrastructure.openai_access import OpenAIAccess
+from infrastructure.openai_debug_access import OpenAIDebugAccess
+
+class WorkerService:
+    WAIT_FOR_JOB_SECONDS: float = 5.0
+
+    def __init__(self,
+                 job_store_path: str,
+                 logger: GenericLogger,
+                 engine_name: str = None,
+                 use_debugger_ai: bool = False,
+                 max_parallel_thread: int = 1,
+                 lease_seconds: float = 120,
+                 exit_when_idle: bool = False,
+                 worker_id: str = None):
+        self.logger: GenericLogger = logger
+        self.job_store_path: str = job_store_path
+        self.engine_name: str = engine_name
+        self.use_debugger_ai: bool = use_debugger_ai
+        self.max_parallel_thread: int = max_parallel_thread
+        self.lease_seconds: float = lease_seconds
+        self.exit_when_idle: bool = exit_when_idle
+        self.worker_id: str = worker_id if worker_id is not None else f'{socket.gethostname()}-{os.getpid()}'
+        self.stop_requested: bool = False
+        self.worker: JobStoreWorker = None
+
+    def __wait_for_job(self, job_store: JobStore) -> Dict:
+        # A store left over by a previous run is closed or replaced: only an open job is worked on
+        while True:
+            job_configuration: Dict = job_store.get_job_configuration() if os.path.exists(self.job_store_path) else None
+            if job_configuration is not None:
+                return job_configuration
+            if self.stop_requested:
+                self.logger.log_warn(f"Request to stop worker {self.worker_id}: exiting before a job was found")
+                return None
+            if self.exit_when_idle:
+                return None
+            self.logger.log_info(f"Waiting for the coordinator to open a job in the job store {self.job_store_path}")
+            time.sleep(self.WAIT_FOR_JOB_SECONDS)
+
+    def __create_llm_request(self, job_configuration: Dict) -> LLMEndpointRequest:
+        engine_name: str = self.engine_name if self.engine_name is not None else job_configuration["engine"]
+        use_debugger_ai: bool = self.use_debugger_ai or job_configuration["use_debugger_ai"]
+        mlaccess: IMLAccess = OpenAIAccess(self.logger, engine_name) if not use_debugger_ai else OpenAIDebugAccess(self.logger)
+        llm_request: LLMEndpointRequest = LLMEndpointRequest(mlaccess, job_configuration["how_to_transform"], self.logger)
+        llm_request.temperature = job_configuration["temperature"]
+        llm_request.top_p = job_configuration["top_p"]
+        llm_request.use_segmenter(TokenBudgetSegmenter(job_configuration.get("max_request_tokens", TokenBudgetSegmenter.DEFAULT_MAX_REQUEST_TOKENS), self.logger))
+        self.logger.log_info(f"Worker {self.worker_id} using engine {engine_name if not use_debugger_ai else 'debugger ai'}")
+        return llm_request
+
+    def process(self) -> int:
+        job_store: JobStore = JobStore(self.job_store_path, self.logger)
+        job_configuration: Dict = self.__wait_for_job(job_store)
+        if job_configuration is None:
+            if self.stop_requested:
+                return 0
+            self.logger.log_warn(f"No open job found in {self.job_store_path}: nothing to do")
+            return 0
+        llm_request: LLMEndpointRequest = self.__create_llm_request(job_configuration)
+        self.worker = JobStoreWorker(job_store, llm_request, self.logger, self.worker_id,
+                                     self.lease_seconds, self.max_parallel_thread, self.exit_when_idle)
+        if self.stop_requested:
+            return 0
+        return self.worker.run()
+
+    def request_drain(self, grace_seconds: float) -> None:
+        # Requests in flight are completed and posted, their lease expires otherwise and another worker takes them over
+        self.stop_requested = True
+        if self.worker is not None:
+            self.worker.request_stop()
+
+    def is_draining(self) -> bool:
+        return self.stop_requested
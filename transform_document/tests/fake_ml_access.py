@@ -0,0 +1,46 @@
+import json
+import re
+from typing import Dict, List
+
+from domain.iml_access import IMLAccess
+
+
+class UpperCaseAccess(IMLAccess):
+    # Returns the text of the request in upper case, the cells of tables sent as JSON are upper cased in place
+    def __upper(self, value: any) -> any:
+        if isinstance(value, str):
+            return value.upper()
+        if isinstance(value, list):
+            return [self.__upper(item) for item in value]
+        if isinstance(value, dict):
+            return {key: item if key in ("row", "column") else self.__upper(item) for key, item in value.items()}
+        return value
+
+    def try_transform_line(self, text_to_transform: str, how_to_transform: str, temperature: float, top_p: float, response_format: Dict = None) -> str:
+        if response_format is not None:
+            decoder: json.JSONDecoder = json.JSONDecoder()
+            for match in re.finditer(r'[\[{]', text_to_transform):
+                try:
+                    value, end = decoder.raw_decode(text_to_transform, match.start())
+                except ValueError:
+                    continue
+                if text_to_transform[end:].strip() == "":
+                    key: str = "rows" if isinstance(value, list) and all(isinstance(row, list) for row in value) else "cells"
+                    return json.dumps(self.__upper(value) if isinstance(value, dict) else {key: self.__upper(value)})
+        match = None
+        for match in re.finditer(r'\[Process the (?:text|table)[^\]]*\] ', text_to_transform):
+            pass
+        return (text_to_transform[match.end():] if match is not None else text_to_transform).upper()
+
+    def transform_line(self, text_to_transform: str, how_to_transform: str, temperature: float, top_p: float, response_format: Dict = None) -> str:
+        return self.try_transform_line(text_to_transform, how_to_transform, temperature, top_p, response_format)
+
+
+class RecordingAccess(UpperCaseAccess):
+    # Keeps the requests sent to the LLM
+    def __init__(self):
+        self.requests: List[str] = []
+
+    def transform_line(self, text_to_transform: str, how_to_transform: str, temperature: float, top_p: float, response_format: Dict = None) -> str:
+        self.requests.append(text_to_transform)
+        return super().transform_line(text_to_transform, how_to_transform, temperature, top_p, response_format)
@@ -0,0 +1,105 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from domain.llm_endpoint_request import LLMEndpointRequest
+from domain.llm_utils import LLMUtils
+from domain.logger import Logger, LoggerType
+from domain.worker_class import Worker
+from infrastructure.checkpoint_journal import CheckpointJournal
+from infrastructure.open_text_document import OpenTextDocument
+from infrastructure.processors import SerializedDocProcessorType
+from fake_ml_access import RecordingAccess
+
+
+class TestCheckpointJournal(unittest.TestCase):
+    PARAGRAPHS = [f"Paragraph number {index} of the document." for index in range(4)]
+
+    def setUp(self):
+        self.directory: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.logger: Logger = Logger(LoggerType.NONE)
+        self.document_path: str = os.path.join(self.directory.name, "input.txt")
+        self.journal_path: str = os.path.join(self.directory.name, "output.txt.journal")
+        with open(self.document_path, "w") as document_file:
+            document_file.write("\n\n".join(self.PARAGRAPHS) + "\n")
+        self.file_hash: str = CheckpointJournal.compute_file_hash(self.document_path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def __run(self, journal: CheckpointJournal) -> List[str]:
+        """
+        Returns the requests sent to the LLM, the output document is checked to be complete.
+        """
+        ml_access: RecordingAccess = RecordingAccess()
+        how_to_transform: str = LLMUtils("", "English", self.logger).get_request(0)[LLMUtils.HOW_TO_TRANSFORM]
+        worker: Worker = Worker(SerializedDocProcessorType(LLMEndpointRequest(ml_access, how_to_transform, self.logger), self.logger), self.logger)
+        self.assertTrue(worker.use_journal(journal))
+        open_document: OpenTextDocument = OpenTextDocument(self.document_path, worker, 0, 0, self.logger)
+        open_document.process()
+        journal.close()
+        output_path: str = os.path.join(self.directory.name, "output.txt")
+        open_document.save(output_path)
+        with open(output_path) as output_file:
+            self.assertEqual(output_file.read(), "\n\n".join([paragraph.upper() for paragraph in self.PARAGRAPHS]) + "\n")
+        return ml_access.requests
+
+    def __read_entries(self) -> List[str]:
+        with open(self.journal_path) as journal_file:
+            return journal_file.read().splitlines()
+
+    def test_resume_replays_responses_by_fingerprint(self):
+        self.assertEqual(len(self.__run(CheckpointJournal(self.journal_path, self.file_hash, "run", False, self.logger))), len(self.PARAGRAPHS))
+        entries: List[str] = self.__read_entries()
+        self.assertEqual(len(entries), len(self.PARAGRAPHS))
+        # Simulates a run interrupted after its first two responses
+        with open(self.journal_path, "w") as journal_file:
+            journal_file.write("\n".join(entries[0:2]) + "\n")
+        requests: List[str] = self.__run(CheckpointJournal(self.journal_path, self.file_hash, "run", True, self.logger))
+        self.assertEqual(len(requests), 2)
+        self.assertTrue(all(paragraph not in "".join(requests) for paragraph in self.PARAGRAPHS[0:2]))
+        self.assertEqual(len(self.__read_entries()), len(self.PARAGRAPHS))
+
+    def test_truncated_last_line_is_ignored(self):
+        self.__run(CheckpointJournal(self.journal_path, self.file_hash, "run", False, self.logger))
+        entries: List[str] = self.__read_entries()
+        # Killed while writing the third entry
+        with open(self.journal_path, "w") as journal_file:
+            journal_file.write("\n".join(entries[0:2]) + "\n" + entries[2][0:len(entries[2]) // 2])
+        journal: CheckpointJournal = CheckpointJournal(self.journal_path, self.file_hash, "run", True, self.logger)
+        self.assertEqual(len(journal.responses), 2)
+        self.assertEqual(len(self.__run(journal)), 2)
+        # New entries start on their own line after the truncated one
+        entries = self.__read_entries()
+        self.assertEqual(len(entries), 5)
+        self.assertEqual(len([entry for entry in entries if self.__is_json(entry)]), 4)
+
+    @staticmethod
+    def __is_json(entry: str) -> bool:
+        try:
+            json.loads(entry)
+        except json.JSONDecodeError:
+            return False
+        return True
+
+    def test_changed_input_or_run_key_invalidates_entries(self):
+        self.__run(CheckpointJournal(self.journal_path, self.file_hash, "run", False, self.logger))
+        other_run: CheckpointJournal = CheckpointJournal(self.journal_path, self.file_hash, "other run", True, self.logger)
+        self.assertEqual(other_run.responses, {})
+        other_run.close()
+        other_file: CheckpointJournal = CheckpointJournal(self.journal_path, "other hash", "run", True, self.logger)
+        self.assertEqual(other_file.responses, {})
+        other_file.close()
+        self.assertEqual(len(self.__run(CheckpointJournal(self.journal_path, self.file_hash, "other run", True, self.logger))), len(self.PARAGRAPHS))
+        # Without --resume the previous journal is discarded
+        self.assertEqual(len(self.__run(CheckpointJournal(self.journal_path, self.file_hash, "run", False, self.logger))), len(self.PARAGRAPHS))
+        self.assertEqual(len(self.__read_entries()), len(self.PARAGRAPHS))
+
+
+if __name__ == '__main__':
+    unittest.main()
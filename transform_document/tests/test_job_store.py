@@ -0,0 +1,130 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from domain.llm_endpoint_request import LLMEndpointRequest
+from domain.llm_utils import LLMUtils
+from domain.logger import Logger, LoggerType
+from domain.worker_class import Worker
+from infrastructure.distributed import JobStoreCoordinatorProcessorType, JobStoreWorker
+from infrastructure.job_store import JobStore
+from infrastructure.open_text_document import OpenTextDocument
+from fake_ml_access import UpperCaseAccess
+
+
+class TestJobStore(unittest.TestCase):
+    def setUp(self):
+        self.directory: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.logger: Logger = Logger(LoggerType.NONE)
+        self.store_path: str = os.path.join(self.directory.name, "jobs.db")
+        self.how_to_transform: str = LLMUtils("", "English", self.logger).get_request(0)[LLMUtils.HOW_TO_TRANSFORM]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def __create_llm_request(self) -> LLMEndpointRequest:
+        return LLMEndpointRequest(UpperCaseAccess(), self.how_to_transform, self.logger)
+
+    def test_coordinator_and_two_workers(self):
+        document_path: str = os.path.join(self.directory.name, "input.txt")
+        with open(document_path, "w") as document_file:
+            document_file.write("\n\n".join([f"Paragraph number {index} of the document." for index in range(12)]) + "\n")
+        coordinator_store: JobStore = JobStore(self.store_path, self.logger)
+        coordinator_store.create_job({"how_to_transform": self.how_to_transform})
+        processor_type: JobStoreCoordinatorProcessorType = JobStoreCoordinatorProcessorType(self.__create_llm_request(), self.logger, coordinator_store)
+        processor_type.POLL_SECONDS = 0.05
+        open_document: OpenTextDocument = OpenTextDocument(document_path, Worker(processor_type, self.logger), 0, 0, self.logger)
+        workers: List[JobStoreWorker] = []
+        for worker_index in range(2):
+            worker_store: JobStore = JobStore(self.store_path, self.logger)
+            self.assertEqual(worker_store.get_job_configuration(), {"how_to_transform": self.how_to_transform})
+            worker: JobStoreWorker = JobStoreWorker(worker_store, self.__create_llm_request(), self.logger, f"worker-{worker_index}")
+            worker.POLL_SECONDS = 0.05
+            workers.append(worker)
+        threads: List[threading.Thread] = [threading.Thread(target=worker.run) for worker in workers]
+        for thread in threads:
+            thread.start()
+        open_document.process()
+        for thread in threads:
+            thread.join(timeout=10)
+            self.assertFalse(thread.is_alive())
+        output_path: str = os.path.join(self.directory.name, "output.txt")
+        open_document.save(output_path)
+        coordinator_store.close()
+        with open(output_path) as output_file:
+            self.assertEqual(output_file.read(), "\n\n".join([f"PARAGRAPH NUMBER {index} OF THE DOCUMENT." for index in range(12)]) + "\n")
+        self.assertEqual(sum([worker.processed for worker in workers]), 12)
+
+    def test_partial_store_is_not_ready(self):
+        # A store whose tables are not created yet is waited for instead of failing
+        sqlite3.connect(self.store_path).close()
+        worker_store: JobStore = JobStore(self.store_path, self.logger)
+        self.assertIsNone(worker_store.get_job_configuration())
+        connection: sqlite3.Connection = sqlite3.connect(self.store_path)
+        connection.execute("CREATE TABLE job (key TEXT PRIMARY KEY, value TEXT)")
+        connection.commit()
+        connection.close()
+        self.assertIsNone(worker_store.get_job_configuration())
+        worker_store.close()
+
+    def test_stale_store_is_replaced(self):
+        previous_store: JobStore = JobStore(self.store_path, self.logger)
+        previous_store.create_job({"run": 1})
+        previous_store.close_job()
+        worker_store: JobStore = JobStore(self.store_path, self.logger)
+        # A closed job left over by a previous run is not worked on
+        self.assertIsNone(worker_store.get_job_configuration())
+        stale_connection: sqlite3.Connection = sqlite3.connect(self.store_path)
+        coordinator_store: JobStore = JobStore(self.store_path, self.logger)
+        coordinator_store.create_job({"run": 2})
+        self.assertFalse(os.path.exists(f'{self.store_path}.tmp'))
+        # Connections to the previous store keep reading it, new ones read the new job
+        self.assertEqual(stale_connection.execute("SELECT value FROM job WHERE key = 'status'").fetchone()[0], JobStore.JOB_CLOSED)
+        stale_connection.close()
+        self.assertEqual(worker_store.get_job_configuration(), {"run": 2})
+        self.assertFalse(worker_store.is_job_closed())
+        # A worker bound to a job sees it closed once the coordinator replaced it with another job
+        JobStore(self.store_path, self.logger).create_job({"run": 3})
+        self.assertTrue(worker_store.is_job_closed())
+        for job_store in [previous_store, worker_store, coordinator_store]:
+            job_store.close()
+
+    def test_expired_lease_is_claimed_again(self):
+        job_store: JobStore = JobStore(self.store_path, self.logger)
+        job_store.create_job({})
+        job_store.add_items([(0, "request", LLMUtils.DEFAULT_REQUEST)])
+        self.assertEqual(job_store.claim_item("first", 0.05)[0], 0)
+        self.assertIsNone(job_store.claim_item("second", 0.05))
+        time.sleep(0.1)
+        self.assertEqual(job_store.claim_item("second", 60)[0], 0)
+        # The first owner lost its lease: its heartbeat and response are refused
+        self.assertFalse(job_store.heartbeat(0, "first", 60))
+        self.assertFalse(job_store.post_response(0, "first", "late"))
+        self.assertTrue(job_store.heartbeat(0, "second", 60))
+        self.assertTrue(job_store.post_response(0, "second", "response"))
+        self.assertEqual(job_store.get_finished_items(), [(0, JobStore.DONE, "response")])
+        job_store.close()
+
+    def test_failed_item_after_max_attempts(self):
+        job_store: JobStore = JobStore(self.store_path, self.logger)
+        job_store.create_job({})
+        job_store.add_items([(0, "request", LLMUtils.DEFAULT_REQUEST)])
+        for attempt in range(1, JobStoreWorker.MAX_ATTEMPTS + 1):
+            self.assertEqual(job_store.claim_item(f"owner-{attempt}", 60)[0], 0)
+            self.assertTrue(job_store.release_item(0, f"owner-{attempt}", JobStoreWorker.MAX_ATTEMPTS))
+            expected_status: str = JobStore.FAILED if attempt == JobStoreWorker.MAX_ATTEMPTS else JobStore.PENDING
+            self.assertEqual(job_store.get_status_counts(), {expected_status: 1})
+        self.assertIsNone(job_store.claim_item("owner", 60))
+        self.assertEqual(job_store.get_finished_items(), [(0, JobStore.FAILED, None)])
+        job_store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
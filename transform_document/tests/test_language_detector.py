@@ -0,0 +1,54 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from domain.logger import Logger, LoggerType
+from infrastructure.language_detector import LanguageDetector, TargetLanguageFilter
+
+
+class TestTargetLanguageFilter(unittest.TestCase):
+    TRANSLATED = {
+        "english": "The committee reviewed the annual report and decided to postpone the vote until the next meeting because several members were absent.",
+        "german": "Der Ausschuss hat den Jahresbericht geprüft und beschlossen, die Abstimmung bis zur nächsten Sitzung zu verschieben, weil mehrere Mitglieder fehlten.",
+        "spanish": "Los trabajadores deben presentar la solicitud antes del final del mes si quieren recibir la ayuda prevista para este año.",
+        "portuguese": "Os trabalhadores devem apresentar o pedido antes do final do mês se quiserem receber o apoio previsto para este ano.",
+    }
+
+    def setUp(self):
+        self.logger: Logger = Logger(LoggerType.NONE)
+
+    def __is_skipped(self, target_language: str, text: str) -> bool:
+        return not TargetLanguageFilter(target_language, self.logger).classify([text])[0]
+
+    def test_text_in_target_language_is_skipped(self):
+        for language, text in self.TRANSLATED.items():
+            self.assertTrue(self.__is_skipped(language, text), language)
+
+    def test_unsupported_languages_are_sent(self):
+        # Detected as the closest shipped language with a probability close to 1
+        unsupported = [("spanish", "El comitè va revisar l'informe anual i va decidir ajornar la votació fins a la propera reunió perquè diversos membres eren absents."),
+                       ("spanish", "La ciutat té molts carrers estrets i places petites on la gent es troba cada vespre per parlar i prendre alguna cosa."),
+                       ("portuguese", "O concello aprobou onte o novo orzamento municipal despois dunha longa discusión entre os grupos políticos."),
+                       ("italian", "Komitet przejrzał sprawozdanie roczne i postanowił odłożyć głosowanie do następnego posiedzenia, ponieważ kilku członków było nieobecnych."),
+                       ("dutch", "Kommittén granskade årsrapporten och beslutade att skjuta upp omröstningen till nästa möte eftersom flera medlemmar var frånvarande.")]
+        detector: LanguageDetector = LanguageDetector(self.logger)
+        for detected_language, text in unsupported:
+            language, confidence = detector.detect(text)
+            self.assertEqual(language, detected_language)
+            self.assertGreater(confidence, TargetLanguageFilter.DEFAULT_MIN_CONFIDENCE)
+            self.assertFalse(self.__is_skipped(detected_language, text), text)
+
+    def test_mixed_languages_are_sent(self):
+        self.assertFalse(self.__is_skipped("english", "Der Ausschuss hat den Bericht geprüft, but the committee decided to postpone the vote until the next meeting."))
+        self.assertFalse(self.__is_skipped("german", "The committee reviewed the annual report und hat beschlossen, die Abstimmung bis zur nächsten Sitzung zu verschieben."))
+        # Paragraphs of a segment are checked one by one
+        self.assertFalse(self.__is_skipped("english", self.TRANSLATED["english"] + "\n" + self.TRANSLATED["german"]))
+
+    def test_short_text_is_sent(self):
+        self.assertFalse(self.__is_skipped("english", "Revenue grew."))
+
+
+if __name__ == '__main__':
+    unittest.main()
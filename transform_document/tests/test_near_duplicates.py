@@ -0,0 +1,108 @@
+import os
+import sys
+import tempfile
+import unittest
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from domain.llm_endpoint_request import LLMEndpointRequest
+from domain.llm_utils import LLMUtils
+from domain.logger import Logger, LoggerType
+from domain.near_duplicates import MinHashIndex, TokenPatch
+from domain.worker_class import Worker
+from infrastructure.open_text_document import OpenTextDocument
+from infrastructure.processors import SerializedDocProcessorType
+from fake_ml_access import RecordingAccess
+
+
+class TestMinHashIndex(unittest.TestCase):
+    BOILERPLATE = "The {} module stores the settings of the application in a local file and reloads them at every start of the service."
+
+    def setUp(self):
+        self.index: MinHashIndex = MinHashIndex(Logger(LoggerType.NONE))
+
+    def test_near_duplicates_are_grouped_with_their_leader(self):
+        texts: List[str] = [self.BOILERPLATE.format("billing"),
+                            "A completely different paragraph about the weather forecast for the coming weekend in the mountains.",
+                            self.BOILERPLATE.format("shipping"),
+                            self.BOILERPLATE.format("invoicing")]
+        self.assertEqual(self.index.find_leaders(texts), [None, None, 0, 0])
+        self.assertEqual((self.index.checked, self.index.near_duplicates, self.index.groups), (4, 2, 1))
+
+    def test_similarity_below_the_threshold_is_not_grouped(self):
+        words: List[str] = [f"word{index}" for index in range(20)]
+        # 18 of the 19 word pairs are shared: Jaccard similarity 18 / 20
+        texts: List[str] = [" ".join(words), " ".join(words[:-1] + ["other"])]
+        self.assertEqual(self.index.find_leaders(texts), [None, 0])
+        self.assertEqual(MinHashIndex(Logger(LoggerType.NONE), 0.95).find_leaders(texts), [None, None])
+        # 4 of the 9 word pairs are shared: Jaccard similarity 4 / 14
+        self.assertEqual(self.index.find_leaders(["one two three four five six seven eight nine ten",
+                                                  "one two three four five alpha beta gamma delta epsilon"]), [None, None])
+
+    def test_different_kinds_are_never_grouped(self):
+        texts: List[str] = [self.BOILERPLATE.format("billing"), self.BOILERPLATE.format("shipping"), self.BOILERPLATE.format("invoicing")]
+        self.assertEqual(self.index.find_leaders(texts, ["heading", "default", "default"]), [None, None, 1])
+
+    def test_grouping_is_repeatable(self):
+        texts: List[str] = [self.BOILERPLATE.format(f"module{index}") for index in range(5)]
+        self.assertEqual(self.index.find_leaders(texts), MinHashIndex(Logger(LoggerType.NONE)).find_leaders(texts))
+
+
+class TestTokenPatch(unittest.TestCase):
+    def test_response_is_patched_when_differing_tokens_are_found_in_it(self):
+        substitutions = TokenPatch.get_substitutions("Install Acme 3 on the server.", "Install Zenith 4 on the server.")
+        self.assertEqual(substitutions, {"Acme": "Zenith", "3": "4"})
+        self.assertEqual(TokenPatch.apply("Install Acme 3 on the server.", "Installez Acme 3 sur le serveur.", substitutions),
+                         "Installez Zenith 4 sur le serveur.")
+
+    def test_response_is_not_reused_when_a_differing_token_is_missing(self):
+        leader_text: str = "The meeting starts on Monday."
+        substitutions = TokenPatch.get_substitutions(leader_text, "The meeting starts on Tuesday.")
+        self.assertEqual(substitutions, {"Monday": "Tuesday"})
+        # The token was translated by the LLM: patching would leave the response of the leader as is
+        self.assertIsNone(TokenPatch.apply(leader_text, "La réunion commence lundi.", substitutions))
+        # Found a different number of times than in the leader: which occurrence to patch is ambiguous
+        self.assertIsNone(TokenPatch.apply(leader_text, "Monday: la réunion commence Monday.", substitutions))
+        # Part of a longer word only is not a match
+        self.assertIsNone(TokenPatch.apply(leader_text, "La réunion commence Mondays.", substitutions))
+
+    def test_texts_differing_otherwise_are_not_patched(self):
+        self.assertIsNone(TokenPatch.get_substitutions("Install Acme on the server.", "Install Acme on the new server."))
+        self.assertIsNone(TokenPatch.get_substitutions("a b c d e", "v w x y e"))
+        # The same token of the leader cannot become two different tokens
+        self.assertIsNone(TokenPatch.get_substitutions("red and red", "blue and green"))
+        # Swapped tokens: a replaced token still present in the text would be patched as well
+        self.assertIsNone(TokenPatch.get_substitutions("Acme then Zenith", "Zenith then Acme"))
+        self.assertEqual(TokenPatch.get_substitutions("Same text.", "Same text."), {})
+
+
+class TestNearDuplicateReuse(unittest.TestCase):
+    PARAGRAPH = "Install {} on the server and restart the service once the configuration file of the application is updated."
+
+    def test_leader_response_is_patched_only_when_the_differing_tokens_are_in_it(self):
+        logger: Logger = Logger(LoggerType.NONE)
+        # The fake LLM answers in upper case: numbers are found as is in its responses, words are not
+        paragraphs: List[str] = [self.PARAGRAPH.format("version 3"), self.PARAGRAPH.format("version 4"), self.PARAGRAPH.format("release 3")]
+        with tempfile.TemporaryDirectory() as directory:
+            document_path: str = os.path.join(directory, "input.txt")
+            with open(document_path, "w") as document_file:
+                document_file.write("\n\n".join(paragraphs) + "\n")
+            ml_access: RecordingAccess = RecordingAccess()
+            llm_request: LLMEndpointRequest = LLMEndpointRequest(ml_access, LLMUtils("", "English", logger).get_request(0)[LLMUtils.HOW_TO_TRANSFORM], logger)
+            processor_type: SerializedDocProcessorType = SerializedDocProcessorType(llm_request, logger)
+            open_document: OpenTextDocument = OpenTextDocument(document_path, Worker(processor_type, logger), 0, 0, logger)
+            open_document.use_near_duplicate_index(MinHashIndex(logger))
+            open_document.process()
+            output_path: str = os.path.join(directory, "output.txt")
+            open_document.save(output_path)
+            with open(output_path) as output_file:
+                self.assertEqual(output_file.read(), "\n\n".join([paragraph.upper() for paragraph in paragraphs]) + "\n")
+        # Only the leader and the paragraph whose differing word is missing from the leader response are sent
+        self.assertEqual(len(ml_access.requests), 2)
+        self.assertIn("For consistency, a nearly identical text was processed before", ml_access.requests[1])
+        self.assertIn("release 3", ml_access.requests[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import sys
+import tempfile
+import unittest
+from typing import List
+
+from docx import Document
+from docx.text.paragraph import Paragraph
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from domain.llm_endpoint_request import LLMEndpointRequest
+from domain.llm_utils import LLMUtils
+from domain.worker_class import Worker
+from infrastructure.processors import SerializedDocProcessorType
+from domain.logger import Logger, LoggerType
+from infrastructure.open_doc_document import OpenDOCDocument
+from fake_ml_access import UpperCaseAccess
+
+
+class TestOpenDOCDocument(unittest.TestCase):
+    def setUp(self):
+        self.directory: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.logger: Logger = Logger(LoggerType.NONE)
+        self.document_path: str = os.path.join(self.directory.name, "input.docx")
+        document: Document = Document()
+        document.add_heading("Introduction words", level=1)
+        document.add_paragraph("Paragraph before the table.")
+        table: any = document.add_table(rows=1, cols=2)
+        table.cell(0, 0).text = "First cell"
+        table.cell(0, 1).text = "Second cell"
+        document.add_paragraph("Paragraph after the table.")
+        document.save(self.document_path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def __transform(self, json_tables: bool) -> List[str]:
+        llm_utils: LLMUtils = LLMUtils("", "English", self.logger)
+        how_to_transform: str = llm_utils.get_request(0)[LLMUtils.HOW_TO_TRANSFORM]
+        worker: Worker = Worker(SerializedDocProcessorType(LLMEndpointRequest(UpperCaseAccess(), how_to_transform, self.logger), self.logger), self.logger)
+        open_document: OpenDOCDocument = OpenDOCDocument(self.document_path, worker, 0, 0, self.logger, json_tables=json_tables)
+        open_document.process()
+        output_path: str = os.path.join(self.directory.name, "output.docx")
+        open_document.save(output_path)
+        # Body items of the output in document order: paragraph texts and tables
+        body_items: List[str] = []
+        document: Document = Document(output_path)
+        for element in document.element.body.iterchildren():
+            if element.tag == OpenDOCDocument.TABLE_TAG:
+                body_items.append("<table>")
+            elif element.tag == OpenDOCDocument.PARAGRAPH_TAG and len(Paragraph(element, document._body).text.strip()) > 0:
+                body_items.append(Paragraph(element, document._body).text.strip())
+        return body_items
+
+    def test_paragraph_after_table_keeps_its_position(self):
+        self.assertEqual(self.__transform(False), ["INTRODUCTION WORDS", "PARAGRAPH BEFORE THE TABLE.", "<table>", "PARAGRAPH AFTER THE TABLE."])
+
+    def test_paragraph_after_json_table_keeps_its_position(self):
+        self.assertEqual(self.__transform(True), ["INTRODUCTION WORDS", "PARAGRAPH BEFORE THE TABLE.", "<table>", "PARAGRAPH AFTER THE TABLE."])
+
+
+if __name__ == '__main__':
+    unittest.main()
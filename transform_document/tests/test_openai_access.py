@@ -0,0 +1,87 @@
+import os
+import sys
+import unittest
+from unittest import mock
+from typing import Dict, List
+
+import httpx
+from openai import APIConnectionError, BadRequestError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+# The shared client of OpenAIAccess is created when the module is imported
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from domain.logger import Logger, LoggerType
+from infrastructure.openai_access import OpenAIAccess
+
+
+class FakeCompletions:
+    # Raises the given errors in turn, then answers with the text of the last message
+    def __init__(self, errors: List[Exception]):
+        self.errors: List[Exception] = errors
+        self.calls: List[Dict] = []
+
+    def create(self, **options) -> any:
+        self.calls.append(options)
+        if len(self.errors) > 0:
+            raise self.errors.pop(0)
+        message: any = type("Message", (), {"content": options["messages"][-1]["content"]})
+        return type("Completion", (), {"choices": [type("Choice", (), {"message": message})]})
+
+
+class FakeClient:
+    def __init__(self, errors: List[Exception]):
+        self.completions: FakeCompletions = FakeCompletions(errors)
+        self.chat: any = type("Chat", (), {"completions": self.completions})
+
+
+def create_bad_request(message: str) -> BadRequestError:
+    request: httpx.Request = httpx.Request("POST", "http://localhost/v1/chat/completions")
+    return BadRequestError(message, response=httpx.Response(400, request=request), body=None)
+
+
+class TestOpenAIAccess(unittest.TestCase):
+    def setUp(self):
+        self.access: OpenAIAccess = OpenAIAccess(Logger(LoggerType.NONE))
+        self.sleeps: List[float] = []
+        sleep_patch: any = mock.patch("infrastructure.openai_access.time.sleep", self.sleeps.append)
+        sleep_patch.start()
+        self.addCleanup(sleep_patch.stop)
+
+    def __use_client(self, errors: List[Exception]) -> FakeCompletions:
+        client: FakeClient = FakeClient(errors)
+        self.access.client = client
+        return client.completions
+
+    def test_context_length_error_is_not_retried(self):
+        completions: FakeCompletions = self.__use_client([create_bad_request("This model's maximum context length is 8192 tokens (context_length_exceeded)")])
+        with self.assertRaises(BadRequestError):
+            self.access.transform_line("text", [], 0.4, 0.3)
+        self.assertEqual(len(completions.calls), 1)
+        self.assertEqual(self.sleeps, [])
+
+    def test_transient_errors_are_retried_a_bounded_number_of_times(self):
+        request: httpx.Request = httpx.Request("POST", "http://localhost/v1/chat/completions")
+        completions: FakeCompletions = self.__use_client([APIConnectionError(request=request) for _ in range(2)])
+        self.assertTrue(self.access.transform_line("text", [], 0.4, 0.3).endswith("text"))
+        self.assertEqual(self.sleeps, [10, 20])
+        completions = self.__use_client([APIConnectionError(request=request) for _ in range(OpenAIAccess.MAX_ATTEMPTS)])
+        with self.assertRaises(APIConnectionError):
+            self.access.transform_line("text", [], 0.4, 0.3)
+        self.assertEqual(len(completions.calls), OpenAIAccess.MAX_ATTEMPTS)
+
+    def test_rejected_response_format_is_retried_with_the_same_messages(self):
+        completions: FakeCompletions = self.__use_client([create_bad_request("Invalid parameter: 'response_format' of type 'json_schema' is not supported")])
+        how_to_transform: List[Dict] = [{"role": "system", "content": "Fix the grammar"}]
+        self.access.transform_line("text", how_to_transform, 0.4, 0.3, {"type": "json_object"})
+        self.assertEqual(how_to_transform, [{"role": "system", "content": "Fix the grammar"}])
+        self.assertEqual(len(completions.calls), 2)
+        self.assertIn("response_format", completions.calls[0])
+        self.assertNotIn("response_format", completions.calls[1])
+        for call in completions.calls:
+            self.assertEqual([message["role"] for message in call["messages"]], ["system", "user"])
+        self.assertEqual(self.sleeps, [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import io
+import os
+import struct
+import sys
+import tempfile
+import unittest
+import zipfile
+import zlib
+from typing import Dict, List
+
+from docx import Document
+from pptx import Presentation
+from pptx.enum.shapes import MSO_SHAPE_TYPE
+from pptx.util import Inches
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from domain.llm_endpoint_request import LLMEndpointRequest
+from domain.llm_utils import LLMUtils
+from domain.logger import Logger, LoggerType
+from domain.worker_class import Worker
+from infrastructure.open_doc_document import OpenDOCDocument
+from infrastructure.open_ppt_document import OpenPPTDocument
+from infrastructure.package_writer import PackageWriter
+from infrastructure.processors import SerializedDocProcessorType
+from fake_ml_access import UpperCaseAccess
+
+
+def create_png(width: int, height: int) -> bytes:
+    def chunk(chunk_type: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+    # Random looking pixels: the image does not shrink when deflated
+    rows: bytes = b"".join(b"\x00" + os.urandom(width * 3) for _ in range(height))
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)) + \
+           chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b"")
+
+
+class TestPackageWriter(unittest.TestCase):
+    def setUp(self):
+        self.directory: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.logger: Logger = Logger(LoggerType.NONE)
+        self.llm_utils: LLMUtils = LLMUtils("", "English", self.logger)
+        self.image: bytes = create_png(64, 64)
+        # Small chunks: the members are copied in several pieces
+        self.chunk_size: int = PackageWriter.COPY_CHUNK_SIZE
+        PackageWriter.COPY_CHUNK_SIZE = 1024
+
+    def tearDown(self):
+        PackageWriter.COPY_CHUNK_SIZE = self.chunk_size
+        self.directory.cleanup()
+
+    def __create_worker(self) -> Worker:
+        how_to_transform: str = self.llm_utils.get_request(0)[LLMUtils.HOW_TO_TRANSFORM]
+        return Worker(SerializedDocProcessorType(LLMEndpointRequest(UpperCaseAccess(), how_to_transform, self.logger), self.logger), self.logger)
+
+    def __check_package(self, source_path: str, output_path: str, modified_parts: List) -> None:
+        self.assertTrue(PackageWriter(source_path, self.logger).save(modified_parts, output_path))
+        self.assertFalse(os.path.exists(f"{output_path}.tmp"))
+        modified_members: List[str] = list(PackageWriter.get_members(modified_parts).keys())
+        with zipfile.ZipFile(source_path) as source, zipfile.ZipFile(output_path) as output:
+            self.assertIsNone(output.testzip())
+            self.assertEqual(output.namelist(), source.namelist())
+            media: Dict[str, bytes] = {name: output.read(name) for name in output.namelist() if name.endswith(".png")}
+            self.assertEqual(list(media.values()), [self.image])
+            for info in source.infolist():
+                if info.filename not in modified_members:
+                    self.assertEqual(output.read(info.filename), source.read(info.filename), info.filename)
+                    self.assertEqual(output.getinfo(info.filename).compress_type, info.compress_type)
+
+    def test_word_document_with_image(self):
+        source_path: str = os.path.join(self.directory.name, "input.docx")
+        document: Document = Document()
+        # The paragraphs of the body are rewritten: the image is in the page header, a part copied as is
+        document.sections[0].header.paragraphs[0].add_run().add_picture(io.BytesIO(self.image))
+        document.add_paragraph("Paragraph of the body.")
+        document.add_paragraph("Last paragraph of the body.")
+        document.save(source_path)
+        open_document: OpenDOCDocument = OpenDOCDocument(source_path, self.__create_worker(), 0, 0, self.logger)
+        open_document.process()
+        output_path: str = os.path.join(self.directory.name, "output.docx")
+        self.__check_package(source_path, output_path, list(open_document.modified_parts.values()))
+        saved: Document = Document(output_path)
+        self.assertEqual([paragraph.text.strip() for paragraph in saved.paragraphs if len(paragraph.text) > 0],
+                         ["PARAGRAPH OF THE BODY.", "LAST PARAGRAPH OF THE BODY."])
+        self.assertEqual(len(saved.sections[0].header.paragraphs[0]._p.xpath('.//pic:pic')), 1)
+
+    def test_presentation_with_image(self):
+        source_path: str = os.path.join(self.directory.name, "input.pptx")
+        presentation: Presentation = Presentation()
+        slide: any = presentation.slides.add_slide(presentation.slide_layouts[1])
+        slide.shapes.title.text = "Slide title"
+        slide.placeholders[1].text = "Text of the slide body."
+        slide.shapes.add_picture(io.BytesIO(self.image), Inches(1), Inches(1))
+        presentation.save(source_path)
+        open_document: OpenPPTDocument = OpenPPTDocument(source_path, self.__create_worker(), 0, 0, [], [], self.logger, self.llm_utils)
+        open_document.process()
+        output_path: str = os.path.join(self.directory.name, "output.pptx")
+        self.__check_package(source_path, output_path, list(open_document.modified_parts.values()))
+        saved_slide: any = Presentation(output_path).slides[0]
+        self.assertEqual(saved_slide.placeholders[1].text.strip(), "TEXT OF THE SLIDE BODY.")
+        self.assertEqual([shape.image.blob for shape in saved_slide.shapes if shape.shape_type == MSO_SHAPE_TYPE.PICTURE], [self.image])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import unittest
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from domain.llm_endpoint_request import LLMEndpointRequest
+from domain.llm_utils import LLMUtils
+from domain.logger import Logger, LoggerType
+from domain.segmenter import TokenBudgetSegmenter
+from fake_ml_access import RecordingAccess
+
+
+class TestTokenBudgetSegmenter(unittest.TestCase):
+    def setUp(self):
+        self.logger: Logger = Logger(LoggerType.NONE)
+
+    def test_merged_segments_round_trip(self):
+        texts: List[str] = ["# First heading\nFirst paragraph.", "# Second heading\nSecond paragraph.\nThird line.", "# Third heading"]
+        merged: str = TokenBudgetSegmenter.join_segments(texts)
+        self.assertEqual(TokenBudgetSegmenter.split_segments(merged, len(texts)), texts)
+        # The LLM keeps the marks but may change the spaces around them
+        response: str = merged.replace("[SEGMENT 2]", "  [SEGMENT  2]  ").upper()
+        self.assertEqual(TokenBudgetSegmenter.split_segments(response, len(texts)), [text.upper() for text in texts])
+
+    def test_dropped_segment_mark(self):
+        texts: List[str] = ["First paragraph.", "Second paragraph.", "Third paragraph."]
+        merged: str = TokenBudgetSegmenter.join_segments(texts)
+        self.assertIsNone(TokenBudgetSegmenter.split_segments(merged.replace("[SEGMENT 2]\n", ""), len(texts)))
+        self.assertIsNone(TokenBudgetSegmenter.split_segments(merged.replace("[SEGMENT 3]", "[SEGMENT 2]"), len(texts)))
+
+    def test_split_groups_paragraphs_within_budget(self):
+        segmenter: TokenBudgetSegmenter = TokenBudgetSegmenter(10, self.logger)
+        self.assertEqual(segmenter.split(["a" * 20, "b" * 20, "c" * 20, "d" * 80]), [[0, 1], [2], [3]])
+
+    def test_split_text_on_sentence_boundaries(self):
+        segmenter: TokenBudgetSegmenter = TokenBudgetSegmenter(10, self.logger)
+        text: str = "First sentence is here. Second sentence is here! Third one?\nFourth sentence is here."
+        parts: List[str] = segmenter.split_text(text)
+        self.assertEqual("".join(parts), text)
+        self.assertEqual(parts, ["First sentence is here. ", "Second sentence is here! Third one?\n", "Fourth sentence is here."])
+        # A sentence larger than the budget is split on words
+        long_sentence: str = " ".join(["word"] * 30) + "."
+        parts = segmenter.split_text(long_sentence)
+        self.assertEqual("".join(parts), long_sentence)
+        self.assertTrue(all(segmenter.fits([part]) for part in parts))
+
+    def test_oversized_paragraph_is_sent_in_parts(self):
+        ml_access: RecordingAccess = RecordingAccess()
+        llm_request: LLMEndpointRequest = LLMEndpointRequest(ml_access, LLMUtils("", "English", self.logger).get_request(0)[LLMUtils.HOW_TO_TRANSFORM], self.logger)
+        llm_request.use_segmenter(TokenBudgetSegmenter(30, self.logger))
+        sentences: List[str] = [f"Sentence number {index} of a very long paragraph." for index in range(6)]
+        response: str = llm_request.transform_text("[Considering the context: Heading] [Process the text as per request] " + " ".join(sentences), LLMUtils.DEFAULT_REQUEST)
+        self.assertEqual(response, " ".join(sentences).upper())
+        self.assertGreater(len(ml_access.requests), 1)
+        for request in ml_access.requests:
+            self.assertTrue(request.startswith("[Considering the context: Heading] [Process the text as per request] "))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import sys
+import tempfile
+import unittest
+from typing import Callable, Dict, List
+
+from docx import Document
+from pptx import Presentation
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from domain.llm_endpoint_request import LLMEndpointRequest
+from domain.llm_utils import LLMUtils
+from domain.logger import Logger, LoggerType
+from domain.queue import Metadata
+from domain.worker_class import Worker
+from infrastructure.open_doc_document import OpenDOCDocument
+from infrastructure.open_microsoft_document import IOpenAndUpdateDocument
+from infrastructure.open_ppt_document import OpenPPTDocument
+from infrastructure.processors import SerializedDocProcessorType
+from infrastructure.sqlite_queue import SQLiteQueue
+from fake_ml_access import UpperCaseAccess
+
+
+class TestSQLiteQueue(unittest.TestCase):
+    def setUp(self):
+        self.directory: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.logger: Logger = Logger(LoggerType.NONE)
+        self.llm_utils: LLMUtils = LLMUtils("", "English", self.logger)
+        self.store_path: str = os.path.join(self.directory.name, "work_items.db")
+        self.records: List[Dict] = []
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def __create_worker(self) -> Worker:
+        how_to_transform: str = self.llm_utils.get_request(0)[LLMUtils.HOW_TO_TRANSFORM]
+        return Worker(SerializedDocProcessorType(LLMEndpointRequest(UpperCaseAccess(), how_to_transform, self.logger), self.logger), self.logger)
+
+    def __recording_factory(self, open_document: IOpenAndUpdateDocument) -> Callable[[Dict], Metadata]:
+        def metadata_factory(record: Dict) -> Metadata:
+            self.records.append(record)
+            return open_document.metadata_from_record(record)
+        return metadata_factory
+
+    def __process_through_store(self, open_document: IOpenAndUpdateDocument, worker: Worker, output_name: str) -> str:
+        work_item_store: SQLiteQueue = SQLiteQueue(self.store_path, self.__recording_factory(open_document), self.logger)
+        self.assertTrue(worker.use_queue(work_item_store))
+        open_document.process()
+        self.assertTrue(work_item_store.is_empty())
+        work_item_store.close()
+        self.assertFalse(os.path.exists(self.store_path))
+        output_path: str = os.path.join(self.directory.name, output_name)
+        open_document.save(output_path)
+        return output_path
+
+    def test_spilled_records_are_written_back_to_paragraphs_and_table_cells(self):
+        source_path: str = os.path.join(self.directory.name, "input.docx")
+        document: Document = Document()
+        document.add_heading("Introduction words", level=1)
+        document.add_paragraph("Paragraph before the table.")
+        table: any = document.add_table(rows=2, cols=2)
+        for row_id in range(2):
+            for col_id in range(2):
+                table.cell(row_id, col_id).text = f"Cell {row_id} {col_id}"
+        document.add_paragraph("Paragraph after the table.")
+        document.save(source_path)
+        worker: Worker = self.__create_worker()
+        output_path: str = self.__process_through_store(OpenDOCDocument(source_path, worker, 0, 0, self.logger), worker, "output.docx")
+        # Every element went through the store: nothing but its record was kept in memory
+        self.assertEqual([record["request_type"] for record in self.records],
+                         [LLMUtils.DEFAULT_REQUEST, LLMUtils.TABLE_REQUEST, LLMUtils.DEFAULT_REQUEST])
+        self.assertEqual([list(record["locator"].keys())[0] for record in self.records], ["paragraphs", "table", "paragraphs"])
+        saved: Document = Document(output_path)
+        self.assertEqual([paragraph.text.strip() for paragraph in saved.paragraphs if len(paragraph.text.strip()) > 0],
+                         ["INTRODUCTION WORDS", "PARAGRAPH BEFORE THE TABLE.", "PARAGRAPH AFTER THE TABLE."])
+        self.assertEqual([[cell.text.strip() for cell in row.cells] for row in saved.tables[0].rows],
+                         [["CELL 0 0", "CELL 0 1"], ["CELL 1 0", "CELL 1 1"]])
+
+    def test_spilled_records_are_written_back_to_their_slide(self):
+        source_path: str = os.path.join(self.directory.name, "input.pptx")
+        presentation: Presentation = Presentation()
+        for slide_index in range(3):
+            slide: any = presentation.slides.add_slide(presentation.slide_layouts[1])
+            slide.shapes.title.text = f"Title of slide {slide_index}"
+            slide.placeholders[1].text = f"Body text of slide number {slide_index}."
+        presentation.save(source_path)
+        worker: Worker = self.__create_worker()
+        open_document: OpenPPTDocument = OpenPPTDocument(source_path, worker, 0, 0, [], [], self.logger, self.llm_utils)
+        output_path: str = self.__process_through_store(open_document, worker, "output.pptx")
+        # The title and the body of each slide are resolved again from the slide and shape of their locator
+        self.assertEqual([record["locator"]["slide"] for record in self.records], [0, 0, 1, 1, 2, 2])
+        saved: Presentation = Presentation(output_path)
+        for slide_index, slide in enumerate(saved.slides):
+            self.assertEqual(slide.shapes.title.text.strip(), f"TITLE OF SLIDE {slide_index}")
+            self.assertEqual(slide.placeholders[1].text.strip(), f"BODY TEXT OF SLIDE NUMBER {slide_index}.")
+
+
+if __name__ == '__main__':
+    unittest.main()
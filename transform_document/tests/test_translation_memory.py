@@ -0,0 +1,86 @@
+import os
+import sys
+import tempfile
+import unittest
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from domain.llm_endpoint_request import LLMEndpointRequest
+from domain.llm_utils import LLMUtils
+from domain.logger import Logger, LoggerType
+from domain.sentence_alignment import SentenceAlignment
+from infrastructure.translation_memory import TranslationMemory
+from fake_ml_access import RecordingAccess
+
+
+class MergingAccess(RecordingAccess):
+    # Joins the sentences of its responses: the sentences of the request and of the response no longer match
+    def transform_line(self, text_to_transform: str, how_to_transform: str, temperature: float, top_p: float, response_format: Dict = None) -> str:
+        return super().transform_line(text_to_transform, how_to_transform, temperature, top_p, response_format).replace(". ", ", ")
+
+
+class TestSentenceAlignment(unittest.TestCase):
+    def test_sentences_are_paired_line_by_line(self):
+        self.assertEqual(SentenceAlignment.align("First one. Second one!\n\nThird  one?", "Erste. Zweite!\nDritte?"),
+                         [("First one.", "Erste."), ("Second one!", "Zweite!"), ("Third one?", "Dritte?")])
+
+    def test_different_sentence_counts_are_not_paired(self):
+        self.assertEqual(SentenceAlignment.align("First one. Second one.", "Erste und zweite."), [])
+        self.assertEqual(SentenceAlignment.align("First one.\nSecond one.", "Erste. Zweite."), [])
+        # Same number of sentences but not on the same lines
+        self.assertEqual(SentenceAlignment.align("First one. Second one.\nThird one.", "Erste.\nZweite. Dritte."), [])
+
+
+class TestTranslationMemory(unittest.TestCase):
+    INSTRUCTION = "[Considering the context: Heading] [Process the text as per request] "
+
+    def setUp(self):
+        self.directory: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.logger: Logger = Logger(LoggerType.NONE)
+        self.memory_path: str = os.path.join(self.directory.name, "memory.db")
+        self.how_to_transform: str = LLMUtils("", "English", self.logger).get_request(0)[LLMUtils.HOW_TO_TRANSFORM]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def __transform(self, ml_access: RecordingAccess, text: str) -> str:
+        llm_request: LLMEndpointRequest = LLMEndpointRequest(ml_access, self.how_to_transform, self.logger)
+        llm_request.use_translation_memory(TranslationMemory(self.memory_path, "run", self.logger))
+        return llm_request.transform_text(f"{self.INSTRUCTION}{text}", LLMUtils.DEFAULT_REQUEST)
+
+    def test_known_sentences_are_not_requested_again(self):
+        self.assertEqual(self.__transform(RecordingAccess(), "First sentence. Second sentence."), "FIRST SENTENCE. SECOND SENTENCE.")
+        ml_access: RecordingAccess = RecordingAccess()
+        self.assertEqual(self.__transform(ml_access, "Second sentence. Third sentence.\nFirst sentence."),
+                         "SECOND SENTENCE. THIRD SENTENCE.\nFIRST SENTENCE.")
+        self.assertEqual(len(ml_access.requests), 1)
+        # Only the new sentence is requested, the known ones are given as context
+        self.assertTrue(ml_access.requests[0].endswith('{"1": "Third sentence."}'))
+        self.assertIn('"First sentence.": "FIRST SENTENCE."', ml_access.requests[0])
+        ml_access = RecordingAccess()
+        self.assertEqual(self.__transform(ml_access, "Third sentence. First sentence."), "THIRD SENTENCE. FIRST SENTENCE.")
+        self.assertEqual(ml_access.requests, [])
+
+    def test_response_with_other_sentence_count_is_not_stored(self):
+        text: str = "First sentence. Second sentence."
+        # The whole response is kept, but no sentence pair can be told apart
+        self.assertEqual(self.__transform(MergingAccess(), text), "FIRST SENTENCE, SECOND SENTENCE.")
+        self.assertEqual(TranslationMemory(self.memory_path, "run", self.logger).get_translations(SentenceAlignment.get_sentences(text)), {})
+        ml_access: RecordingAccess = RecordingAccess()
+        self.assertEqual(self.__transform(ml_access, text), "FIRST SENTENCE. SECOND SENTENCE.")
+        self.assertEqual(ml_access.requests, [f"{self.INSTRUCTION}{text}"])
+
+    def test_lookup_of_more_keys_than_sqlite_variables(self):
+        translation_memory: TranslationMemory = TranslationMemory(self.memory_path, "run", self.logger)
+        pairs: List[Tuple[str, str]] = [(f"Sentence number {index}.", f"SENTENCE NUMBER {index}.") for index in range(2500)]
+        translation_memory.store(pairs)
+        unknown: List[str] = [f"Unknown sentence {index}." for index in range(500)]
+        # More keys than the 999 variables older SQLite versions accept in one statement
+        translations: Dict[str, str] = translation_memory.get_translations([source for source, _ in pairs] + unknown)
+        self.assertEqual(translations, dict(pairs))
+        self.assertEqual(TranslationMemory(self.memory_path, "other run", self.logger).get_translations([source for source, _ in pairs]), {})
+
+
+if __name__ == '__main__':
+    unittest.main()